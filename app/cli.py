@@ -0,0 +1,259 @@
+"""Command line transcription of directories or manifests of recordings, without streamlit
+
+Run from the repository root:
+
+    python app/cli.py recordings/ --model large-v2 --formats vtt,docx
+    python app/cli.py --manifest overnight.txt --model vosk-small --workers 4
+
+Transcripts are written next to each recording (or into --output-dir). Every finished file
+is appended to a journal, so an interrupted run picks up where it stopped when restarted.
+"""
+from concurrent.futures import as_completed
+from pathlib import Path
+import argparse
+import json
+import os
+import sys
+import time
+
+from converters import formats
+from transcribers import audio, batch, library, metrics, resegment
+
+MODELS = ['tiny', 'base', 'small', 'medium', 'large', 'large-v2', 'large-v3',
+          'vosk-small', 'vosk-large']
+
+EXPORTS = ['vtt', 'srt', 'txt', 'docx', 'pdf', 'lrc', 'tsv', 'json']
+
+# extensions picked up when walking a directory
+MEDIA_EXTENSIONS = {'.aac', '.flac', '.m4a', '.mkv', '.mov', '.mp3', '.mp4', '.ogg', '.opus',
+                    '.wav', '.webm', '.wma'}
+
+JOURNAL_NAME = '.transcription-journal.jsonl'
+
+# the same model naming as the webapps
+def model_name(model: str, eo: str) -> str:
+    """Returns the model to load, the english-only variant when there is one"""
+    if eo == 'yes' and model.split('-')[0] not in ('large', 'vosk'):
+        return model + '.en'
+    return model
+
+# gather the recordings to transcribe
+def find_inputs(paths, manifest=None) -> list:
+    """Returns the media files under the given paths and listed in the manifest, sorted"""
+    found = set()
+    for path in map(Path, paths):
+        if path.is_dir():
+            found.update(p for p in path.rglob('*')
+                         if p.is_file() and p.suffix.lower() in MEDIA_EXTENSIONS)
+        elif path.is_file():
+            found.add(path)
+        else:
+            print(f"skipping {path}: not found", file=sys.stderr)
+
+    # a manifest lists one path per line, relative to the manifest, '#' starts a comment
+    if manifest is not None:
+        manifest = Path(manifest)
+        with open(manifest, encoding='utf-8') as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip()
+                if line:
+                    found.add(manifest.parent.joinpath(line))
+
+    return sorted(p.resolve() for p in found)
+
+# the journal remembers finished files across runs
+def _fingerprint(path: Path) -> dict:
+    """Returns what identifies a version of a file in the journal"""
+    stat = path.stat()
+    return {'path': str(path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+def read_journal(journal: Path) -> set:
+    """Returns the (path, size, mtime) of the files the journal records as done"""
+    done = set()
+    if not journal.exists():
+        return done
+    with open(journal, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # the last line is cut short when a run is killed mid-write
+                continue
+            if entry.get('status') == 'done':
+                done.add((entry['path'], entry['size'], entry['mtime']))
+    return done
+
+def append_journal(journal: Path, entry: dict) -> None:
+    """Appends one entry and flushes it to disk before the next file is reported"""
+    with open(journal, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+# subtitle formats whose captions --reflow rebuilds
+SUBTITLES = ('vtt', 'srt')
+
+# where each recording's transcripts go
+def output_stems(inputs, output_dir=None) -> dict:
+    """Returns {recording: path of its transcripts without the extension}
+
+    under output_dir the recordings keep their directories relative to the folder holding
+    them all, so a/x.mp3 and b/x.mp3 don't overwrite each other. Recordings of one directory
+    sharing a stem (x.mp3 and x.wav) keep their extension in the name, x.mp3.vtt
+    """
+    if not inputs:
+        return {}
+    root = Path(os.path.commonpath([str(path.parent) for path in inputs]))
+    directories = {path: (Path(output_dir).joinpath(path.parent.relative_to(root))
+                          if output_dir else path.parent) for path in inputs}
+    stems = {}
+    for path, directory in directories.items():
+        key = (directory, path.stem.lower())
+        stems[key] = stems.get(key, 0) + 1
+    return {path: directory.joinpath(path.name if stems[(directory, path.stem.lower())] > 1
+                                     else path.stem)
+            for path, directory in directories.items()}
+
+# write every requested format for one recording
+def export(transcript, target: Path, exports, ts: str, layout=None) -> list:
+    """Writes the transcript in each format next to target and returns the written paths
+
+    layout holds resegment() limits, the subtitle formats are reflowed with them when given
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    transcript_file = target.parent.joinpath(target.name + '.vtt')
+
+    captions = transcript
+    if layout is not None and set(exports) & set(SUBTITLES):
+        captions = resegment.resegment(transcript, **layout)
+    return [formats.export(transcript_file, captions if extension in SUBTITLES else transcript,
+                           extension, ts) for extension in exports]
+
+def run(args) -> int:
+    """Transcribes every pending input and returns the number of files that failed"""
+    inputs = find_inputs(args.paths, args.manifest)
+    journal = Path(args.journal) if args.journal else Path(
+        args.output_dir or (args.paths[0] if args.paths and Path(args.paths[0]).is_dir()
+                            else '.')).joinpath(JOURNAL_NAME)
+    done = read_journal(journal)
+
+    pending = []
+    for path in inputs:
+        fingerprint = _fingerprint(path)
+        if (fingerprint['path'], fingerprint['size'], fingerprint['mtime']) in done:
+            continue
+        pending.append((path, fingerprint))
+    print(f"{len(inputs)} files, {len(inputs) - len(pending)} already done, "
+          f"{len(pending)} to transcribe", file=sys.stderr)
+    if not pending:
+        return 0
+
+    targets = output_stems(inputs, args.output_dir)
+    model = model_name(args.model, args.eo)
+    workers, cpu_threads = batch.plan_workers(args.workers, args.threads)
+    # every worker process keeps its model loaded for the whole run
+    pool = batch.get_pool(workers, cpu_threads)
+
+    futures = {pool.submit(batch._transcribe_path, str(path), model, args.eo, args.long_form,
+                           args.diarize, args.draft): (path, fingerprint)
+               for path, fingerprint in pending}
+
+    layout = None
+    if args.reflow:
+        layout = {'max_chars': args.max_chars, 'max_lines': args.max_lines,
+                  'max_duration': args.max_duration, 'max_cps': args.max_cps}
+
+    failed = 0
+    total_audio = total_seconds = 0.0
+    start = time.perf_counter()
+    try:
+        for future in as_completed(futures):
+            path, fingerprint = futures[future]
+            entry = dict(fingerprint, model=model)
+            try:
+                transcript, seconds = future.result()
+                duration = transcript.duration or audio.probe_duration(path) or 0.0
+                export(transcript, targets[path], args.formats, args.ts, layout)
+            except Exception as e:
+                failed += 1
+                append_journal(journal, dict(entry, status='failed', error=str(e)))
+                print(f"FAILED {path}: {e}", file=sys.stderr)
+                continue
+
+            # the transcripts are written, a library problem only costs the search entry
+            try:
+                library.add(transcript, path.name, model=model)
+            except Exception as e:
+                metrics.inc('transcriber_index_errors_total')
+                print(f"{path.name}: not added to the library: {e}", file=sys.stderr)
+
+            rtf = seconds / duration if duration else None
+            total_audio += duration
+            total_seconds += seconds
+            append_journal(journal, dict(entry, status='done', duration=duration,
+                                         seconds=round(seconds, 3), rtf=rtf))
+            rtf_text = f"{rtf:.3f}" if rtf is not None else 'n/a'
+            print(f"{path.name}: {duration:.1f} s of audio in {seconds:.1f} s, rtf {rtf_text}")
+    except KeyboardInterrupt:
+        # the journal already holds every finished file, a rerun continues from here
+        print("interrupted, rerun the same command to resume", file=sys.stderr)
+        pool.shutdown(wait=False, cancel_futures=True)
+        return failed + 1
+
+    elapsed = time.perf_counter() - start
+    if total_audio:
+        print(f"{len(pending) - failed} transcribed, {failed} failed, "
+              f"{total_audio / 3600:.2f} h of audio in {elapsed / 60:.1f} min, "
+              f"rtf {total_seconds / total_audio:.3f} per worker, "
+              f"{elapsed / total_audio:.3f} overall", file=sys.stderr)
+    return failed
+
+def parse_args(argv=None):
+    """Parses the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('paths', nargs='*', help='recordings or directories to walk')
+    parser.add_argument('--manifest', help='text file listing one recording per line')
+    parser.add_argument('--model', default='large-v2', choices=MODELS)
+    parser.add_argument('--eo', default='yes', choices=['yes', 'no'],
+                        help='english only, the same as the webapp option')
+    parser.add_argument('--ts', default='yes', choices=['yes', 'no'],
+                        help='include time stamps in the transcripts')
+    parser.add_argument('--formats', default='vtt',
+                        type=lambda value: [v.strip() for v in value.split(',') if v.strip()],
+                        help=f"comma separated export formats out of {','.join(EXPORTS)}")
+    parser.add_argument('--long-form', action='store_true',
+                        help='split recordings on silence and decode the parts in parallel')
+    parser.add_argument('--draft', action='store_true',
+                        help='decode with a small model first and re-decode only the unclear '
+                        'parts with --model, Whisper models only')
+    parser.add_argument('--diarize', action='store_true',
+                        help='label the segments with Speaker 1, Speaker 2...')
+    parser.add_argument('--reflow', action='store_true',
+                        help='rebuild the vtt and srt captions from the word timings')
+    parser.add_argument('--max-chars', type=int, default=resegment.MAX_CHARS,
+                        help='characters per caption line with --reflow')
+    parser.add_argument('--max-lines', type=int, default=resegment.MAX_LINES,
+                        help='lines per caption with --reflow')
+    parser.add_argument('--max-duration', type=float, default=resegment.MAX_DURATION,
+                        help='longest caption in seconds with --reflow')
+    parser.add_argument('--max-cps', type=float, default=resegment.MAX_CPS,
+                        help='reading speed in characters a second with --reflow')
+    parser.add_argument('--output-dir', help='write every transcript here instead of next to '
+                        'its recording')
+    parser.add_argument('--journal', help=f"progress journal, {JOURNAL_NAME} in the first "
+                        "directory or the output directory by default")
+    parser.add_argument('--workers', type=int, default=batch.DEFAULT_WORKERS,
+                        help='files transcribed at once, 0 picks cores / threads')
+    parser.add_argument('--threads', type=int, default=batch.DEFAULT_WORKER_THREADS,
+                        help='CPU threads per worker')
+    args = parser.parse_args(argv)
+
+    if not args.paths and not args.manifest:
+        parser.error('give recordings, directories or a --manifest')
+    unknown = set(args.formats) - set(EXPORTS)
+    if unknown:
+        parser.error(f"unknown formats: {', '.join(sorted(unknown))}")
+    return args
+
+if __name__ == '__main__':
+    sys.exit(1 if run(parse_args()) else 0)
@@ -0,0 +1,122 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePath
+import os
+import struct
+import zlib
+
+from . import formats
+
+# deflate level of the batch downloads, 0 stores every member uncompressed
+LEVEL = int(os.environ.get('TRANSCRIPT_ZIP_LEVEL', '6'))
+
+# members smaller than this are stored, deflating a few hundred bytes saves nothing
+STORE_BELOW = 1024
+
+# formats that are compressed already (pdf page streams, docx is itself a zip)
+PRECOMPRESSED = {'pdf', 'docx'}
+
+# 1980-01-01 00:00, every archive of the same transcripts is byte for byte the same
+DOS_TIME, DOS_DATE = 0, (0 << 9) | (1 << 5) | 1
+
+# bit 11: the member names are utf-8
+UTF8_FLAG = 0x0800
+
+# members compressed at once, bounds the rendered exports held in memory
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+def member_names(names, extension: str) -> list:
+    """Returns the archive name of each upload, its own stem with the export extension
+
+    the same name uploaded twice gets ' (2)', ' (3)'... so no transcript is overwritten
+    """
+    taken = set()
+    # last number given to each stem, so counting resumes rather than restarts
+    counters = {}
+    result = []
+    for name in names:
+        # only the final component, an upload name must not create directories
+        stem = PurePath(name.replace('\\', '/')).stem or 'transcript'
+        candidate = f"{stem}.{extension}"
+        if candidate.lower() in taken:
+            # an upload may itself be named like a numbered duplicate, 'a (2).mp3'
+            count = counters.get(stem.lower(), 1)
+            while candidate.lower() in taken:
+                count += 1
+                candidate = f"{stem} ({count}).{extension}"
+            counters[stem.lower()] = count
+        taken.add(candidate.lower())
+        result.append(candidate)
+    return result
+
+def compress(data: bytes, extension: str, level: int):
+    """Returns (method, crc, compressed data) of one member
+
+    level 0 stores everything, otherwise small and already compressed members are stored
+    and the rest deflated, zlib releases the GIL so members compress in parallel
+    """
+    crc = zlib.crc32(data)
+    if level == 0 or len(data) < STORE_BELOW or extension in PRECOMPRESSED:
+        return 0, crc, data
+    # raw deflate, the zip headers replace zlib's own
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return 8, crc, compressor.compress(data) + compressor.flush()
+
+class ZipStream:
+    """Writes a zip archive member by member into a binary file object, without seeking"""
+
+    def __init__(self, file):
+        self.file = file
+        self.offset = 0
+        self.entries = []
+
+    def _write(self, data: bytes) -> None:
+        self.file.write(data)
+        self.offset += len(data)
+
+    def add(self, name: str, size: int, method: int, crc: int, data: bytes) -> None:
+        """Appends a member whose data is already compressed with method"""
+        if self.offset + len(data) >= 0xFFFFFFFF or size >= 0xFFFFFFFF:
+            raise ValueError('archives over 4 GB are not supported')
+        encoded = name.encode('utf-8')
+        header = struct.pack('<IHHHHHIIIHH', 0x04034b50, 20, UTF8_FLAG, method, DOS_TIME,
+                             DOS_DATE, crc, len(data), size, len(encoded), 0)
+        self.entries.append((encoded, size, method, crc, len(data), self.offset))
+        self._write(header + encoded)
+        self._write(data)
+
+    def close(self) -> None:
+        """Writes the central directory"""
+        start = self.offset
+        for encoded, size, method, crc, compressed, offset in self.entries:
+            self._write(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, 20, 20, UTF8_FLAG, method,
+                                    DOS_TIME, DOS_DATE, crc, compressed, size, len(encoded),
+                                    0, 0, 0, 0, 0o644 << 16, offset) + encoded)
+        self._write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, len(self.entries),
+                                len(self.entries), self.offset - start, start, 0))
+
+def _member(transcript, extension: str, ts: str, level: int):
+    """Renders and compresses one transcript inside a worker thread"""
+    data = formats.render(transcript, extension, ts)
+    return (len(data),) + compress(data, extension, level)
+
+def write_zip(file, transcripts, extension: str, ts: str = 'yes', level: int = LEVEL,
+              workers: int = DEFAULT_WORKERS) -> None:
+    """Exports (name, transcript) pairs into a zip written to file, in the given order
+
+    every export is rendered in memory and compressed on a thread pool, and at most
+    2 * workers of them are held at once
+    """
+    transcripts = list(transcripts)
+    names = member_names([name for name, _ in transcripts], extension)
+    archive = ZipStream(file)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        pending = []
+        for name, (_, transcript) in zip(names, transcripts):
+            pending.append((name, pool.submit(_member, transcript, extension, ts, level)))
+            # members are written in order as soon as the oldest is ready
+            while len(pending) > 2 * workers:
+                done_name, future = pending.pop(0)
+                archive.add(done_name, *future.result())
+        for done_name, future in pending:
+            archive.add(done_name, *future.result())
+    archive.close()
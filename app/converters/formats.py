@@ -0,0 +1,145 @@
+from pathlib import Path
+import io
+import json
+
+# split seconds into whole units once, every format builds its timestamps from these
+def _hmsm(seconds: float):
+    """Returns (hours, minutes, seconds, milliseconds) of a timestamp"""
+    ms = int(round(seconds * 1000))
+    hours, ms = divmod(ms, 3600000)
+    minutes, ms = divmod(ms, 60000)
+    secs, ms = divmod(ms, 1000)
+    return hours, minutes, secs, ms
+
+def vtt_time(seconds: float) -> str:
+    """Formats a timestamp as HH:MM:SS.mmm"""
+    return "%02d:%02d:%02d.%03d" % _hmsm(seconds)
+
+def srt_time(seconds: float) -> str:
+    """Formats a timestamp as HH:MM:SS,mmm"""
+    return "%02d:%02d:%02d,%03d" % _hmsm(seconds)
+
+def lrc_time(seconds: float) -> str:
+    """Formats a timestamp as [MM:SS.xx], minutes keep counting past the hour"""
+    centis = int(round(seconds * 100))
+    minutes, centis = divmod(centis, 6000)
+    return "[%02d:%02d.%02d]" % (minutes, centis // 100, centis % 100)
+
+# cue text is markup in webvtt, a spoken '<' or '&' would start a tag or an entity
+_VTT_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+
+# each writer yields the pieces of the file in one pass over the segments
+def _vtt(transcript, ts):
+    if ts != 'yes':
+        for segment in transcript:
+            yield f"{segment.spoken}\n\n"
+        return
+    yield "WEBVTT\n\n"
+    for i, segment in enumerate(transcript, start=1):
+        text = segment.text.translate(_VTT_ESCAPES)
+        # webvtt marks the speaker with a voice span
+        if segment.speaker:
+            text = f"<v {segment.speaker.translate(_VTT_ESCAPES)}>{text}"
+        yield f"{i}\n{vtt_time(segment.start)} --> {vtt_time(segment.end)}\n{text}\n\n"
+
+def _srt(transcript, ts):
+    for i, segment in enumerate(transcript, start=1):
+        yield (f"{i}\n{srt_time(segment.start)} --> {srt_time(segment.end)}\n"
+               f"{segment.spoken}\n\n")
+
+def _lrc(transcript, ts):
+    for segment in transcript:
+        yield f"{lrc_time(segment.start)}{segment.spoken}\n"
+
+def _tsv(transcript, ts):
+    # integer milliseconds, the layout used by whisper's own tsv writer
+    speakers = any(segment.speaker for segment in transcript)
+    yield "start\tend\ttext\tspeaker\n" if speakers else "start\tend\ttext\n"
+    for segment in transcript:
+        text = segment.text.replace('\t', ' ')
+        if speakers:
+            text += f"\t{segment.speaker or ''}"
+        yield f"{int(round(segment.start * 1000))}\t{int(round(segment.end * 1000))}\t{text}\n"
+
+def _txt(transcript, ts):
+    for segment in transcript:
+        yield f"{segment.spoken}\n"
+
+# strings are quoted by the json module's C encoder; numbers use repr, which json matches
+# for plain floats (a numpy float's repr is np.float64(...), so they are converted first)
+_quote = json.JSONEncoder(ensure_ascii=False).encode
+_WORD = '{"start": %d%s, "end": %d%s, "word": %s}'
+
+# '%d%s' % (ms // 1000, _FRACTIONS[ms % 1000]) is repr(ms / 1000) without the float formatting
+_FRACTIONS = [('.%03d' % ms).rstrip('0') if ms else '.0' for ms in range(1000)]
+
+def _json(transcript, ts):
+    # segments are serialised one at a time so the whole document is never built in memory,
+    # formatted directly rather than through a dict per segment and word
+    yield ('{"language": %s, "duration": %s, "segments": ['
+           % (json.dumps(transcript.language), json.dumps(transcript.duration)))
+    for i, segment in enumerate(transcript):
+        item = '%s{"id": %d, "start": %r, "end": %r, "text": %s' % (
+            ',\n' if i else '\n', i, float(segment.start), float(segment.end),
+            _quote(segment.text))
+        if segment.speaker:
+            item += ', "speaker": ' + _quote(segment.speaker)
+        if segment.words:
+            # word timings are kept in integer milliseconds, see transcript.Words
+            words = segment.words
+            item += ', "words": [%s]' % ', '.join([
+                _WORD % (start // 1000, _FRACTIONS[start % 1000], end // 1000,
+                         _FRACTIONS[end % 1000], _quote(word))
+                for start, end, word in zip(words.starts, words.ends, words.text.split('\n'))])
+        yield item + '}'
+    yield '\n]}\n'
+
+WRITERS = {
+    'vtt': _vtt,
+    'srt': _srt,
+    'lrc': _lrc,
+    'tsv': _tsv,
+    'txt': _txt,
+    'json': _json,
+}
+
+def write(transcript, file, extension: str, ts: str = 'yes') -> None:
+    """Streams the transcript in the given format into a text file object"""
+    file.writelines(WRITERS[extension](transcript, ts))
+
+def convert(transcript_file, transcript, extension, ts='yes'):
+    """Writes the transcript next to transcript_file with the given format's extension"""
+    new_transcript = Path(str(transcript_file.parent.joinpath(transcript_file.stem)) + '.' + extension)
+
+    with open(new_transcript, 'w', encoding='utf-8') as tr:
+        write(transcript, tr, extension, ts)
+
+    return new_transcript
+
+# pdf and docx pull in reportlab and python-docx, they are imported on the first such export
+def export(transcript_file, transcript, extension, ts='yes'):
+    """Writes the transcript in any export format next to transcript_file and returns it"""
+    if extension == 'pdf':
+        from . import vtt2pdf
+        return vtt2pdf.convert(transcript_file, transcript, ts)
+    if extension == 'docx':
+        from . import vtt2docx
+        return vtt2docx.convert(transcript_file, transcript, ts)
+    return convert(transcript_file, transcript, extension, ts)
+
+def render(transcript, extension, ts='yes') -> bytes:
+    """Returns the transcript exported in any format as bytes, without writing a file"""
+    buffer = io.BytesIO()
+    if extension == 'pdf':
+        from . import vtt2pdf
+        vtt2pdf.write(transcript, buffer, ts)
+    elif extension == 'docx':
+        from . import vtt2docx
+        vtt2docx.write(transcript, buffer, ts)
+    else:
+        text = io.TextIOWrapper(buffer, encoding='utf-8')
+        write(transcript, text, extension, ts)
+        # detach so closing the wrapper later doesn't close the buffer
+        text.flush()
+        text.detach()
+    return buffer.getvalue()
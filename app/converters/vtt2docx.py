@@ -1,20 +1,83 @@
 from pathlib import Path
-from docx import Document
+from xml.sax.saxutils import escape
+import io
+import re
+import zipfile
 
-def convert(transcript_file, transcript):
+from .formats import vtt_time
+
+# the parts of a minimal word document, the body is streamed into word/document.xml
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" '
+    'ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-'
+    'officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>')
+
+RELATIONSHIPS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+    'relationships/officeDocument" Target="word/document.xml"/>'
+    '</Relationships>')
+
+DOCUMENT_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+    '<w:body>')
+
+# A4 with 2 cm margins, in twentieths of a point
+DOCUMENT_END = (
+    '<w:sectPr><w:pgSz w:w="11906" w:h="16838"/>'
+    '<w:pgMar w:top="1134" w:right="1134" w:bottom="1134" w:left="1134" w:header="708" '
+    'w:footer="708" w:gutter="0"/></w:sectPr>'
+    '</w:body></w:document>')
+
+# grey, 8 pt, bold timestamps above the text of each segment
+HEADER_RUN = ('<w:r><w:rPr><w:b/><w:color w:val="808080"/><w:sz w:val="16"/></w:rPr>'
+              '<w:t>%s</w:t></w:r>')
+TEXT_RUN = '<w:r><w:t xml:space="preserve">%s</w:t></w:r>'
+
+# characters xml 1.0 doesn't allow, a decoder can emit them on garbled audio
+_INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+def _text(text: str) -> str:
+    return escape(_INVALID_XML.sub('', text))
+
+def _paragraphs(transcript, ts):
+    """Yields the xml of one paragraph per segment"""
+    for i, segment in enumerate(transcript, start=1):
+        header = _text(segment.speaker) if segment.speaker else None
+        if ts == 'yes':
+            header = f"{i}   {vtt_time(segment.start)} --&gt; {vtt_time(segment.end)}"
+            if segment.speaker:
+                header += f"   {_text(segment.speaker)}"
+        if header is not None:
+            yield (f'<w:p>{HEADER_RUN % header}<w:r><w:br/></w:r>'
+                   f'{TEXT_RUN % _text(segment.text)}</w:p>')
+        else:
+            yield f'<w:p>{TEXT_RUN % _text(segment.text)}</w:p>'
+
+def write(transcript, file, ts='yes') -> None:
+    """Writes the transcript as a docx into a binary file object, one paragraph per segment"""
+    with zipfile.ZipFile(file, 'w', compression=zipfile.ZIP_DEFLATED) as package:
+        package.writestr('[Content_Types].xml', CONTENT_TYPES)
+        package.writestr('_rels/.rels', RELATIONSHIPS)
+        # the body is compressed as it is written, the document is never held in memory
+        with package.open('word/document.xml', 'w') as part:
+            with io.TextIOWrapper(part, encoding='utf-8') as body:
+                body.write(DOCUMENT_START)
+                body.writelines(_paragraphs(transcript, ts))
+                body.write(DOCUMENT_END)
+
+def convert(transcript_file, transcript, ts='yes'):
+    """Writes the transcript as a docx next to transcript_file"""
     new_transcript = Path(str(transcript_file.parent.joinpath(transcript_file.stem)) + '.docx')
 
-    document = Document()
-    p = document.add_paragraph()
-        
-    lines = transcript.split('\n')
-    # need to add carrage return for proper formatting
-    for i, line in enumerate(lines):
-        lines[i] = lines[i] + '\n'
-        
-    for line in lines:
-        p.add_run(line)
-        
-    document.save(new_transcript)
+    with open(new_transcript, 'wb') as f:
+        write(transcript, f, ts)
 
     return new_transcript
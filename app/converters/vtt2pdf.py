@@ -1,38 +1,75 @@
-import numpy as np
+from pathlib import Path
 
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.pdfgen import canvas
+from reportlab.lib.colors import grey, black
 from reportlab.lib.pagesizes import A4
-from reportlab.platypus import Paragraph
-from reportlab.platypus import SimpleDocTemplate
+from reportlab.lib.units import cm
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfgen.canvas import Canvas
 
-from pathlib import Path
+from .formats import vtt_time
 
-def convert(transcript_file, transcript):
-    new_transcript = Path(str(transcript_file.parent.joinpath(transcript_file.stem)) + '.pdf')
-    
-    text_width=A4[0] / 2
-    text_height=A4[1] / 2
+MARGIN = 2 * cm
+FONT, FONT_SIZE, LEADING = 'Helvetica', 10, 13
+HEADER_FONT, HEADER_SIZE = 'Helvetica-Bold', 8
+
+# segments are drawn straight onto the page and each page is compressed as it fills; the canvas
+# still keeps every finished page until save(), so memory grows with the compressed document
+class _Writer:
+    """Lays out text blocks top to bottom on A4 pages of a canvas"""
+
+    def __init__(self, file):
+        self.canvas = Canvas(file, pagesize=A4, pageCompression=1)
+        self.width = A4[0] - 2 * MARGIN
+        self.top = A4[1] - MARGIN
+        self.y = self.top
 
-    # creating a pdf object 
-    pdf = SimpleDocTemplate(str(new_transcript))
-    styles = getSampleStyleSheet()
+    def block(self, header, text: str) -> None:
+        """Draws an optional header line and the wrapped text, kept on one page if it fits"""
+        lines = simpleSplit(text, FONT, FONT_SIZE, self.width) or ['']
+        height = (len(lines) + (header is not None)) * LEADING
+        if self.y - height < MARGIN and self.y < self.top:
+            self.page()
 
-    lines = transcript.split('\n')
-    # need to add carrage return for proper formatting
-    for i, line in enumerate(lines):
-        lines[i] = lines[i] + '\n'
-    
-    paragraphs = []
+        if header is not None:
+            self.line(header, HEADER_FONT, HEADER_SIZE, grey)
+        for line in lines:
+            self.line(line, FONT, FONT_SIZE, black)
+        # a blank line between segments
+        self.y -= LEADING / 2
 
-    for i in np.arange(0, len(lines), 3):
-        line = ''.join(lines[i:i+3]).replace('\n','<br/>\n')
-        # line = line.replace('\n','<br/>\n')
+    def line(self, text: str, font: str, size: int, colour) -> None:
+        # blocks taller than a page carry on over the page break
+        if self.y - LEADING < MARGIN:
+            self.page()
+        self.y -= LEADING
+        self.canvas.setFont(font, size)
+        self.canvas.setFillColor(colour)
+        self.canvas.drawString(MARGIN, self.y, text)
 
-        p = Paragraph(line, styles["Normal"])   
-        p.wrapOn(pdf, text_width, text_height)
-        paragraphs.append(p)
+    def page(self) -> None:
+        self.canvas.showPage()
+        self.y = self.top
+
+    def save(self) -> None:
+        self.canvas.save()
+
+def write(transcript, file, ts='yes') -> None:
+    """Writes the transcript as a pdf into a binary file object, one block per segment"""
+    writer = _Writer(file)
+    for i, segment in enumerate(transcript, start=1):
+        header = segment.speaker
+        if ts == 'yes':
+            header = f"{i}   {vtt_time(segment.start)} --> {vtt_time(segment.end)}"
+            if segment.speaker:
+                header += f"   {segment.speaker}"
+        writer.block(header, segment.text)
+    writer.save()
+
+def convert(transcript_file, transcript, ts='yes'):
+    """Writes the transcript as a pdf next to transcript_file"""
+    new_transcript = Path(str(transcript_file.parent.joinpath(transcript_file.stem)) + '.pdf')
 
-    pdf.build(paragraphs)
+    with open(new_transcript, 'wb') as f:
+        write(transcript, f, ts)
 
-    return new_transcript
\ No newline at end of file
+    return new_transcript
@@ -1,14 +1,14 @@
 """Streamlit Webapp to handle offline transcriptions"""
 from pathlib import Path
-from tempfile import NamedTemporaryFile
-import codecs
+import time
 import uuid
 
 from streamlit.runtime.scriptrunner import get_script_run_ctx
 import streamlit as st
+import streamlit.components.v1 as components
 
-from converters import vtt2docx, vtt2pdf, vtt2txt
-from transcribers import whisper, vosk
+from converters import formats
+from transcribers import jobs, library, metrics, resegment, uploads, workspace
 
 # set the details of the page
 st.set_page_config(
@@ -21,19 +21,26 @@ st.set_page_config(
 if 'transcript' not in st.session_state:
     st.session_state['transcript'] = None
 
+if 'job_id' not in st.session_state:
+    st.session_state['job_id'] = None
+    st.session_state['job_error'] = None
+
 if 'export' not in st.session_state:
     st.session_state['export'] = 'vtt'
     st.session_state['disabled'] = True
 
-# create dummy transcript file if doesn't exist.
-if 'transcript_file' not in st.session_state:
-    Path('./app/audio').mkdir(parents=True, exist_ok=True)
-    transcript_file_path = Path('./app/audio/transcript.vtt')
-    with open(transcript_file_path, 'w+', encoding='utf-8') as tt:
-        tt.write(" ")
+# subtitle layout, applied to the vtt and srt exports when the captions are reflowed
+if 'reflow' not in st.session_state:
+    st.session_state['reflow'] = False
+    st.session_state['max_chars'] = resegment.MAX_CHARS
+    st.session_state['max_lines'] = resegment.MAX_LINES
+    st.session_state['max_duration'] = resegment.MAX_DURATION
+    st.session_state['max_cps'] = resegment.MAX_CPS
 
-    st.session_state['transcript_file'] = transcript_file_path
-    st.session_state['transcript_output'] = st.session_state['transcript_file']
+# the export waiting to be downloaded, a file in this session's workspace
+if 'transcript_output' not in st.session_state:
+    st.session_state['transcript_name'] = 'transcript'
+    st.session_state['transcript_output'] = None
 
 # get IP of remote client
 def get_remote_ip() -> str:
@@ -52,48 +59,143 @@ def get_remote_ip() -> str:
 
     return session_info.request.remote_ip
 
-# create ip address session state
+# tells the workspace reaper whether a browser session is still open
+def session_alive(session_id: str) -> bool:
+    """Returns True while streamlit keeps the session"""
+    return st.runtime.get_instance().is_active_session(session_id)
+
+# scratch files of this session, deleted once the session has ended
+if 'workspace' not in st.session_state:
+    ctx = get_script_run_ctx()
+    st.session_state['workspace'] = ctx.session_id if ctx is not None else str(uuid.uuid4())
+workspace.start_reaper(session_alive)
+
+# create ip address session state, sessions are counted for capacity planning
 if 'ip_address' not in st.session_state:
     st.session_state['ip_address'] = get_remote_ip()
-    with open('connections.txt', 'a', encoding='utf-8') as cn:
-        cn.write(st.session_state['ip_address'] + '\n')
+    metrics.inc('transcriber_sessions_total', app='single')
+
+# serve /metrics when TRANSCRIBER_METRICS_PORT is set, started once per server process
+metrics.serve()
+
+# the workers start (and load the default model) with the first page view, not the first upload
+jobs.start()
+
+# large files go through the chunked upload endpoint, started once per server process
+uploads.serve()
+
+# the page keeps one registered upload until it has been transcribed and has fully arrived,
+# a new id would reload the upload field and stop the browser sending the file
+if uploads.PORT and ('upload_id' not in st.session_state or (
+        st.session_state['upload_submitted']
+        and (uploads.status(st.session_state['upload_id']) or {'complete': True})['complete'])):
+    st.session_state['upload_id'] = uploads.create(st.session_state.get('session_id', ''))
+    st.session_state['upload_submitted'] = False
+
+# describe how far the transcription is
+def progress_text(progress, elapsed: float) -> str:
+    """Returns the progress bar label with an estimate of the time left"""
+    if not progress:
+        return "Transcribing!..."
+    remaining = elapsed * (1.0 - progress) / progress
+    minutes, seconds = divmod(int(remaining), 60)
+    return f"Transcribing!... {progress:.0%} done, about {minutes}m {seconds:02}s left"
 
 # transcribe the audio
 #@st.cache_resource(show_spinner="Transcribing...")
-def transcription(audio_file_name, model):
-    """Uses different packages to transcribe audio file and writes the segments"""
-    if model[0:4] == 'vosk':
-        st.session_state['transcript_file'] = vosk.transcribe(audio_file_name, model,
-                                                             st.session_state['eo'],
-                                                             st.session_state['ts'])
-    else:
-        st.session_state['transcript_file'] = whisper.transcribe(audio_file_name, model,
-                                                                st.session_state['eo'],
-                                                                st.session_state['ts'])
+def transcription(uploaded_file, model):
+    """Queues the uploaded file for the background transcription workers"""
+    options = {'eo': st.session_state['eo'], 'long_form': st.session_state['lf'] == 'yes',
+               'diarization': st.session_state['sp'] == 'yes',
+               'draft': st.session_state['fd'] == 'yes',
+               'library': st.session_state.get('lib') == 'yes'}
+
+    # a new upload replaces the one this session was waiting for
+    if st.session_state['job_id'] is not None:
+        jobs.cancel(st.session_state['job_id'])
+        st.session_state['job_id'] = None
 
-    with codecs.open(st.session_state['transcript_file'], encoding='utf-8') as file:
-        data = file.read()
+    try:
+        with metrics.stage('submit'):
+            if uploaded_file is None:
+                # the chunked upload, decoding starts on the part that has arrived
+                st.session_state['job_id'] = jobs.submit_upload(
+                    st.session_state['upload_id'], model, options,
+                    st.session_state.get('session_id', ''))
+                st.session_state['upload_submitted'] = True
+            else:
+                st.session_state['job_id'] = jobs.submit(uploaded_file, uploaded_file.name,
+                                                         model, options,
+                                                         st.session_state.get('session_id', ''))
+    except (jobs.QueueFull, ValueError) as e:
+        st.warning(str(e))
+        return False
 
-    st.session_state['transcript'] = data
-    st.session_state['transcript_output'] = st.session_state['transcript_file']
+    st.session_state['transcript'] = None
+    st.session_state['disabled'] = True
 
     return True
 
+# poll the background job without blocking the rest of the page
+@st.fragment(run_every=1.0)
+def job_status():
+    """Shows the queue position or live preview of the job, and collects it once finished"""
+    job = jobs.get(st.session_state['job_id'])
+    if job is None:
+        st.session_state['job_id'] = None
+        st.warning("The transcription expired. Please transcribe the file again.")
+        return
+
+    if job['status'] == jobs.QUEUED:
+        # shorter files and other users' first files may start ahead of earlier uploads
+        wait = jobs.expected_wait(job['id'])
+        estimate = f", starting in about {int(wait // 60) + 1} min" if wait else ""
+        st.info(f"Waiting in the queue, {jobs.position(job['id'])} transcriptions ahead of "
+                f"yours{estimate}")
+    elif job['status'] == jobs.RUNNING:
+        st.progress(job['progress'], text=progress_text(job['progress'],
+                                                        time.time() - job['started']))
+        if job['preview'] is not None:
+            st.text(job['preview'].to_vtt('no'))
+    else:
+        st.session_state['job_id'] = None
+        if job['status'] == jobs.DONE:
+            # keep the original file name for the exports
+            st.session_state['transcript'] = job['result']
+            st.session_state['transcript_name'] = Path(job['name']).stem
+            convert_transcript()
+            st.session_state['disabled'] = False
+        else:
+            st.session_state['job_error'] = job['error']
+        # rerun the whole page so the export widgets pick up the transcript
+        st.rerun()
+
 # Convert the transcript to various forms
 def convert_transcript():
     """If-else statement to send transcript to the proper converter script"""
     export = st.session_state['export']
-    transcript_file = st.session_state['transcript_file']
-    if export == 'pdf':
-        st.session_state['transcript_output'] = vtt2pdf.convert(transcript_file,
-                                                                st.session_state['transcript'])
-    elif export == 'docx':
-        st.session_state['transcript_output'] = vtt2docx.convert(transcript_file,
-                                                                 st.session_state['transcript'])
-    else:
-        st.session_state['transcript_output'] = vtt2txt.convert(transcript_file,
-                                                                st.session_state['transcript'],
-                                                                export)
+    transcript = st.session_state['transcript']
+    if transcript is None:
+        return False
+    ts = st.session_state['ts']
+    # captions are rebuilt from the word timings, the recording isn't decoded again
+    if st.session_state['reflow'] and export in ('vtt', 'srt'):
+        transcript = resegment.resegment(transcript, st.session_state['max_chars'],
+                                         st.session_state['max_lines'],
+                                         st.session_state['max_duration'],
+                                         st.session_state['max_cps'])
+    with metrics.stage('export', format=export):
+        data = formats.render(transcript, export, ts)
+    try:
+        with workspace.use(st.session_state['workspace']) as scratch:
+            # one export at a time, the previous format's file is deleted
+            scratch.clear()
+            st.session_state['transcript_output'] = scratch.write(
+                f"{st.session_state['transcript_name']}.{export}", data)
+    except workspace.QuotaExceeded as e:
+        st.session_state['transcript_output'] = None
+        st.warning(str(e))
+        return False
 
     return True
 
@@ -111,10 +213,13 @@ if __name__ == "__main__":
                         To transcribe an audio or video file, drag and drop the file, or you can use
                         the **Browse Files** button""")
 
+    # the library is the one place a transcript outlives the browser window
+    kept = (f", except the transcripts you add to the library, which every user of this app "
+            f"can search {library.kept_for()}") if library.ENABLED else ''
     st.sidebar.subheader("Note")
-    st.sidebar.markdown("""This Whisper ASR package has been trained using machine learning, but is
+    st.sidebar.markdown(f"""This Whisper ASR package has been trained using machine learning, but is
                         secure to use at UC. Your data will not be used to train future versions of
-                        the app. All files are automatically deleted after closing the browser window.
+                        the app. All files are automatically deleted after closing the browser window{kept}.
                         Please ensure that you download the generated transcript file and save it in a
                         secure location. You should also save the original audio or video file in a
                         secure location.
@@ -138,50 +243,77 @@ if __name__ == "__main__":
         ts = st.radio('Include Time Stamps', ['yes', 'no'], key='ts', index=0, horizontal=True,
                       help='Should the transcription be labeled with timestamps')
 
+        lf = st.radio('Long Recording', ['yes', 'no'], key='lf', index=1, horizontal=True,
+                      help="""Splits the recording on silences and transcribes the parts in
+                      parallel. Faster for lectures and meetings, Whisper models only""")
+
+        fd = st.radio('Fast Draft', ['yes', 'no'], key='fd', index=1, horizontal=True,
+                      help="""Transcribes with a small model first and only re-transcribes the
+                      unclear parts with the selected model. Much faster on clear recordings,
+                      Whisper models only""")
+
+        sp = st.radio('Label Speakers', ['yes', 'no'], key='sp', index=1, horizontal=True,
+                      help='Marks which speaker said each part, for interviews and meetings')
+
+        # sharing is asked for every upload, nothing is kept unless its user says so
+        if library.ENABLED:
+            st.radio('Add to the Library', ['yes', 'no'], key='lib', index=1, horizontal=True,
+                     help=f"Keeps the transcript in the library, where every user of this app "
+                     f"can search it {library.kept_for()}")
+
         # File uploader
         uploaded_file = st.file_uploader(
             "Upload file you want to transcribe",
             accept_multiple_files=False,
         )
 
+        # files are sent in chunks and transcription starts before the upload has finished
+        if uploads.PORT:
+            st.caption("""Or, for large videos and recordings, choose the file here. It keeps
+                       uploading after a dropped connection, and you can press Transcribe
+                       as soon as the upload has started""")
+            components.html(uploads.widget(st.session_state['upload_id']), height=70)
+
         transcribe_btn = st.form_submit_button("Transcribe")
 
     if transcribe_btn:
-        if uploaded_file is not None:
-            # write to temporary file and get name
-            with NamedTemporaryFile() as temp:
-                temp.write(uploaded_file.getvalue())
-                temp.seek(0)
-                audio_file = temp.name
-
-                # Transcribe the audio file
-                if st.session_state['eo'] == 'yes':
-                    if st.session_state['model'].split('-')[0] == 'large':
-                        model = st.session_state['model']
-                    else:
-                        model = st.session_state['model'] + '.en'
-                else:
+        upload = uploads.status(st.session_state['upload_id']) if uploads.PORT else None
+        if uploaded_file is not None or (upload is not None and upload['received']
+                                         and not st.session_state['upload_submitted']):
+            # Queue the audio file for transcription
+            if st.session_state['eo'] == 'yes':
+                if st.session_state['model'].split('-')[0] == 'large':
                     model = st.session_state['model']
-
-                with st.spinner("Transcribing!..."):
-                    RETURN_CODE = transcription(audio_file, model)
-
-                if RETURN_CODE:
-                    st.success('Transcription complete!')
-                    st.session_state['disabled'] = False
                 else:
-                    st.warning("""Something went wrong. Please contact the eResearch Team.
-                               Or try refreshing the app.""")
-
-                with st.expander(label='Preview the transcript'):
-                    st.write(st.session_state['transcript'])
+                    model = st.session_state['model'] + '.en'
+            else:
+                model = st.session_state['model']
+
+            RETURN_CODE = transcription(uploaded_file, model)
+
+    # the transcription runs in a worker process and survives reruns of this page
+    if st.session_state['job_id'] is not None:
+        job_status()
+    elif st.session_state['job_error'] is not None:
+        st.warning(f"""Something went wrong ({st.session_state['job_error']}). Please contact
+                   the eResearch Team. Or try refreshing the app.""")
+        st.session_state['job_error'] = None
+    elif st.session_state['transcript'] is not None:
+        st.success('Transcription complete!')
+        report = (st.session_state['transcript'].info or {}).get('cascade')
+        if report is not None:
+            st.caption(f"Fast draft: {report['redecoded']:.0%} of the recording was "
+                       f"re-transcribed with {report['model']}, about {report['speedup']:.1f}x "
+                       f"faster than {report['model']} alone")
+        with st.expander(label='Preview the transcript'):
+            st.write(st.session_state['transcript'].to_vtt(st.session_state['ts']))
 
     # Output widgets
     col1, col2 = st.columns(2)
 
     with col1:
         export_select = st.selectbox('Select your file export format',
-                            ['vtt', 'srt', 'txt', 'docx', 'pdf', 'lrc', 'tsv'],
+                            ['vtt', 'srt', 'txt', 'docx', 'pdf', 'lrc', 'tsv', 'json'],
                             key='export',
                             index=0,
                             on_change=convert_transcript,
@@ -200,16 +332,36 @@ if __name__ == "__main__":
     with col2:
         st.write(" ")
         st.write(" ")
-        with open(st.session_state['transcript_output'], 'rb') as f:
-            download = st.download_button(
-                        label='Download Transcript',
-                        data = f,
-                        file_name=st.session_state['transcript_output'].name,
-                        mime = MIME,
-                        disabled=st.session_state['disabled'],
-                        )
-
-            # if download:
-            #     os.remove(st.session_state['transcript_output'])
+        # the workspace may have been reaped while the page sat idle, export it again
+        output = st.session_state['transcript_output']
+        if st.session_state['transcript'] is not None and (output is None
+                                                           or not output.exists()):
+            convert_transcript()
+            output = st.session_state['transcript_output']
+        download = st.download_button(
+                    label='Download Transcript',
+                    data = output.read_bytes() if output is not None else b'',
+                    file_name=output.name if output is not None else 'transcript.vtt',
+                    mime = MIME,
+                    disabled=st.session_state['disabled'] or output is None,
+                    )
+
+    # subtitle layout, changing it re-exports without transcribing again
+    with st.expander(label='Subtitle layout (vtt and srt)'):
+        st.checkbox('Reflow the captions', key='reflow', on_change=convert_transcript,
+                    disabled=st.session_state['disabled'],
+                    help='Rebuilds the captions from the word timings with the limits below')
+        layout1, layout2 = st.columns(2)
+        with layout1:
+            st.number_input('Characters per line', 16, 80, key='max_chars',
+                            on_change=convert_transcript, disabled=st.session_state['disabled'])
+            st.number_input('Lines per caption', 1, 3, key='max_lines',
+                            on_change=convert_transcript, disabled=st.session_state['disabled'])
+        with layout2:
+            st.number_input('Longest caption (seconds)', 1.0, 20.0, step=0.5, key='max_duration',
+                            on_change=convert_transcript, disabled=st.session_state['disabled'])
+            st.number_input('Reading speed (characters a second)', 5.0, 40.0, step=1.0,
+                            key='max_cps', on_change=convert_transcript,
+                            disabled=st.session_state['disabled'])
 
     #st.write(st.session_state)
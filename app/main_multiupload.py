@@ -1,17 +1,12 @@
 """Streamlit Webapp to handle offline transcriptions"""
-from pathlib import Path
-from tempfile import NamedTemporaryFile
-
-import codecs
-import zipfile
-import os
+import io
 import uuid
 
 from streamlit.runtime.scriptrunner import get_script_run_ctx
 import streamlit as st
 
-from converters import vtt2docx, vtt2pdf, vtt2txt
-from transcribers import whisper, vosk
+from converters import archive
+from transcribers import batch, jobs, library, metrics
 
 st.set_page_config(
     page_title="Offline Batch Transcriptions",
@@ -19,15 +14,15 @@ st.set_page_config(
     initial_sidebar_state="auto"
 )
 
-# create transcript session state
-if 'transcript' not in st.session_state:
-    st.session_state['transcript'] = None
-
 if 'export' not in st.session_state:
     st.session_state['export'] = 'vtt'
 
 if 'session_id' not in st.session_state:
     st.session_state['session_id'] = ''
+
+if 'job_ids' not in st.session_state:
+    st.session_state['job_ids'] = []
+    st.session_state['results'] = None
     
 # get IP of remote client
 def get_remote_ip() -> str:
@@ -46,65 +41,63 @@ def get_remote_ip() -> str:
 
     return session_info.request.remote_ip
 
-# create ip address session state
+# create ip address session state, sessions are counted for capacity planning
 if 'ip_address' not in st.session_state:
     st.session_state['ip_address'] = get_remote_ip()
-    with open('connections.txt', 'a', encoding='utf-8') as cn:
-        cn.write(st.session_state['ip_address'] + '\n')
-
-# transcribe the audio
-#@st.cache_resource(show_spinner="Transcribing...")
-def transcription(audio_file_name, model):
-    """Uses different packages to transcribe audio file and writes the segments"""
-    if model[0:4] == 'vosk':
-        st.session_state['transcript_file'] = vosk.transcribe(audio_file_name, model,
-                                                             st.session_state['eo'],
-                                                             st.session_state['ts'])
-    else:
-        st.session_state['transcript_file'] = whisper.transcribe(audio_file_name, model,
-                                                                st.session_state['eo'],
-                                                                st.session_state['ts'])
-
-    with codecs.open(st.session_state['transcript_file'], encoding='utf-8') as file:
-        data = file.read()
-
-    st.session_state['transcript'] = data
-    st.session_state['transcript_output'] = st.session_state['transcript_file']
-
-    return True
-
-# Convert the transcript to various forms
-def convert_transcript(transcript_num):
-    """If-else statement to send transcript to the proper converter script"""
-    export = st.session_state['export']
-    transcript_file = st.session_state['transcript_file']
-    if export == 'pdf':
-        st.session_state['transcript_output'] = vtt2pdf.convert(transcript_file,
-                                                                st.session_state['transcript'])
-    elif export == 'docx':
-        st.session_state['transcript_output'] = vtt2docx.convert(transcript_file,
-                                                                 st.session_state['transcript'])
-    else:
-        st.session_state['transcript_output'] = vtt2txt.convert(transcript_file,
-                                                                st.session_state['transcript'],
-                                                                export)
-
-    return True
-
-# Zip the files in a .zip file
-def zipFiles(zip_file_path, transcript_file_paths):
-    compression = zipfile.ZIP_DEFLATED
-    zf = zipfile.ZipFile(zip_file_path, mode="w")
-        
-    # Zip the files
-    for i, file_path in enumerate(transcript_file_paths):
-        current_path = Path(file_path)
-        new_path = current_path.rename(str(current_path.parent.joinpath('transcript_' + str(i+1) + current_path.suffix)))
-        zf.write(new_path, compress_type=compression)
-        os.remove(new_path)
-    zf.close()
-
-    return zip_file_path
+    metrics.inc('transcriber_sessions_total', app='multi')
+
+# serve /metrics when TRANSCRIBER_METRICS_PORT is set, started once per server process
+metrics.serve()
+
+# the workers start (and load the default model) with the first page view, not the first upload
+jobs.start()
+
+# poll the background jobs without blocking the rest of the page
+@st.fragment(run_every=1.0)
+def batch_status():
+    """Shows how far the queued files are, and zips the transcripts once all are finished"""
+    submitted = st.session_state['job_ids']
+    found = [(name, job_id, error, jobs.get(job_id) if job_id else None)
+             for name, job_id, error in submitted]
+    pending = [job for _, job_id, _, job in found
+               if job_id and job is not None and job['status'] not in jobs.FINISHED]
+    if pending:
+        done = len(found) - len(pending)
+        running = sum(job['progress'] for job in pending if job['status'] == jobs.RUNNING)
+        st.progress((done + running) / len(found),
+                    text=f"Transcribed {done} of {len(found)} files")
+        # the files are interleaved with other users' uploads, shortest first
+        queued = [job for job in pending if job['status'] == jobs.QUEUED]
+        waits = [jobs.expected_wait(job['id']) for job in queued]
+        waits = [wait for wait in waits if wait is not None]
+        if waits:
+            st.caption(f"{len(queued)} files waiting in the queue, the last should start in "
+                       f"about {int(max(waits) // 60) + 1} min")
+        return
+
+    # every job finished, collect them in upload order
+    results = []
+    for name, job_id, error, job in found:
+        if job is None:
+            results.append(batch.BatchResult(name, None, error or 'the transcription expired'))
+        elif job['status'] == jobs.DONE:
+            results.append(batch.BatchResult(name, job['result'], None))
+        else:
+            results.append(batch.BatchResult(name, None, job['error'] or job['status']))
+
+    # the exports are rendered in memory and streamed into the archive, no files on disk
+    zip_data = io.BytesIO()
+    finished = [(result.name, result.transcript) for result in results if result.error is None]
+    # the choices made when the batch was submitted, the form has been reset since
+    output, ts = st.session_state['batch_format']
+    with metrics.stage('export', format=output):
+        archive.write_zip(zip_data, finished, output, ts, archive.LEVEL)
+    st.session_state['zip_data'] = zip_data.getvalue()
+
+    st.session_state['results'] = results
+    st.session_state['job_ids'] = []
+    # rerun the whole page so the download button is shown
+    st.rerun()
 
 if __name__ == "__main__":
     # ------------------- Sidebar Information -------------------------
@@ -120,10 +113,13 @@ if __name__ == "__main__":
                         To transcribe an audio or video file, drag and drop the file, or you can use
                         the **Browse Files** button""")
 
+    # the library is the one place a transcript outlives the browser window
+    kept = (f", except the transcripts you add to the library, which every user of this app "
+            f"can search {library.kept_for()}") if library.ENABLED else ''
     st.sidebar.subheader("Note")
-    st.sidebar.markdown("""This Whisper ASR package has been trained using machine learning, but is
+    st.sidebar.markdown(f"""This Whisper ASR package has been trained using machine learning, but is
                         secure to use at UC. Your data will not be used to train future versions of
-                        the app. All files are automatically deleted after closing the browser window.
+                        the app. All files are automatically deleted after closing the browser window{kept}.
                         Please ensure that you download the generated transcript file and save it in a
                         secure location. You should also save the original audio or video file in a
                         secure location.
@@ -147,6 +143,15 @@ if __name__ == "__main__":
         ts = st.radio('Include Time Stamps', ['yes', 'no'], key='ts', index=0, horizontal=True,
                       help='Should the transcription be labeled with timestamps')
 
+        sp = st.radio('Label Speakers', ['yes', 'no'], key='sp', index=1, horizontal=True,
+                      help='Marks which speaker said each part, for interviews and meetings')
+
+        # sharing is asked for every upload, nothing is kept unless its user says so
+        if library.ENABLED:
+            st.radio('Add to the Library', ['yes', 'no'], key='lib', index=1, horizontal=True,
+                     help=f"Keeps the transcript in the library, where every user of this app "
+                     f"can search it {library.kept_for()}")
+
         # File uploader
         uploaded_files = st.file_uploader(
             "Upload file you want to transcribe",
@@ -154,7 +159,7 @@ if __name__ == "__main__":
         )
 
         output_select = st.radio('Select an output format',
-                                ['vtt', 'txt', 'pdf', 'docx', 'json', 'lrc', 'tsv'],
+                                ['vtt', 'srt', 'txt', 'pdf', 'docx', 'json', 'lrc', 'tsv'],
                                 key='output',
                                 index=0,
                                 horizontal=True)
@@ -172,45 +177,39 @@ if __name__ == "__main__":
         else:
             model = st.session_state['model']
     
-        # transcribe the audio for each file
-        return_codes = []
-        transcript_files = []
-        with st.spinner("Transcribing!..."):
-            # write the audio files into the temp folder
-            for file_num, uploaded_file in enumerate(uploaded_files):
-                if uploaded_file is not None:
-                    # write to temporary file and get name    
-                    with NamedTemporaryFile() as temp:
-                        temp.write(uploaded_file.getvalue())
-                        temp.seek(0)
-                        audio_file = temp.name
-
-                        return_code = transcription(audio_file, model)
-                        return_codes.append(return_code)
-                        convert_transcript(file_num)
-                        transcript_files.append(st.session_state['transcript_output'])
-
-        zip_file_path = zipFiles(st.session_state['session_id'] + '.zip', transcript_files)
-        for i, return_code in enumerate(return_codes):
-            if return_code:
+        # queue the audio files for the background workers, they survive reruns of this page;
+        # the batch takes one place in the queue, all of its files are queued or none
+        files = [(uploaded_file, uploaded_file.name) for uploaded_file in uploaded_files
+                 if uploaded_file is not None]
+        try:
+            job_ids = jobs.submit_batch(files, model,
+                                        {'eo': st.session_state['eo'],
+                                         'diarization': st.session_state['sp'] == 'yes',
+                                         'library': st.session_state.get('lib') == 'yes'},
+                                        st.session_state['session_id'])
+            submitted = [(name, job_id, None) for (_, name), job_id in zip(files, job_ids)]
+        except jobs.QueueFull as e:
+            submitted = [(name, None, str(e)) for _, name in files]
+        st.session_state['job_ids'] = submitted
+        st.session_state['batch_format'] = (st.session_state['output'], st.session_state['ts'])
+        st.session_state['results'] = None
+
+    if st.session_state['job_ids']:
+        batch_status()
+    elif st.session_state['results'] is not None:
+        for i, result in enumerate(st.session_state['results']):
+            if result.error is None:
                 st.success('Transcript ' + str(i+1) + " was successful")
             else:
-                st.warning("Something went wrong. Transcript " +
-                           'Transcript ' + str(i+1) + ' failed. ' +
+                st.warning("Something went wrong. " +
+                           'Transcript ' + str(i+1) + ' failed (' + result.error + '). ' +
                            "Please contact the eResearch Team. Or try refreshing the app.")
-        
+
         # Download the transcript
-        with open(zip_file_path, 'rb') as f:
-            download = st.download_button(
-                    label='Download Transcript',
-                    data = f,
-                    file_name='transcripts.zip'
-                    )
-                   
-            # remove the zipfile if it exists
-            if zipfile.is_zipfile(zip_file_path):
-                os.remove(zip_file_path)
-            else:
-                pass
+        download = st.download_button(
+                label='Download Transcript',
+                data = st.session_state['zip_data'],
+                file_name='transcripts.zip'
+                )
     
     # st.write(st.session_state)
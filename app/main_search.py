@@ -0,0 +1,115 @@
+"""Streamlit Webapp to search the transcripts kept in the library"""
+from pathlib import Path
+
+import streamlit as st
+
+from converters import formats
+from transcribers import library
+
+st.set_page_config(
+    page_title="Transcript Library",
+    layout="centered",
+    initial_sidebar_state="auto"
+)
+
+# results shown per page of a search
+PAGE_SIZE = 50
+
+if 'page' not in st.session_state:
+    st.session_state['page'] = 0
+
+# characters markdown would interpret in a transcript's words
+MARKDOWN = '\\`*_{}[]()<>#+-.!|~'
+
+# a new query starts from the best results again
+def reset_page() -> None:
+    st.session_state['page'] = 0
+
+# transcripts and file names are shown as they are, never as markdown
+def escape(text: str) -> str:
+    """Escapes the characters markdown would interpret"""
+    return ''.join('\\' + c if c in MARKDOWN else c for c in text)
+
+def highlight(snippet: str) -> str:
+    """Returns the snippet as markdown with the matched words in bold"""
+    return escape(snippet).replace(library.MARK_START, '**').replace(library.MARK_END, '**')
+
+# rendered once per transcript and format, and only when asked for
+@st.cache_data(max_entries=16, show_spinner='Preparing the transcript...')
+def render_export(transcript_id: int, export: str):
+    """Returns (file name, bytes) of a library transcript in the export format, or None"""
+    entry = library.get_library().get(transcript_id)
+    if entry is None:
+        return None
+    name, transcript = entry
+    return Path(name).with_suffix(f".{export}").name, formats.render(transcript, export)
+
+# each match with its time in the recording and a download of the whole transcript
+def show_result(result: dict, i: int) -> None:
+    """Shows one matching segment"""
+    start = formats.vtt_time(result['start_ms'] / 1000)
+    end = formats.vtt_time(result['end_ms'] / 1000)
+    speaker = f" · {result['speaker']}" if result['speaker'] else ''
+    st.markdown(f"**{escape(result['name'])}** `{start} --> {end}`{escape(speaker)}")
+    st.markdown(highlight(result['snippet']))
+    with st.expander('Download transcript'):
+        export = st.radio('Format', ('vtt', 'srt', 'txt', 'docx', 'pdf'), horizontal=True,
+                          key=f"format_{i}")
+        wanted = (result['transcript_id'], export)
+        if st.button('Prepare download', key=f"prepare_{i}"):
+            st.session_state['prepared'] = wanted
+        # only the transcript asked for is loaded and rendered
+        if st.session_state.get('prepared') == wanted:
+            prepared = render_export(*wanted)
+            if prepared is None:
+                st.write('This transcript is no longer in the library.')
+            else:
+                file_name, data = prepared
+                st.download_button(label='Download', data=data, file_name=file_name,
+                                   key=f"download_{i}")
+
+def search() -> None:
+    """Searches the library and shows a page of matching segments"""
+    if not library.ENABLED:
+        st.info('The library is off. Set TRANSCRIBER_LIBRARY=1 for the app and its workers '
+                'to keep the transcripts their users choose to add here.')
+        return
+
+    library.purge()
+    stats = library.get_library().stats()
+    st.caption(f"{stats['transcripts']} transcripts, {stats['hours']:.1f} hours of audio, each "
+               f"kept {library.kept_for()}")
+    query = st.text_input('Search', placeholder='words to find, end a word with * for '
+                          'its prefix', on_change=reset_page)
+    if not query:
+        return
+
+    page = st.session_state['page']
+    results = library.get_library().search(query, PAGE_SIZE + 1, page * PAGE_SIZE)
+    if not results:
+        st.write('Nothing found.')
+    for i, result in enumerate(results[:PAGE_SIZE]):
+        show_result(result, i)
+
+    previous, following = st.columns(2)
+    if page and previous.button('Previous'):
+        st.session_state['page'] -= 1
+        st.rerun()
+    if len(results) > PAGE_SIZE and following.button('Next'):
+        st.session_state['page'] += 1
+        st.rerun()
+
+if __name__ == "__main__":
+    # ------------------- Sidebar Information -------------------------
+    st.title('Transcript Library')
+
+    # UC banner
+    st.sidebar.image('./img/UCWhite.png')
+
+    st.sidebar.title('About this app')
+    st.sidebar.markdown(f"""Search the transcripts users chose to add to the library, and those
+                        of the command line. Each match shows the recording and the time it was
+                        said, so the passage can be found in the audio or downloaded with its
+                        whole transcript. Transcripts are kept {library.kept_for()}""")
+
+    search()
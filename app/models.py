@@ -0,0 +1,76 @@
+"""Manage the local model store, so transcription never downloads at request time
+
+Run from the repository root:
+
+    python app/models.py prefetch large-v2 vosk-small          # with internet access
+    python app/models.py pack large-v2 vosk-small -o models.tar
+    python app/models.py install models.tar                    # on the air-gapped node
+    python app/models.py install ./faster-whisper-large-v2 --model large-v2
+    python app/models.py verify
+    python app/models.py list
+
+Every installed file is recorded with its size and sha256 in the store's manifest.json.
+"""
+import argparse
+import sys
+import time
+
+from transcribers import store
+
+# installing into the store
+def run(args) -> int:
+    """Runs one subcommand and returns the exit status"""
+    if args.command == 'prefetch':
+        for model in args.models:
+            print(f"downloading {model}", file=sys.stderr)
+            store.prefetch(model)
+    elif args.command == 'install':
+        for model in store.install(args.source, args.model, args.version):
+            print(f"installed {model}", file=sys.stderr)
+    elif args.command == 'pack':
+        store.pack(args.models, args.output)
+    elif args.command == 'verify':
+        failed = 0
+        for model in args.models or sorted(store.read_manifest()):
+            problems = store.verify(model)
+            failed += bool(problems)
+            print(f"{model}: {'; '.join(problems) or 'ok'}")
+        return 1 if failed else 0
+    else:
+        for model, entry in sorted(store.read_manifest().items()):
+            size = sum(size for size, _ in entry['files'].values())
+            installed = time.strftime('%Y-%m-%d', time.localtime(entry['installed']))
+            print(f"{model:<12} {entry['backend']:<8} {size / 1024 ** 3:6.2f} GB  "
+                  f"{entry['version']}  installed {installed}")
+    return 0
+
+def parse_args(argv=None):
+    """Parses the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    prefetch = commands.add_parser('prefetch', help='download models into the store')
+    prefetch.add_argument('models', nargs='+')
+
+    install = commands.add_parser('install', help='install from a directory or an archive')
+    install.add_argument('source', help='model directory, zip or tar archive, or a packed store')
+    install.add_argument('--model', help='name of the model, e.g. large-v2 or vosk-small')
+    install.add_argument('--version', help='version recorded in the manifest, the source '
+                         'name by default')
+
+    pack = commands.add_parser('pack', help='archive installed models to carry offline')
+    pack.add_argument('models', nargs='+')
+    pack.add_argument('-o', '--output', required=True, help='tar archive to write')
+
+    verify = commands.add_parser('verify', help='check the installed files against '
+                                 'their checksums')
+    verify.add_argument('models', nargs='*')
+
+    commands.add_parser('list', help='show the installed models')
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    try:
+        sys.exit(run(parse_args()))
+    except store.ModelStoreError as e:
+        sys.exit(f"error: {e}")
@@ -0,0 +1,182 @@
+from contextlib import contextmanager
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+import shutil
+import subprocess
+import threading
+
+from . import metrics
+
+# whisper and vosk both expect 16 kHz mono audio
+SAMPLE_RATE = 16000
+
+# size of the chunks copied from the upload buffer into ffmpeg and read back out
+CHUNK_SIZE = 1 << 20
+
+# copy the upload buffer into ffmpeg's stdin
+def _feed(source, stdin, chunk_size: int):
+    """Writes the file-like source into stdin in bounded chunks"""
+    try:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            stdin.write(chunk)
+    except (BrokenPipeError, ValueError):
+        # ffmpeg stopped reading (bad input or early exit), the reader reports it
+        pass
+    finally:
+        try:
+            stdin.close()
+        except BrokenPipeError:
+            pass
+
+@contextmanager
+def open_pcm(source, fmt: str = 'f32le', sample_rate: int = SAMPLE_RATE,
+             chunk_size: int = CHUNK_SIZE):
+    """Starts ffmpeg decoding source (a path or file-like object) to mono PCM on stdout"""
+    piped = not isinstance(source, (str, Path))
+    command = ["ffmpeg", "-nostdin", "-loglevel", "quiet",
+               "-i", "pipe:0" if piped else str(source),
+               # only the audio stream is demuxed and decoded, video frames are skipped
+               "-vn", "-sn", "-dn",
+               "-ar", str(sample_rate), "-ac", "1", "-f", fmt, "-"]
+    if piped:
+        # -nostdin only stops ffmpeg reading commands, pipe:0 is still read
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        feeder = threading.Thread(target=_feed, args=(source, process.stdin, chunk_size),
+                                  daemon=True)
+        feeder.start()
+    else:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE)
+        feeder = None
+
+    try:
+        yield process
+    finally:
+        process.stdout.close()
+        process.wait()
+        if feeder is not None:
+            feeder.join()
+
+# read the duration from the container header without decoding
+def probe_duration(path) -> float:
+    """Returns the duration in seconds of a media file, or None when ffprobe can't tell"""
+    command = ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+               "-of", "default=noprint_wrappers=1:nokey=1", str(path)]
+    try:
+        output = subprocess.run(command, capture_output=True, text=True, timeout=30).stdout
+        return float(output.strip())
+    except (OSError, subprocess.SubprocessError, ValueError):
+        return None
+
+# how far ffmpeg has read into the upload, a progress measure when the duration is unknown
+def consumed(source):
+    """Returns the fraction of a file-like source read so far, or None when it can't tell"""
+    if isinstance(source, (str, Path)) or not hasattr(source, 'tell'):
+        return None
+
+    size = getattr(source, 'size', None)
+    if size is None and hasattr(source, 'getbuffer'):
+        with source.getbuffer() as view:
+            size = view.nbytes
+    if not size:
+        return None
+
+    return min(source.tell() / size, 1.0)
+
+# some containers (e.g. mp4 with the index at the end) can't be demuxed from a pipe
+@contextmanager
+def _seekable(source):
+    """Spools a file-like source to a temporary file so ffmpeg can seek in it"""
+    source.seek(0)
+    with NamedTemporaryFile() as temp:
+        shutil.copyfileobj(source, temp, CHUNK_SIZE)
+        temp.flush()
+        yield temp.name
+
+def iter_pcm(source, fmt: str = 's16le', sample_rate: int = SAMPLE_RATE,
+             chunk_size: int = CHUNK_SIZE):
+    """Yields raw PCM chunks of at most chunk_size bytes decoded from source"""
+    produced = False
+    with open_pcm(source, fmt, sample_rate) as process:
+        while True:
+            data = process.stdout.read(chunk_size)
+            if len(data) == 0:
+                break
+            produced = True
+            yield data
+
+    if not produced and process.returncode and not isinstance(source, (str, Path)):
+        with _seekable(source) as path:
+            yield from iter_pcm(path, fmt, sample_rate, chunk_size)
+
+def iter_pcm_into(source, buffer: bytearray, fmt: str = 's16le',
+                  sample_rate: int = SAMPLE_RATE):
+    """Decodes source into a reusable buffer, yielding the number of bytes of each read
+
+    every read overwrites the buffer, so a chunk must be consumed before advancing
+    """
+    produced = False
+    view = memoryview(buffer)
+    try:
+        with open_pcm(source, fmt, sample_rate) as process:
+            while True:
+                read = process.stdout.readinto(view)
+                if not read:
+                    break
+                produced = True
+                yield read
+    finally:
+        view.release()
+
+    if not produced and process.returncode and not isinstance(source, (str, Path)):
+        with _seekable(source) as path:
+            yield from iter_pcm_into(path, buffer, fmt, sample_rate)
+
+def iter_samples(source, sample_rate: int = SAMPLE_RATE, chunk_size: int = CHUNK_SIZE):
+    """Yields float32 arrays of the samples as ffmpeg decodes them, e.g. from a growing upload"""
+    import numpy as np
+
+    for data in iter_pcm(source, 'f32le', sample_rate, chunk_size):
+        yield np.frombuffer(data, dtype=np.float32)
+
+def _read_float32(source, sample_rate: int, chunk_size: int):
+    """Reads ffmpeg's float32 output straight into a growing numpy buffer"""
+    # imported here, the server only spools and probes uploads and never needs numpy
+    import numpy as np
+
+    # start with a minute of audio and double when full
+    audio = np.empty(sample_rate * 60, dtype=np.float32)
+    filled = 0
+    with open_pcm(source, 'f32le', sample_rate) as process:
+        while True:
+            raw = audio.view(np.uint8)
+            if filled == raw.nbytes:
+                grown = np.empty(len(audio) * 2, dtype=np.float32)
+                grown[:len(audio)] = audio
+                audio = grown
+                raw = audio.view(np.uint8)
+            read = process.stdout.readinto(raw[filled:filled + chunk_size])
+            if not read:
+                break
+            filled += read
+
+    samples = filled // 4
+    # give back the unused part of the buffer when it is large
+    if samples < len(audio) * 3 // 4:
+        return audio[:samples].copy(), process.returncode
+    return audio[:samples], process.returncode
+
+def decode_audio(source, sample_rate: int = SAMPLE_RATE,
+                 chunk_size: int = CHUNK_SIZE):
+    """Decodes a path or file-like object into a 16 kHz mono float32 array"""
+    with metrics.stage('ffmpeg_decode'):
+        audio, returncode = _read_float32(source, sample_rate, chunk_size)
+        if len(audio) == 0 and returncode and not isinstance(source, (str, Path)):
+            with _seekable(source) as path:
+                audio, returncode = _read_float32(path, sample_rate, chunk_size)
+
+    return audio
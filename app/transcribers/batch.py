@@ -0,0 +1,87 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Optional
+import multiprocessing
+import os
+import threading
+import time
+
+from .transcript import Transcript
+
+# threads each worker may use inside ctranslate2/kaldi, so workers don't oversubscribe cores
+DEFAULT_WORKER_THREADS = int(os.environ.get('TRANSCRIBER_WORKER_THREADS', '4'))
+
+# number of files the command line transcribes at once (0 picks cores // threads)
+DEFAULT_WORKERS = int(os.environ.get('TRANSCRIBER_BATCH_WORKERS', '0'))
+
+class BatchResult(NamedTuple):
+    """Outcome of one file in a batch, error is None when it succeeded"""
+    name: str
+    transcript: Optional[Transcript]
+    error: Optional[str]
+
+# number of usable cores for this process
+def cpu_count() -> int:
+    """Returns the cores this process is allowed to run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+# split the cores between workers
+def plan_workers(workers: int = DEFAULT_WORKERS, cpu_threads: int = DEFAULT_WORKER_THREADS):
+    """Returns (workers, cpu_threads) so that workers * cpu_threads fits the cores"""
+    cores = cpu_count()
+    cpu_threads = max(1, min(cpu_threads, cores))
+    if workers <= 0:
+        workers = max(1, cores // cpu_threads)
+    return workers, cpu_threads
+
+# ------------------------- worker process side -------------------------
+_WORKER_THREADS = 0
+
+def _init_worker(cpu_threads: int):
+    """Pins the thread pools of the numeric libraries before they are imported"""
+    global _WORKER_THREADS
+    _WORKER_THREADS = cpu_threads
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[var] = str(cpu_threads)
+
+def worker_threads() -> int:
+    """Returns the threads this worker process may use, 0 outside of a worker"""
+    return _WORKER_THREADS
+
+def _transcribe_path(path, model, eo, long_form=False, diarization=False, draft=False):
+    """Transcribes a file on disk inside a worker, returns (transcript, decoding seconds)"""
+    # the worker reads the file itself, nothing is copied through the pool's pipes
+    start = time.perf_counter()
+    if model[0:4] == 'vosk':
+        from . import vosk
+        transcript = vosk.transcribe(path, model, eo, diarization)
+    else:
+        from . import whisper
+        transcript = whisper.transcribe(path, model, eo, cpu_threads=_WORKER_THREADS,
+                                        long_form=long_form, diarization=diarization,
+                                        draft=draft)
+    return transcript, time.perf_counter() - start
+
+# ------------------------- scheduler side -------------------------
+_POOL = None
+_POOL_CONFIG = None
+_POOL_LOCK = threading.Lock()
+
+def get_pool(workers: int, cpu_threads: int) -> ProcessPoolExecutor:
+    """Returns the shared process pool, restarting it when the configuration changes"""
+    global _POOL, _POOL_CONFIG
+    with _POOL_LOCK:
+        # a worker that died (e.g. out of memory) leaves the pool unusable
+        if (_POOL is None or _POOL_CONFIG != (workers, cpu_threads)
+                or getattr(_POOL, '_broken', False)):
+            if _POOL is not None:
+                _POOL.shutdown(wait=False)
+            # spawn, forking the streamlit server with its threads is not safe
+            _POOL = ProcessPoolExecutor(max_workers=workers,
+                                        mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_init_worker,
+                                        initargs=(cpu_threads,))
+            _POOL_CONFIG = (workers, cpu_threads)
+        return _POOL
@@ -0,0 +1,168 @@
+from importlib import metadata
+from pathlib import Path
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from . import metrics
+from .transcript import Transcript
+
+# where decoded transcripts are kept, set TRANSCRIPT_CACHE=0 to disable the cache
+CACHE_DIR = Path(os.environ.get('TRANSCRIPT_CACHE_DIR',
+                                Path.home().joinpath('.cache', 'offline-transcription',
+                                                     'transcripts')))
+ENABLED = os.environ.get('TRANSCRIPT_CACHE', '1') != '0'
+
+# size bound and time to live, transcripts of sensitive recordings must not be kept forever
+MAX_BYTES = int(float(os.environ.get('TRANSCRIPT_CACHE_MB', '512')) * 1024 ** 2)
+TTL_SECONDS = float(os.environ.get('TRANSCRIPT_CACHE_TTL_HOURS', '24')) * 3600
+
+# <first 2 hex digits>/<sha256>.json, the only files the purge may delete
+ENTRY_NAME = re.compile(r'[0-9a-f]{64}\.json')
+
+# bytes hashed per read, the upload is never buffered a second time
+HASH_CHUNK_SIZE = 1 << 20
+
+# hash the audio without loading it whole
+def content_hash(source, chunk_size: int = HASH_CHUNK_SIZE) -> str:
+    """Returns the sha256 of a path or file-like source, read in chunks"""
+    digest = hashlib.sha256()
+    if isinstance(source, (str, Path)):
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    else:
+        source.seek(0)
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            digest.update(chunk)
+        source.seek(0)
+
+    return digest.hexdigest()
+
+# the backend version is part of the key so upgrades don't serve stale transcripts
+def backend_version(package: str) -> str:
+    """Returns the installed version of the backend package"""
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+def make_key(source, backend: str, model: str, **options) -> str:
+    """Returns the cache key of the audio content together with the decoding options"""
+    fields = {
+        'audio': content_hash(source),
+        'backend': backend,
+        'version': backend_version(backend),
+        'model': model,
+        'options': options,
+    }
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode('utf-8')).hexdigest()
+
+class TranscriptCache:
+    """On-disk content-addressed store of decoded transcripts with LRU eviction and a TTL"""
+
+    def __init__(self, directory: Path = CACHE_DIR, max_bytes: int = MAX_BYTES,
+                 ttl_seconds: float = TTL_SECONDS):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.directory.joinpath(key[:2], key + '.json')
+
+    def get(self, key: str):
+        """Returns the cached transcript for key, or None on a miss"""
+        path = self._path(key)
+        try:
+            stat = path.stat()
+            # the modification time is the creation time of the entry
+            if time.time() - stat.st_mtime > self.ttl_seconds:
+                path.unlink(missing_ok=True)
+                return None
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # the access time orders the entries for eviction, set it even on noatime mounts;
+        # the entry may have been purged by another process since, the hit still counts
+        try:
+            os.utime(path, (time.time(), stat.st_mtime))
+        except OSError:
+            pass
+        return Transcript.from_dict(entry)
+
+    def put(self, key: str, transcript: Transcript) -> None:
+        """Stores the transcript under key and evicts old entries beyond the size bound"""
+        path = self._path(key)
+        path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        entry = transcript.to_dict()
+
+        # write then rename so readers in other processes never see a partial entry
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(tmp, path)
+
+        self.purge()
+
+    def purge(self) -> None:
+        """Removes expired entries, then the least recently used ones above the size bound"""
+        with self._lock:
+            now = time.time()
+            entries = []
+            for path in self.directory.glob('[0-9a-f][0-9a-f]/*.json'):
+                # other data may share a directory set by hand, never purge it
+                if not ENTRY_NAME.fullmatch(path.name) or path.parent.name != path.name[:2]:
+                    continue
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                if now - stat.st_mtime > self.ttl_seconds:
+                    path.unlink(missing_ok=True)
+                else:
+                    entries.append((stat.st_atime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+
+# process-wide cache, the directory is shared with the batch worker processes
+CACHE = TranscriptCache()
+
+def _replay(transcript: Transcript):
+    """Yields the cached segments with their progress through the audio"""
+    duration = transcript.duration or (transcript.segments[-1].end if transcript.segments else 1.0)
+    for segment in transcript:
+        yield segment, min(segment.end / max(duration, 1e-6), 1.0)
+
+def stream(source, backend: str, model: str, decoder, **options):
+    """Returns decoder()'s (segments, transcript), served from the cache when decoded before"""
+    # an upload still arriving can't be hashed without waiting for all of it
+    if not ENABLED or getattr(source, 'growing', False):
+        return decoder()
+
+    key = make_key(source, backend, model, **options)
+    transcript = CACHE.get(key)
+    if transcript is not None:
+        # replayed in no time, the job's timing says nothing about the model's speed
+        metrics.annotate(cached=True)
+        return _replay(transcript), transcript
+
+    segments, transcript = decoder()
+
+    def store():
+        yield from segments
+        # only a transcript that was decoded to the end is cached
+        CACHE.put(key, transcript)
+
+    return store(), transcript
@@ -0,0 +1,120 @@
+import os
+import time
+
+from . import longform, metrics
+from .audio import SAMPLE_RATE
+
+# the fast model every cascade decodes with first
+DRAFT_MODEL = os.environ.get('TRANSCRIBER_CASCADE_DRAFT', 'base')
+
+# a draft segment is re-decoded below this average log probability per token
+LOGPROB_THRESHOLD = float(os.environ.get('TRANSCRIBER_CASCADE_LOGPROB', '-0.6'))
+
+# or when its text compresses this well (repetition loops), faster_whisper's own threshold
+COMPRESSION_THRESHOLD = 2.4
+
+# or when it is probably silence yet has text, a hallucination
+NO_SPEECH_THRESHOLD = 0.6
+
+# flagged segments are widened by up to this much silence on each side, never into the
+# segments kept from the draft, and joined across shorter gaps
+PAD_SECONDS = 0.5
+JOIN_SECONDS = 1.0
+
+# share of the progress bar the draft pass fills
+DRAFT_SHARE = 0.5
+
+# relative decoding cost of the whisper sizes, for the speedup when nothing is re-decoded
+SIZE_COST = {'tiny': 0.05, 'base': 0.08, 'small': 0.2, 'medium': 0.45, 'large': 0.9}
+
+def _size(model: str) -> str:
+    return model.removesuffix('.en').split('-')[0]
+
+def draft_model(model: str, eo: str):
+    """Returns the draft model for a cascade towards model, or None when model isn't larger"""
+    draft = DRAFT_MODEL + ('.en' if eo == 'yes' and _size(DRAFT_MODEL) != 'large' else '')
+    if SIZE_COST.get(_size(model), 1.0) <= SIZE_COST.get(_size(draft), 1.0):
+        return None
+    return draft
+
+def uncertain(segment) -> bool:
+    """Returns True when a faster_whisper segment's own scores say it is likely wrong"""
+    return (segment.avg_logprob < LOGPROB_THRESHOLD
+            or segment.compression_ratio > COMPRESSION_THRESHOLD
+            or (segment.no_speech_prob > NO_SPEECH_THRESHOLD and segment.avg_logprob < -0.3))
+
+def spans(draft: list, flags: list, duration: float) -> list:
+    """Returns the (start, end) seconds to re-decode, from the flagged draft segments"""
+    result = []
+    for i, segment in enumerate(draft):
+        if not flags[i]:
+            continue
+        before = draft[i - 1].end if i else 0.0
+        after = draft[i + 1].start if i + 1 < len(draft) else duration
+        start = max(segment.start - PAD_SECONDS, min(before, segment.start))
+        end = min(segment.end + PAD_SECONDS, max(after, segment.end))
+        if result and start - result[-1][1] <= JOIN_SECONDS:
+            result[-1][1] = max(result[-1][1], end)
+        else:
+            result.append([start, end])
+    return [(start, end) for start, end in result]
+
+def merge(draft: list, redecoded: list, redone: list) -> list:
+    """Returns the draft segments outside the re-decoded spans with the new ones, in time order"""
+    def inside(segment):
+        middle = (segment.start + segment.end) / 2
+        return any(start <= middle <= end for start, end in redone)
+
+    kept = [segment for segment in draft if not inside(segment)]
+    return sorted(kept + redecoded, key=lambda segment: segment.start)
+
+def decode(fw_draft, fw_model, samples, transcript, draft_name: str, model: str, **options):
+    """Decodes with the draft model, then re-decodes its uncertain spans with fw_model
+
+    yields (segment, progress) of the draft and then of the re-decoded spans as they are
+    decoded; once the generator finishes, transcript holds the merged segments in time order
+    and transcript.info['cascade'] the fraction re-decoded and the speedup over fw_model alone
+    """
+    duration = len(samples) / SAMPLE_RATE
+    start = time.perf_counter()
+    draft, flags = [], []
+    fw_segments, info = fw_draft.transcribe(samples, **options)
+    transcript.language = info.language
+    for fw_segment in fw_segments:
+        segment = longform.to_segment(fw_segment)
+        draft.append(segment)
+        flags.append(uncertain(fw_segment))
+        yield segment, min(segment.end / max(duration, 1e-6), 1.0) * DRAFT_SHARE
+    draft_seconds = time.perf_counter() - start
+
+    # the large model only sees the uncertain parts, in the draft's language
+    redo = spans(draft, flags, duration)
+    options = dict(options, language=options.get('language') or info.language)
+    start = time.perf_counter()
+    redecoded = []
+    redone_seconds = 0.0
+    total = sum(end - begin for begin, end in redo)
+    for begin, end in redo:
+        chunk = samples[int(begin * SAMPLE_RATE):int(end * SAMPLE_RATE)]
+        segments, _ = fw_model.transcribe(chunk, **options)
+        redone_seconds += end - begin
+        for fw_segment in segments:
+            segment = longform.to_segment(fw_segment, begin)
+            redecoded.append(segment)
+            yield segment, DRAFT_SHARE + (1 - DRAFT_SHARE) * redone_seconds / total
+        metrics.inc('transcriber_cascade_redecoded_seconds_total', end - begin)
+    redecode_seconds = time.perf_counter() - start
+
+    transcript.segments[:] = merge(draft, redecoded, redo)
+
+    # large-only time: measured on the re-decoded audio, else scaled from the draft's
+    if redone_seconds:
+        large_only = redecode_seconds / redone_seconds * duration
+    else:
+        large_only = draft_seconds * SIZE_COST.get(_size(model), 1.0) / SIZE_COST.get(
+            _size(draft_name), 1.0)
+    report = {'draft': draft_name, 'model': model,
+              'redecoded': round(redone_seconds / max(duration, 1e-6), 4),
+              'speedup': round(large_only / max(draft_seconds + redecode_seconds, 1e-6), 2)}
+    transcript.info = dict(transcript.info or {}, cascade=report)
+    metrics.annotate(cascade=report)
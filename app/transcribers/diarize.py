@@ -0,0 +1,161 @@
+import os
+
+import numpy as np
+
+from . import longform
+from .audio import SAMPLE_RATE
+
+# cosine similarity above which two clusters are the same speaker
+THRESHOLD = float(os.environ.get('TRANSCRIBER_DIARIZE_THRESHOLD', '0.75'))
+
+# speech is embedded in windows of at most this length
+WINDOW_SECONDS = 3.0
+MIN_WINDOW_SECONDS = 0.5
+
+# clusters with fewer windows than this share of the recording are merged into the closest
+MIN_CLUSTER_SHARE = 0.01
+
+# mfcc front end: 25 ms frames every 10 ms, 40 mel bands, 20 coefficients
+FRAME, HOP, N_FFT, N_MELS, N_MFCC = 400, 160, 512, 40, 20
+
+# frames transformed at once, bounds the spectra held in memory on long recordings
+BLOCK_FRAMES = 4096
+
+# the filterbank and dct matrices are built once per process
+_MATRICES = {}
+
+def _matrices(sample_rate: int):
+    """Returns the (mel filterbank, dct) matrices of the front end"""
+    if sample_rate not in _MATRICES:
+        def mel(hz):
+            return 2595 * np.log10(1 + hz / 700)
+
+        def hz(mels):
+            return 700 * (10 ** (mels / 2595) - 1)
+
+        points = hz(np.linspace(mel(20), mel(sample_rate / 2), N_MELS + 2))
+        bins = np.fft.rfftfreq(N_FFT, 1 / sample_rate)
+        lower, centre, upper = points[:-2, None], points[1:-1, None], points[2:, None]
+        filterbank = np.maximum(0, np.minimum((bins - lower) / (centre - lower),
+                                              (upper - bins) / (upper - centre)))
+
+        # dct-ii, dropping c0 which only carries the loudness
+        n = np.arange(N_MELS)
+        dct = np.cos(np.pi / N_MELS * (n + 0.5) * np.arange(1, N_MFCC + 1)[:, None])
+        _MATRICES[sample_rate] = (filterbank.astype(np.float32), dct.astype(np.float32))
+    return _MATRICES[sample_rate]
+
+def mfcc(samples: np.ndarray, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Returns the (frames, N_MFCC) cepstra of the samples, vectorised over blocks of frames"""
+    if len(samples) < FRAME:
+        return np.empty((0, N_MFCC), dtype=np.float32)
+    filterbank, dct = _matrices(sample_rate)
+    window = np.hamming(FRAME).astype(np.float32)
+    # overlapping frames as a strided view, nothing is copied until a block is windowed
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FRAME)[::HOP]
+    result = np.empty((len(frames), N_MFCC), dtype=np.float32)
+    for i in range(0, len(frames), BLOCK_FRAMES):
+        block = frames[i:i + BLOCK_FRAMES] * window
+        power = np.abs(np.fft.rfft(block, N_FFT)).astype(np.float32) ** 2
+        result[i:i + BLOCK_FRAMES] = np.log(power @ filterbank.T + 1e-10) @ dct.T
+    return result
+
+def windows(samples: np.ndarray, sample_rate: int = SAMPLE_RATE) -> list:
+    """Returns (start, end) sample ranges of the speech, cut in windows for embedding
+
+    the speech is found by the same detector as the long-form chunking: silero vad when
+    faster-whisper is installed, the energy detector of longform only without it
+    """
+    size = int(WINDOW_SECONDS * sample_rate)
+    minimum = int(MIN_WINDOW_SECONDS * sample_rate)
+    result = []
+    for span in longform.speech_timestamps(samples):
+        start, end = span['start'], span['end']
+        count = max(1, round((end - start) / size))
+        edges = np.linspace(start, end, count + 1).astype(int)
+        result += [(a, b) for a, b in zip(edges[:-1], edges[1:]) if b - a >= minimum]
+    return result
+
+def embeddings(samples: np.ndarray, spans: list, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Returns one unit-length voice embedding per span: mean and spread of its cepstra"""
+    features = mfcc(samples, sample_rate)
+    # cepstral mean normalisation over the recording removes the channel
+    features -= features.mean(axis=0)
+
+    result = np.empty((len(spans), 2 * N_MFCC), dtype=np.float32)
+    for i, (start, end) in enumerate(spans):
+        frames = features[start // HOP:max(start // HOP + 1, (end - FRAME) // HOP)]
+        result[i, :N_MFCC] = frames.mean(axis=0)
+        result[i, N_MFCC:] = frames.std(axis=0)
+    # scale each dimension over the recording, then project on the unit sphere
+    result = (result - result.mean(axis=0)) / (result.std(axis=0) + 1e-6)
+    return result / (np.linalg.norm(result, axis=1, keepdims=True) + 1e-9)
+
+def cluster(vectors: np.ndarray, threshold: float = THRESHOLD, speakers: int = 0) -> np.ndarray:
+    """Average-linkage agglomerative clustering on cosine similarity, returns a label per row
+
+    merging stops at the given number of speakers, or when no two clusters are more similar
+    than the threshold
+    """
+    n = len(vectors)
+    if n < 2:
+        return np.zeros(n, dtype=int)
+
+    similarity = vectors @ vectors.T
+    np.fill_diagonal(similarity, -np.inf)
+    sizes = np.ones(n)
+    labels = np.arange(n)
+    active = n
+    while active > max(speakers, 1):
+        flat = int(np.argmax(similarity))
+        a, b = divmod(flat, n)
+        if not speakers and similarity[a, b] < threshold:
+            break
+        # average linkage: the merged row is the size-weighted mean of both rows
+        merged = (similarity[a] * sizes[a] + similarity[b] * sizes[b]) / (sizes[a] + sizes[b])
+        similarity[a], similarity[:, a] = merged, merged
+        similarity[a, a] = -np.inf
+        similarity[b], similarity[:, b] = -np.inf, -np.inf
+        sizes[a] += sizes[b]
+        labels[labels == b] = a
+        active -= 1
+
+    # a cluster of a few stray windows (a cough, laughter) is not a speaker of its own
+    ids, counts = np.unique(labels, return_counts=True)
+    large = ids[counts >= max(2, MIN_CLUSTER_SHARE * n)]
+    if not speakers and 0 < len(large) < len(ids):
+        centroids = np.stack([vectors[labels == i].mean(axis=0) for i in large])
+        stray = ~np.isin(labels, large)
+        labels[stray] = large[np.argmax(vectors[stray] @ centroids.T, axis=1)]
+
+    # number the speakers in order of first appearance
+    _, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    order = np.argsort(np.argsort(first))
+    return order[inverse]
+
+def assign(transcript, spans: list, labels: np.ndarray, sample_rate: int = SAMPLE_RATE) -> None:
+    """Labels every segment with the speaker who talks longest during it"""
+    if not len(spans):
+        return
+    starts = np.array([start for start, _ in spans]) / sample_rate
+    ends = np.array([end for _, end in spans]) / sample_rate
+    count = int(labels.max()) + 1
+    for segment in transcript:
+        overlap = np.clip(np.minimum(ends, segment.end) - np.maximum(starts, segment.start),
+                          0, None)
+        if overlap.any():
+            talk = np.bincount(labels, weights=overlap, minlength=count)
+            segment.speaker = f"Speaker {int(np.argmax(talk)) + 1}"
+
+def diarize(transcript, samples: np.ndarray, speakers: int = 0,
+            sample_rate: int = SAMPLE_RATE) -> None:
+    """Sets the speaker of each segment from the decoded samples of its recording
+
+    speech found by the voice activity detector is embedded in windows of mfcc statistics,
+    clustered by cosine similarity, and each segment gets the speaker talking longest in it
+    """
+    spans = windows(samples, sample_rate)
+    if not spans:
+        return
+    labels = cluster(embeddings(samples, spans, sample_rate), speakers=speakers)
+    assign(transcript, spans, labels, sample_rate)
@@ -0,0 +1,613 @@
+from contextlib import closing
+from pathlib import Path
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+from . import audio, batch, library, metrics, uploads
+from .transcript import Transcript
+
+# the queue database and the spooled uploads, only readable by the user running the app
+JOBS_DIR = Path(os.environ.get('TRANSCRIBER_JOBS_DIR',
+                               Path.home().joinpath('.cache', 'offline-transcription', 'jobs')))
+
+# fixed number of worker processes, the server's load doesn't grow with the sessions
+# (0 picks cores // TRANSCRIBER_WORKER_THREADS, as batch.plan_workers does)
+JOB_WORKERS = int(os.environ.get('TRANSCRIBER_JOB_WORKERS', '0'))
+
+# admission control: submissions waiting or running, in total and for one session; a batch
+# of files is admitted as one submission, up to MAX_BATCH_FILES of them
+MAX_PENDING = int(os.environ.get('TRANSCRIBER_MAX_PENDING', '20'))
+MAX_PENDING_PER_SESSION = int(os.environ.get('TRANSCRIBER_MAX_PENDING_PER_SESSION', '10'))
+MAX_BATCH_FILES = int(os.environ.get('TRANSCRIBER_MAX_BATCH_FILES', '100'))
+
+# a job whose worker died this many times (out of memory, a crashing decoder) is failed
+# rather than handed to the next worker
+MAX_ATTEMPTS = int(os.environ.get('TRANSCRIBER_JOB_ATTEMPTS', '3'))
+
+# finished jobs are kept this long for the sessions to collect them
+RETENTION_SECONDS = float(os.environ.get('TRANSCRIBER_JOB_RETENTION_HOURS', '2')) * 3600
+
+# seconds between polls of an idle worker, and between progress writes of a busy one
+POLL_SECONDS = 0.5
+PROGRESS_SECONDS = 1.0
+
+# models every worker loads when it starts, so the first job doesn't wait for them
+WARMUP_MODELS = [model.strip() for model in
+                 os.environ.get('TRANSCRIBER_WARMUP_MODELS', 'large-v2').split(',')
+                 if model.strip()]
+
+# number of segments kept for the live preview
+PREVIEW_SEGMENTS = 12
+
+# seconds of decoding per second of audio assumed for a model until its jobs measured it
+MODEL_RTF = {'tiny': 0.05, 'base': 0.08, 'small': 0.2, 'medium': 0.45, 'large': 0.9,
+             'vosk-small': 0.1, 'vosk-large': 0.25}
+
+# audio length assumed for an upload ffprobe couldn't measure (or still arriving)
+UNKNOWN_DURATION = 1800.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    session TEXT NOT NULL,
+    name TEXT NOT NULL,
+    model TEXT NOT NULL,
+    options TEXT NOT NULL,
+    input_path TEXT NOT NULL,
+    duration REAL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    preview TEXT,
+    result TEXT,
+    error TEXT,
+    worker INTEGER,
+    cached INTEGER NOT NULL DEFAULT 0,
+    batch TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+"""
+
+# states a job moves through
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+class JobQueue:
+    """SQLite-backed queue of transcription jobs shared by the server and its workers"""
+
+    def __init__(self, directory: Path = JOBS_DIR):
+        self.directory = Path(directory)
+        self.inputs = self.directory.joinpath('inputs')
+        self.inputs.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self.db_path = self.directory.joinpath('jobs.sqlite3')
+        with closing(self._connect()) as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(SCHEMA)
+            # queues created before cache hits were recorded
+            columns = {row['name'] for row in db.execute('PRAGMA table_info(jobs)')}
+            if 'cached' not in columns:
+                db.execute('ALTER TABLE jobs ADD COLUMN cached INTEGER NOT NULL DEFAULT 0')
+            # and before batches were admitted as one submission
+            if 'batch' not in columns:
+                db.execute('ALTER TABLE jobs ADD COLUMN batch TEXT')
+            # and before the attempts of a job were counted
+            if 'attempts' not in columns:
+                db.execute('ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+
+    def _connect(self) -> sqlite3.Connection:
+        """Opens a connection, one per call so threads and processes never share one"""
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def _admit(self, session: str, db: sqlite3.Connection = None, files: int = 1) -> None:
+        """Raises QueueFull when the queue or the session is at its limit
+
+        the limits count submissions, the files of a batch only take one place together
+        """
+        if files > MAX_BATCH_FILES:
+            raise QueueFull(f"A batch can hold at most {MAX_BATCH_FILES} files")
+        if db is None:
+            with closing(self._connect()) as db:
+                return self._admit(session, db, files)
+        pending, own = db.execute(
+            "SELECT COUNT(DISTINCT COALESCE(batch, id)), "
+            "COUNT(DISTINCT CASE WHEN session = ? THEN COALESCE(batch, id) END) FROM jobs "
+            "WHERE status IN (?, ?)", (session, QUEUED, RUNNING)).fetchone()
+        if pending >= MAX_PENDING:
+            raise QueueFull("The transcription queue is full, please try again later")
+        if own >= MAX_PENDING_PER_SESSION:
+            raise QueueFull("You already have the maximum number of transcriptions waiting")
+
+    def _insert(self, session: str, entries: list, model: str, options: dict,
+                batch_id: str = None) -> list:
+        """Queues (job id, name, input path) entries as one submission, returns their ids"""
+        with metrics.stage('probe'):
+            durations = [audio.probe_duration(input_path) for _, _, input_path in entries]
+
+        # counted again with the insert, concurrent submits may have passed the first check
+        with closing(self._connect()) as db:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                self._admit(session, db, len(entries))
+                db.executemany(
+                    "INSERT INTO jobs (id, session, name, model, options, input_path, duration, "
+                    "status, batch, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(job_id, session, name, model, json.dumps(options), str(input_path),
+                      duration, QUEUED, batch_id, time.time())
+                     for (job_id, name, input_path), duration in zip(entries, durations)])
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+
+        return [job_id for job_id, _, _ in entries]
+
+    def _spool(self, source) -> tuple:
+        """Copies an upload to disk in chunks, returns (job id, path)"""
+        # the workers are separate processes, so the upload is copied once to disk
+        job_id = uuid.uuid4().hex
+        input_path = self.inputs.joinpath(job_id)
+        try:
+            with metrics.stage('spool'):
+                fd = os.open(input_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                with os.fdopen(fd, 'wb') as f:
+                    source.seek(0)
+                    shutil.copyfileobj(source, f, audio.CHUNK_SIZE)
+        except BaseException:
+            input_path.unlink(missing_ok=True)
+            raise
+        return job_id, input_path
+
+    def submit(self, source, name: str, model: str, options: dict, session: str = '') -> str:
+        """Spools the upload to disk and queues it, raising QueueFull beyond the limits"""
+        return self.submit_batch([(source, name)], model, options, session)[0]
+
+    def submit_batch(self, files, model: str, options: dict, session: str = '') -> list:
+        """Spools (file-like source, name) pairs and queues them as one submission
+
+        either every file is queued or, beyond the limits, none is and QueueFull is raised.
+        Returns the job ids in the order of the files
+        """
+        # checked before the copy too, a full queue doesn't cost a spooled upload
+        self._admit(session, files=len(files))
+
+        entries = []
+        try:
+            for source, name in files:
+                job_id, input_path = self._spool(source)
+                entries.append((job_id, name, input_path))
+            return self._insert(session, entries, model, options,
+                                uuid.uuid4().hex if len(entries) > 1 else None)
+        except BaseException:
+            # refused or failed, no job will ever remove the spooled copies
+            for _, _, input_path in entries:
+                input_path.unlink(missing_ok=True)
+            raise
+
+    def submit_upload(self, upload_id: str, model: str, options: dict,
+                      session: str = '') -> str:
+        """Queues a chunked upload where it is spooled, possibly before it has all arrived"""
+        info = uploads.status(upload_id)
+        if info is None or not info['received']:
+            raise ValueError("The upload hasn't started yet")
+        self._admit(session)
+
+        # the worker tails the spool while the rest of the upload arrives, nothing is copied
+        options = dict(options, upload=upload_id)
+        return self._insert(session, [(uuid.uuid4().hex, info['name'], uploads.path(upload_id))],
+                            model, options)[0]
+
+    def get(self, job_id: str):
+        """Returns the job as a dict, with the transcript once it is done, or None"""
+        with closing(self._connect()) as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = dict(row)
+        job['options'] = json.loads(job['options'])
+        for field in ('preview', 'result'):
+            if job[field]:
+                job[field] = Transcript.from_dict(json.loads(job[field]))
+        return job
+
+    def _rtf(self, db: sqlite3.Connection) -> dict:
+        """Returns the decoding seconds per audio second of each model, measured when possible
+
+        the jobs of every variant of a model (large-v2, large-v3, small.en) are added up, those
+        served from the transcript cache are left out
+        """
+        rtf = dict(MODEL_RTF)
+        db.create_function('model_key', 1, _model_key, deterministic=True)
+        rows = db.execute(
+            "SELECT model_key(model), SUM(finished - started), SUM(duration) FROM jobs "
+            "WHERE status = ? AND NOT cached AND duration > 0 GROUP BY model_key(model)",
+            (DONE,)).fetchall()
+        for key, seconds, duration in rows:
+            rtf[key] = seconds / duration
+        return rtf
+
+    def _schedule(self, db: sqlite3.Connection):
+        """Returns (queued jobs in the order they will start, running jobs, model costs)"""
+        queued = [dict(row) for row in db.execute(
+            "SELECT id, session, model, duration, created FROM jobs WHERE status = ?",
+            (QUEUED,))]
+        running = [dict(row) for row in db.execute(
+            "SELECT id, session, model, duration, started, progress FROM jobs "
+            "WHERE status = ?", (RUNNING,))]
+        rtf = self._rtf(db)
+        return order(queued, running, rtf, time.time()), running, rtf
+
+    def position(self, job_id: str) -> int:
+        """Returns how many queued jobs will start before this one"""
+        with closing(self._connect()) as db:
+            queued, _, _ = self._schedule(db)
+        ids = [job['id'] for job in queued]
+        return ids.index(job_id) if job_id in ids else 0
+
+    def expected_wait(self, job_id: str, workers: int = 0):
+        """Returns the estimated seconds until the job starts, or None when it isn't queued"""
+        workers = workers or plan_workers()[0]
+        with closing(self._connect()) as db:
+            queued, running, rtf = self._schedule(db)
+        return estimate_wait(job_id, queued, running, rtf, time.time(), workers)
+
+    def cancel(self, job_id: str) -> None:
+        """Cancels a job, a running job stops at its next progress update"""
+        with closing(self._connect()) as db:
+            db.execute("UPDATE jobs SET status = ?, finished = ? WHERE id = ? AND status IN (?, ?)",
+                       (CANCELLED, time.time(), job_id, QUEUED, RUNNING))
+
+    def claim(self, worker: int):
+        """Atomically moves the next job (see order()) to running and returns it, or None"""
+        with closing(self._connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            queued, _, _ = self._schedule(db)
+            if not queued:
+                db.execute("COMMIT")
+                return None
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (queued[0]['id'],)).fetchone()
+            db.execute("UPDATE jobs SET status = ?, worker = ?, started = ?, "
+                       "attempts = attempts + 1 WHERE id = ?",
+                       (RUNNING, worker, time.time(), row['id']))
+            db.execute("COMMIT")
+        return dict(row)
+
+    def update(self, job_id: str, progress: float, preview: Transcript) -> bool:
+        """Records the progress of a running job, returns False when it was cancelled"""
+        with closing(self._connect()) as db:
+            cursor = db.execute(
+                "UPDATE jobs SET progress = ?, preview = ? WHERE id = ? AND status = ?",
+                (progress, json.dumps(preview.to_dict()), job_id, RUNNING))
+        return cursor.rowcount == 1
+
+    def finish(self, job_id: str, transcript: Transcript = None, error: str = None,
+               cached: bool = False) -> None:
+        """Stores the outcome of a job and removes its spooled upload
+
+        cached marks a transcript replayed from the cache, its timing isn't a measurement
+        """
+        with closing(self._connect()) as db:
+            row = db.execute("SELECT input_path FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if transcript is not None:
+                db.execute("UPDATE jobs SET status = ?, progress = 1, result = ?, finished = ?, "
+                           "cached = ? WHERE id = ? AND status = ?",
+                           (DONE, json.dumps(transcript.to_dict()), time.time(), int(cached),
+                            job_id, RUNNING))
+            else:
+                db.execute("UPDATE jobs SET status = ?, error = ?, finished = ? "
+                           "WHERE id = ? AND status = ?",
+                           (FAILED, error, time.time(), job_id, RUNNING))
+        if row is not None:
+            Path(row['input_path']).unlink(missing_ok=True)
+
+    def requeue_orphans(self) -> None:
+        """Puts back the running jobs whose worker process no longer exists
+
+        a job that took down its worker MAX_ATTEMPTS times fails instead, it would only take
+        down the next one
+        """
+        with closing(self._connect()) as db:
+            rows = db.execute("SELECT id, worker, attempts, input_path FROM jobs "
+                              "WHERE status = ?", (RUNNING,)).fetchall()
+            for row in rows:
+                if _alive(row['worker']):
+                    continue
+                if row['attempts'] < MAX_ATTEMPTS:
+                    db.execute("UPDATE jobs SET status = ?, worker = NULL WHERE id = ? "
+                               "AND status = ?", (QUEUED, row['id'], RUNNING))
+                    continue
+                cursor = db.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ? "
+                    "AND status = ?",
+                    (FAILED, f"the transcription stopped its worker {row['attempts']} times, "
+                     "the file may be too long for the server's memory", time.time(),
+                     row['id'], RUNNING))
+                if cursor.rowcount:
+                    metrics.inc('transcriber_jobs_abandoned_total')
+                    Path(row['input_path']).unlink(missing_ok=True)
+
+    def pending_inputs(self) -> list:
+        """Returns the input paths of the queued and running jobs"""
+        with closing(self._connect()) as db:
+            rows = db.execute("SELECT input_path FROM jobs WHERE status IN (?, ?)",
+                              (QUEUED, RUNNING)).fetchall()
+        return [row['input_path'] for row in rows]
+
+    def purge(self) -> None:
+        """Deletes the finished jobs and their uploads after the retention period"""
+        cutoff = time.time() - RETENTION_SECONDS
+        with closing(self._connect()) as db:
+            rows = db.execute("SELECT id, input_path FROM jobs WHERE finished < ?",
+                              (cutoff,)).fetchall()
+            for row in rows:
+                Path(row['input_path']).unlink(missing_ok=True)
+                db.execute("DELETE FROM jobs WHERE id = ?", (row['id'],))
+
+# ------------------------- scheduling -------------------------
+def _model_key(model: str) -> str:
+    """Returns the MODEL_RTF entry of a model name, e.g. large-v3 and small.en"""
+    model = model.removesuffix('.en')
+    return model if model[0:4] == 'vosk' else model.split('-')[0]
+
+def cost(job: dict, rtf: dict) -> float:
+    """Returns the estimated decoding seconds of a job, from its duration and model"""
+    return (job['duration'] or UNKNOWN_DURATION) * rtf.get(_model_key(job['model']), 1.0)
+
+def order(queued: list, running: list, rtf: dict, now: float) -> list:
+    """Returns the queued jobs in the order the workers will take them
+
+    fair share first: the next job comes from the session with the fewest jobs running or
+    picked before it, so one session's long uploads never hold up everyone else. Within that,
+    shortest estimated job first, less the time it has waited: a long job rises as it waits,
+    so it is never starved
+    """
+    taken = {}
+    for job in running:
+        taken[job['session']] = taken.get(job['session'], 0) + 1
+
+    def priority(job):
+        return (taken.get(job['session'], 0), cost(job, rtf) - (now - job['created']),
+                job['created'])
+
+    remaining = list(queued)
+    result = []
+    while remaining:
+        job = min(remaining, key=priority)
+        remaining.remove(job)
+        result.append(job)
+        taken[job['session']] = taken.get(job['session'], 0) + 1
+    return result
+
+def estimate_wait(job_id: str, queued: list, running: list, rtf: dict, now: float,
+                  workers: int):
+    """Returns the estimated seconds until a queued job starts, or None when it isn't queued
+
+    the running jobs' remaining time and the estimated cost of the jobs ahead are handed to
+    the workers in start order, each job going to the worker that frees up first
+    """
+    free = []
+    for job in running:
+        elapsed = now - (job['started'] or now)
+        if job['progress']:
+            remaining = elapsed * (1.0 - job['progress']) / job['progress']
+        else:
+            remaining = max(cost(job, rtf) - elapsed, 0.0)
+        free.append(remaining)
+    # idle workers are free now
+    free += [0.0] * max(workers - len(free), 0)
+    free.sort()
+
+    for job in queued:
+        start = free.pop(0) if free else 0.0
+        if job['id'] == job_id:
+            return start
+        free.append(start + cost(job, rtf))
+        free.sort()
+    return None
+
+# check a worker pid without signalling it
+def _alive(pid) -> bool:
+    """Returns True when a process with this pid exists"""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+# ------------------------- worker process side -------------------------
+def run_job(queue: JobQueue, job: dict) -> None:
+    """Transcribes one claimed job, writing its progress and preview as it decodes"""
+    options = json.loads(job['options'])
+    model, path = job['model'], job['input_path']
+    with metrics.job(job['id'], model=model, duration=job['duration'], **options) as record:
+        # the job was claimed just now, so it waited since it was created
+        wait = time.time() - job['created']
+        metrics.observe('transcriber_stage_seconds', wait, stage='queue_wait')
+        record['stages']['queue_wait'] = round(wait, 4)
+        record['status'] = _run(queue, job, options, model, path)
+
+def _run(queue: JobQueue, job: dict, options: dict, model: str, path: str) -> str:
+    """Decodes the job's upload and returns its final status"""
+    source = path
+    # a chunked upload still arriving is decoded as it comes in
+    upload = options.pop('upload', None)
+    if upload is not None:
+        info = uploads.status(upload)
+        if info is not None and not info['complete']:
+            source = uploads.TailReader(upload)
+    try:
+        with metrics.stage('transcribe', backend='vosk' if model[0:4] == 'vosk' else 'whisper'):
+            if model[0:4] == 'vosk':
+                from . import vosk
+                segments, transcript = vosk.stream(source, model, options['eo'],
+                                                   options.get('diarization', False))
+            else:
+                from . import whisper
+                segments, transcript = whisper.stream(source, model, options['eo'],
+                                                      cpu_threads=batch.worker_threads(),
+                                                      long_form=options.get('long_form', False),
+                                                      diarization=options.get('diarization',
+                                                                              False),
+                                                      draft=options.get('draft', False))
+
+            last_update = 0.0
+            for segment, progress in segments:
+                now = time.monotonic()
+                if now - last_update < PROGRESS_SECONDS:
+                    continue
+                last_update = now
+                # backends that can't tell their progress are measured against the probed duration
+                if progress is None and job['duration']:
+                    progress = min(segment.end / job['duration'], 1.0)
+                preview = Transcript(transcript.segments[-PREVIEW_SEGMENTS:])
+                if not queue.update(job['id'], progress or 0.0, preview):
+                    segments.close()
+                    break
+            else:
+                if getattr(source, 'stalled', False):
+                    raise ValueError('the upload stopped before it finished')
+                queue.finish(job['id'], transcript,
+                             cached=metrics.annotation('cached', False))
+                # only what its user chose to share is searchable by everyone
+                if options.get('library'):
+                    _index(job, transcript)
+                return DONE
+        # cancelled, the upload is no longer needed
+        queue.finish(job['id'], error='cancelled')
+        return CANCELLED
+    except Exception as e:
+        queue.finish(job['id'], error=str(e))
+        return FAILED
+    finally:
+        if source is not path:
+            source.close()
+
+def _index(job: dict, transcript: Transcript) -> None:
+    """Adds a finished transcript to the search library, when it is enabled"""
+    try:
+        with metrics.stage('index'):
+            library.add(transcript, job['name'], job['id'], job['session'], job['model'])
+    except Exception:
+        # the transcript is done either way, a library problem only costs its search entry
+        metrics.inc('transcriber_index_errors_total')
+
+def warm_up(models, cpu_threads: int) -> None:
+    """Loads the models into this worker's registry ahead of the first job"""
+    for model in models:
+        try:
+            with metrics.stage('warm_up'):
+                if model[0:4] == 'vosk':
+                    from . import vosk
+                    vosk.load_model(model)
+                else:
+                    from . import whisper
+                    whisper.warm_up(model, cpu_threads)
+        except Exception:
+            # the first job using the model loads it again and reports the error
+            pass
+
+def _worker_main(directory: str, cpu_threads: int, parent: int) -> None:
+    """Loop of a worker process: claim a job, run it, repeat until the server goes away"""
+    batch._init_worker(cpu_threads)
+    metrics.configure_log()
+    queue = JobQueue(Path(directory))
+    warm_up(WARMUP_MODELS, cpu_threads)
+    last_purge = 0.0
+    while os.getppid() == parent:
+        job = queue.claim(os.getpid())
+        if job is not None:
+            run_job(queue, job)
+            continue
+
+        if time.monotonic() - last_purge > 60:
+            queue.purge()
+            uploads.purge(queue.pending_inputs())
+            try:
+                library.purge()
+            except Exception:
+                # tried again at the next round
+                metrics.inc('transcriber_index_errors_total')
+            metrics.write_textfile()
+            last_purge = time.monotonic()
+        time.sleep(POLL_SECONDS)
+
+# ------------------------- server side -------------------------
+def plan_workers():
+    """Returns (workers, cpu_threads) of the job workers, splitting the cores between them"""
+    if JOB_WORKERS > 0:
+        return batch.plan_workers(JOB_WORKERS, max(1, batch.cpu_count() // JOB_WORKERS))
+    return batch.plan_workers(0, batch.DEFAULT_WORKER_THREADS)
+
+_QUEUE = None
+_WORKERS = []
+_LOCK = threading.Lock()
+
+def get_queue() -> JobQueue:
+    """Returns the process-wide queue, starting the worker processes on first use"""
+    global _QUEUE
+    with _LOCK:
+        if _QUEUE is None:
+            _QUEUE = JobQueue()
+        _QUEUE.requeue_orphans()
+
+        # restart workers that died, e.g. killed for running out of memory
+        _WORKERS[:] = [worker for worker in _WORKERS if worker.is_alive()]
+        workers, cpu_threads = plan_workers()
+        context = multiprocessing.get_context('spawn')
+        while len(_WORKERS) < workers:
+            worker = context.Process(target=_worker_main, daemon=True,
+                                     args=(str(_QUEUE.directory), cpu_threads, os.getpid()))
+            worker.start()
+            _WORKERS.append(worker)
+
+        return _QUEUE
+
+def start() -> None:
+    """Starts the worker processes, which warm up their models while the page is in use"""
+    get_queue()
+
+def submit(source, name: str, model: str, options: dict, session: str = '') -> str:
+    """Queues a transcription of the file-like source and returns the job id"""
+    return get_queue().submit(source, name, model, options, session)
+
+def submit_batch(files, model: str, options: dict, session: str = '') -> list:
+    """Queues (file-like source, name) pairs as one submission and returns their job ids"""
+    return get_queue().submit_batch(files, model, options, session)
+
+def submit_upload(upload_id: str, model: str, options: dict, session: str = '') -> str:
+    """Queues a transcription of a chunked upload, arrived or still arriving"""
+    return get_queue().submit_upload(upload_id, model, options, session)
+
+def get(job_id: str):
+    """Returns the job with the given id, or None"""
+    return get_queue().get(job_id)
+
+def position(job_id: str) -> int:
+    """Returns how many queued jobs will start before this one"""
+    return get_queue().position(job_id)
+
+def expected_wait(job_id: str):
+    """Returns the estimated seconds until the queued job starts, or None"""
+    return get_queue().expected_wait(job_id, max(len(_WORKERS), 1))
+
+def cancel(job_id: str) -> None:
+    """Cancels the job with the given id"""
+    get_queue().cancel(job_id)
@@ -0,0 +1,208 @@
+from contextlib import closing
+from pathlib import Path
+import json
+import os
+import re
+import sqlite3
+import time
+
+from .transcript import Transcript
+
+# keep finished transcripts in a searchable library, off unless asked for; with it on, the
+# webapps still only add the transcripts their users choose to share
+ENABLED = os.environ.get('TRANSCRIBER_LIBRARY', '0') == '1'
+
+# transcripts are deleted from the library this long after they were added, 0 keeps them
+RETENTION_SECONDS = float(os.environ.get('TRANSCRIBER_LIBRARY_RETENTION_DAYS', '30')) * 86400
+
+LIBRARY_PATH = Path(os.environ.get('TRANSCRIBER_LIBRARY_PATH',
+                                   Path.home().joinpath('.cache', 'offline-transcription',
+                                                        'library.sqlite3')))
+
+# segments are indexed as they are added, a query never waits for a rebuild
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transcripts (
+    id INTEGER PRIMARY KEY,
+    job_id TEXT UNIQUE,
+    name TEXT NOT NULL,
+    session TEXT NOT NULL DEFAULT '',
+    model TEXT,
+    language TEXT,
+    duration REAL,
+    added REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transcripts_added ON transcripts (added);
+CREATE VIRTUAL TABLE IF NOT EXISTS segments USING fts5(
+    text,
+    speaker,
+    transcript_id UNINDEXED,
+    start_ms UNINDEXED,
+    end_ms UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+# snippet markers around the matched words, stripped from the indexed text so they can't
+# be confused with anything said
+MARK_START, MARK_END = '\x02', '\x03'
+
+# words of a query, a trailing * keeps a prefix search
+_TERM = re.compile(r'\w+\*?', re.UNICODE)
+
+def _match(query: str) -> str:
+    """Turns free text into an fts5 query matching every word, so no input is a syntax error"""
+    terms = []
+    for term in _TERM.findall(query):
+        prefix = term.endswith('*')
+        terms.append('"%s"%s' % (term.rstrip('*'), '*' if prefix else ''))
+    return ' '.join(terms)
+
+def _unmarked(text: str) -> str:
+    return text.replace(MARK_START, '').replace(MARK_END, '')
+
+class Library:
+    """SQLite FTS5 index of finished transcripts, searched segment by segment"""
+
+    def __init__(self, path: Path = LIBRARY_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        with closing(self._connect()) as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Opens a connection, one per call so threads and processes never share one"""
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def add(self, transcript: Transcript, name: str, job_id: str = None, session: str = '',
+            model: str = None) -> int:
+        """Indexes a transcript's segments in one transaction and returns its id
+
+        adding the same job again replaces its earlier copy
+        """
+        with closing(self._connect()) as db:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                if job_id is not None:
+                    self._delete(db, job_id=job_id)
+                cursor = db.execute(
+                    "INSERT INTO transcripts (job_id, name, session, model, language, duration, "
+                    "added, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, name, session, model, transcript.language, transcript.duration,
+                     time.time(), json.dumps(transcript.to_dict())))
+                transcript_id = cursor.lastrowid
+                db.executemany(
+                    "INSERT INTO segments (text, speaker, transcript_id, start_ms, end_ms) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    ((_unmarked(segment.text), segment.speaker or '', transcript_id,
+                      int(round(segment.start * 1000)), int(round(segment.end * 1000)))
+                     for segment in transcript))
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+        return transcript_id
+
+    def _delete(self, db: sqlite3.Connection, transcript_id: int = None, job_id: str = None):
+        if job_id is not None:
+            row = db.execute("SELECT id FROM transcripts WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            transcript_id = row['id']
+        db.execute("DELETE FROM segments WHERE transcript_id = ?", (transcript_id,))
+        db.execute("DELETE FROM transcripts WHERE id = ?", (transcript_id,))
+
+    def remove(self, transcript_id: int) -> None:
+        """Deletes a transcript and its index entries"""
+        with closing(self._connect()) as db:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                self._delete(db, transcript_id)
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+
+    def purge(self, retention_seconds: float = RETENTION_SECONDS) -> int:
+        """Deletes the transcripts added longer ago than the retention, returns how many"""
+        if retention_seconds <= 0:
+            return 0
+        cutoff = time.time() - retention_seconds
+        with closing(self._connect()) as db:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                rows = db.execute("SELECT id FROM transcripts WHERE added < ?",
+                                  (cutoff,)).fetchall()
+                for row in rows:
+                    self._delete(db, row['id'])
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+        return len(rows)
+
+    def search(self, query: str, limit: int = 50, offset: int = 0) -> list:
+        """Returns the best matching segments across the library, best first
+
+        each result has the transcript's id and name, the segment's start_ms and end_ms and
+        a snippet with the matches between MARK_START and MARK_END
+        """
+        match = _match(query)
+        if not match:
+            return []
+        with closing(self._connect()) as db:
+            rows = db.execute(
+                "SELECT s.transcript_id, t.name, s.start_ms, s.end_ms, s.speaker, "
+                "snippet(segments, 0, ?, ?, '…', 16) AS snippet "
+                "FROM segments s JOIN transcripts t ON t.id = s.transcript_id "
+                "WHERE segments MATCH ? ORDER BY rank LIMIT ? OFFSET ?",
+                (MARK_START, MARK_END, match, limit, offset)).fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, transcript_id: int):
+        """Returns (name, transcript) of a library entry, or None"""
+        with closing(self._connect()) as db:
+            row = db.execute("SELECT name, data FROM transcripts WHERE id = ?",
+                             (transcript_id,)).fetchone()
+        if row is None:
+            return None
+        return row['name'], Transcript.from_dict(json.loads(row['data']))
+
+    def stats(self) -> dict:
+        """Returns the number of transcripts, indexed segments and hours of audio"""
+        with closing(self._connect()) as db:
+            transcripts, seconds = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(duration), 0) FROM transcripts").fetchone()
+            segments = db.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+        return {'transcripts': transcripts, 'segments': segments, 'hours': seconds / 3600}
+
+# process-wide library, shared with the workers through the database file
+_LIBRARY = None
+
+def get_library() -> Library:
+    """Returns the process-wide library, creating its database on first use"""
+    global _LIBRARY
+    if _LIBRARY is None:
+        _LIBRARY = Library()
+    return _LIBRARY
+
+def add(transcript: Transcript, name: str, job_id: str = None, session: str = '',
+        model: str = None):
+    """Indexes a finished transcript when the library is enabled, returns its id or None"""
+    if not ENABLED:
+        return None
+    return get_library().add(transcript, name, job_id, session, model)
+
+def kept_for() -> str:
+    """Returns how long a transcript stays in the library, as the pages tell their users"""
+    if RETENTION_SECONDS <= 0:
+        return 'until it is removed'
+    return f"for {RETENTION_SECONDS / 86400:g} days"
+
+def purge() -> None:
+    """Deletes the transcripts past the retention when the library is enabled"""
+    if ENABLED:
+        get_library().purge()
@@ -0,0 +1,145 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .audio import SAMPLE_RATE
+from .transcript import Segment
+
+# longest stretch of speech decoded as one chunk
+MAX_CHUNK_SECONDS = 60
+
+# silences shorter than this are kept inside a chunk
+MIN_SILENCE_SECONDS = 0.5
+
+# fallback when the silero vad bundled with faster-whisper is unavailable
+def energy_speech_timestamps(samples: np.ndarray, sample_rate: int = SAMPLE_RATE,
+                             frame_seconds: float = 0.03,
+                             min_silence_seconds: float = MIN_SILENCE_SECONDS) -> list:
+    """Returns [{'start', 'end'}] sample ranges whose frame energy is above the noise floor"""
+    frame = int(sample_rate * frame_seconds)
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        return []
+
+    # rms energy of every frame in one vectorised pass
+    frames = samples[:n_frames * frame].reshape(n_frames, frame)
+    energy = np.sqrt(np.mean(frames * frames, axis=1))
+
+    # speech is well above the quietest 10% of the recording
+    floor = np.percentile(energy, 10)
+    voiced = energy > max(floor * 3.0, 1e-3)
+
+    # close the gaps shorter than the minimum silence
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], voiced.astype(np.int8), [0]))))
+    starts, ends = edges[0::2], edges[1::2]
+    min_gap = int(min_silence_seconds / frame_seconds)
+    speech = []
+    for start, end in zip(starts, ends):
+        if speech and start - speech[-1][1] < min_gap:
+            speech[-1][1] = end
+        else:
+            speech.append([start, end])
+
+    # keep a little context around each stretch of speech
+    pad = int(0.2 * sample_rate)
+    return [{'start': max(0, int(start * frame) - pad),
+             'end': min(len(samples), int(end * frame) + pad)} for start, end in speech]
+
+# find the speech in the recording
+def speech_timestamps(samples: np.ndarray) -> list:
+    """Returns the speech sample ranges, using silero vad when it is available"""
+    try:
+        from faster_whisper.vad import VadOptions, get_speech_timestamps
+    except ImportError:
+        return energy_speech_timestamps(samples)
+
+    options = VadOptions(min_silence_duration_ms=int(MIN_SILENCE_SECONDS * 1000))
+    return get_speech_timestamps(samples, options)
+
+# group the speech into chunks that can be decoded independently
+def split_on_silence(samples: np.ndarray, sample_rate: int = SAMPLE_RATE,
+                     max_chunk_seconds: float = MAX_CHUNK_SECONDS) -> list:
+    """Returns (start, end) sample ranges that cover the speech and cut only at silences"""
+    max_chunk = int(max_chunk_seconds * sample_rate)
+    chunks = []
+    for span in speech_timestamps(samples):
+        start, end = span['start'], span['end']
+        # grow the current chunk while it stays under the maximum length
+        if chunks and end - chunks[-1][0] <= max_chunk:
+            chunks[-1][1] = end
+            continue
+        # speech without any pause is cut at the maximum length
+        while end - start > max_chunk:
+            chunks.append([start, start + max_chunk])
+            start += max_chunk
+        chunks.append([start, end])
+
+    return [(start, end) for start, end in chunks]
+
+def to_segment(segment, offset: float = 0.0) -> Segment:
+    """Converts a faster_whisper segment, keeping its word timings when it has them"""
+    words = None
+    if segment.words:
+        words = [(offset + w.start, offset + w.end, w.word) for w in segment.words]
+    return Segment(offset + segment.start, offset + segment.end, segment.text, words)
+
+def transcribe_chunks(fw_model, samples: np.ndarray, workers: int,
+                      sample_rate: int = SAMPLE_RATE, **options):
+    """Decodes the speech chunks concurrently and yields (segment, progress) in time order"""
+    chunks = split_on_silence(samples, sample_rate)
+
+    def decode(chunk):
+        start, end = chunk
+        offset = start / sample_rate
+        segments, _ = fw_model.transcribe(samples[start:end], **options)
+        return [to_segment(seg, offset) for seg in segments]
+
+    # ctranslate2 releases the GIL, so threads decode in parallel on the model's replicas
+    pool = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        futures = [pool.submit(decode, chunk) for chunk in chunks]
+        for (_, end), future in zip(chunks, futures):
+            progress = end / max(len(samples), 1)
+            for segment in future.result():
+                yield segment, progress
+    finally:
+        # stop the remaining chunks when the caller gives up early
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def transcribe_stream(fw_model, blocks, options: dict, sample_rate: int = SAMPLE_RATE,
+                      max_chunk_seconds: float = MAX_CHUNK_SECONDS):
+    """Decodes audio arriving in blocks of samples, yields (segment, seconds decoded)
+
+    the audio is cut at silences like split_on_silence, and each chunk is decoded as soon
+    as the speech after it has begun, so decoding keeps up with an upload instead of
+    waiting for its end. The language found in the first chunk is set in options, the
+    later chunks are decoded in it
+    """
+    max_chunk = int(max_chunk_seconds * sample_rate)
+    pending = np.empty(0, dtype=np.float32)
+    # samples of the audio before pending
+    offset = 0
+
+    def decode(start, end):
+        segments, info = fw_model.transcribe(pending[start:end], **options)
+        options.setdefault('language', info.language)
+        for segment in segments:
+            yield to_segment(segment, (offset + start) / sample_rate), (offset + end) / sample_rate
+
+    for block in blocks:
+        pending = np.concatenate((pending, block))
+        if len(pending) < 2 * max_chunk:
+            continue
+        chunks = split_on_silence(pending, sample_rate, max_chunk_seconds)
+        # a last chunk reaching the end may go on in the audio to come, it waits for it
+        if chunks and len(pending) - chunks[-1][1] < 2 * MIN_SILENCE_SECONDS * sample_rate:
+            cut = chunks.pop()[0]
+        else:
+            cut = len(pending)
+        for start, end in chunks:
+            yield from decode(start, end)
+        offset += cut
+        pending = pending[cut:]
+
+    for start, end in split_on_silence(pending, sample_rate, max_chunk_seconds):
+        yield from decode(start, end)
@@ -0,0 +1,358 @@
+from contextlib import contextmanager
+from pathlib import Path
+import contextvars
+import json
+import logging
+import multiprocessing.util
+import os
+import resource
+import threading
+import time
+import uuid
+
+# snapshots of every process and the per-job log, set TRANSCRIBER_METRICS=0 to disable
+METRICS_DIR = Path(os.environ.get('TRANSCRIBER_METRICS_DIR',
+                                  Path.home().joinpath('.cache', 'offline-transcription',
+                                                       'metrics')))
+ENABLED = os.environ.get('TRANSCRIBER_METRICS', '1') != '0'
+
+# local port of the prometheus endpoint, 0 only writes the metrics file
+PORT = int(os.environ.get('TRANSCRIBER_METRICS_PORT', '0'))
+
+# seconds between two snapshots of a process
+FLUSH_SECONDS = 5.0
+
+# snapshots of processes that stopped this long ago are dropped
+STALE_SECONDS = 7 * 24 * 3600
+
+# gauges are current values, those of a process that stopped updating them are ignored sooner
+GAUGE_STALE_SECONDS = 5 * 60
+
+# upper bounds of the histogram buckets, from a quick export to a long recording
+BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+# memory histograms (names ending in _bytes) are bucketed from 256 MB to 32 GB
+MEMORY_BUCKETS = tuple(2 ** i * 1024 ** 2 for i in range(8, 16))
+
+DESCRIPTIONS = {
+    'transcriber_stage_seconds': 'Time spent in each stage of a transcription',
+    'transcriber_jobs_total': 'Transcription jobs by final status',
+    'transcriber_jobs_abandoned_total': 'Jobs failed after their worker died on every attempt',
+    'transcriber_audio_seconds_total': 'Seconds of audio transcribed',
+    'transcriber_job_peak_rss_bytes': 'Peak resident memory of the process running a job',
+    'transcriber_sessions_total': 'Browser sessions opened',
+    'transcriber_workspace_bytes': 'Bytes held in the session workspaces, by storage',
+    'transcriber_workspaces': 'Session workspaces holding files',
+}
+
+# structured per-job log, one json object per line
+LOG = logging.getLogger('transcribers.jobs')
+
+# stage timings of the job running in this context
+_JOB = contextvars.ContextVar('transcriber_job', default=None)
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+def _buckets(name: str) -> tuple:
+    return MEMORY_BUCKETS if name.endswith('_bytes') else BUCKETS
+
+def rss_bytes() -> int:
+    """Returns the current resident memory of this process"""
+    try:
+        with open('/proc/self/statm', encoding='ascii') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is the peak, in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def peak_rss_bytes() -> int:
+    """Returns the peak resident memory of this process"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class Metrics:
+    """Counters and histograms of one process, snapshotted to a file for the exporter"""
+
+    def __init__(self, directory: Path = METRICS_DIR):
+        self.directory = Path(directory)
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        # one snapshot written at a time, a slow write never overtakes a newer one
+        self._write_lock = threading.Lock()
+        self._last_flush = 0.0
+        # a reused pid must not overwrite the snapshot of an earlier process
+        self._name = f"{os.getpid()}-{int(time.time())}"
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        """Adds value to a counter"""
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+        self._maybe_flush()
+
+    def set(self, name: str, value: float, **labels) -> None:
+        """Sets a gauge to its current value"""
+        key = _key(name, labels)
+        with self._lock:
+            self.gauges[key] = value
+        self._maybe_flush()
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Records a value in a histogram"""
+        key = _key(name, labels)
+        with self._lock:
+            bounds = _buckets(name)
+            counts, total, count = self.histograms.get(key, ([0] * len(bounds), 0.0, 0))
+            # counts are per bucket here, cumulative sums are built when rendering
+            for i, bound in enumerate(bounds):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self.histograms[key] = (counts, total + value, count + 1)
+        self._maybe_flush()
+
+    def _maybe_flush(self) -> None:
+        # a thread finding another one writing leaves the snapshot to it
+        if (ENABLED and time.monotonic() - self._last_flush >= FLUSH_SECONDS
+                and self._write_lock.acquire(blocking=False)):
+            try:
+                self._write()
+            finally:
+                self._write_lock.release()
+
+    def flush(self) -> None:
+        """Writes this process's metrics to its snapshot file"""
+        if not ENABLED:
+            return
+        with self._write_lock:
+            self._write()
+
+    def _write(self) -> None:
+        with self._lock:
+            self._last_flush = time.monotonic()
+            # the bucket counts are copied, observe() keeps updating the lists
+            snapshot = {
+                'counters': [[name, dict(labels), value]
+                             for (name, labels), value in self.counters.items()],
+                'gauges': [[name, dict(labels), value]
+                           for (name, labels), value in self.gauges.items()],
+                'histograms': [[name, dict(labels), list(counts), total, count]
+                               for (name, labels), (counts, total, count)
+                               in self.histograms.items()],
+            }
+        try:
+            self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+            path = self.directory.joinpath(f"{self._name}.json")
+            tmp = path.with_suffix('.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp, path)
+        except OSError:
+            # metrics must never fail a transcription
+            pass
+
+# process-wide metrics, every process (server, job workers, batch workers) has its own
+METRICS = Metrics()
+
+# the last seconds of counts are written when the process exits; multiprocessing children
+# skip atexit, but run their finalizers, as does the main process
+multiprocessing.util.Finalize(None, METRICS.flush, exitpriority=0)
+
+def inc(name: str, value: float = 1.0, **labels) -> None:
+    """Adds value to a counter of this process"""
+    if ENABLED:
+        METRICS.inc(name, value, **labels)
+
+def gauge(name: str, value: float, **labels) -> None:
+    """Sets a gauge of this process, the exporter adds up those of every process"""
+    if ENABLED:
+        METRICS.set(name, value, **labels)
+
+def observe(name: str, value: float, **labels) -> None:
+    """Records a value in a histogram of this process"""
+    if ENABLED:
+        METRICS.observe(name, value, **labels)
+
+@contextmanager
+def stage(name: str, **labels):
+    """Times a stage into the stage histogram and the log record of the current job"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe('transcriber_stage_seconds', elapsed, stage=name, **labels)
+        record = _JOB.get()
+        if record is not None:
+            record['stages'][name] = round(record['stages'].get(name, 0.0) + elapsed, 4)
+            record['rss_bytes'][name] = rss_bytes()
+
+@contextmanager
+def job(job_id: str, **fields):
+    """Collects the stages run inside the block and logs them as one json line per job"""
+    record = dict(fields, job=job_id, stages={}, rss_bytes={}, status='done')
+    token = _JOB.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException:
+        record['status'] = 'failed'
+        raise
+    finally:
+        _JOB.reset(token)
+        record['seconds'] = round(time.perf_counter() - start, 4)
+        record['peak_rss_bytes'] = peak_rss_bytes()
+        inc('transcriber_jobs_total', status=record['status'])
+        if record.get('duration'):
+            inc('transcriber_audio_seconds_total', record['duration'])
+        observe('transcriber_job_peak_rss_bytes', record['peak_rss_bytes'])
+        LOG.info(json.dumps(record))
+        METRICS.flush()
+
+def annotate(**fields) -> None:
+    """Adds fields to the log record of the current job, if there is one"""
+    record = _JOB.get()
+    if record is not None:
+        record.update(fields)
+
+def annotation(name: str, default=None):
+    """Returns a field of the current job's log record, default outside a job"""
+    record = _JOB.get()
+    return default if record is None else record.get(name, default)
+
+def configure_log() -> None:
+    """Sends the per-job records to jobs.log in the metrics directory"""
+    if not ENABLED or LOG.handlers:
+        return
+    try:
+        METRICS_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+        handler = logging.FileHandler(METRICS_DIR.joinpath('jobs.log'), encoding='utf-8')
+    except OSError:
+        return
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    LOG.addHandler(handler)
+    LOG.setLevel(logging.INFO)
+    LOG.propagate = False
+
+# ------------------------- exporter side -------------------------
+def _collect(directory: Path):
+    """Sums the snapshots of every process, dropping those of long gone processes"""
+    counters, gauges, histograms = {}, {}, {}
+    now = time.time()
+    for path in directory.glob('*.json'):
+        try:
+            age = now - path.stat().st_mtime
+            if age > STALE_SECONDS:
+                path.unlink(missing_ok=True)
+                continue
+            with open(path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, labels, value in snapshot['counters']:
+            key = _key(name, labels)
+            counters[key] = counters.get(key, 0.0) + value
+        # snapshots written before gauges existed have none
+        for name, labels, value in snapshot.get('gauges', ()):
+            if age <= GAUGE_STALE_SECONDS:
+                key = _key(name, labels)
+                gauges[key] = gauges.get(key, 0.0) + value
+        for name, labels, counts, total, count in snapshot['histograms']:
+            key = _key(name, labels)
+            old_counts, old_total, old_count = histograms.get(key, ([0] * len(counts), 0.0, 0))
+            histograms[key] = ([a + b for a, b in zip(old_counts, counts)],
+                               old_total + total, old_count + count)
+    return counters, gauges, histograms
+
+def _escape(value) -> str:
+    """Escapes a label value as the text format requires"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels, extra: str = '') -> str:
+    items = [f'{k}="{_escape(v)}"' for k, v in labels]
+    if extra:
+        items.append(extra)
+    return '{' + ','.join(items) + '}' if items else ''
+
+def render(directory: Path = METRICS_DIR) -> str:
+    """Returns the metrics of all processes in the prometheus text format"""
+    METRICS.flush()
+    counters, gauges, histograms = _collect(Path(directory))
+    lines = []
+    described = set()
+
+    def header(name, kind):
+        if name not in described:
+            described.add(name)
+            lines.append(f"# HELP {name} {DESCRIPTIONS.get(name, name)}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, 'counter')
+        lines.append(f"{name}{_labels(labels)} {value:g}")
+    for (name, labels), value in sorted(gauges.items()):
+        header(name, 'gauge')
+        lines.append(f"{name}{_labels(labels)} {value:g}")
+    for (name, labels), (counts, total, count) in sorted(histograms.items()):
+        header(name, 'histogram')
+        cumulative = 0
+        for bound, bucket in zip(_buckets(name), counts):
+            cumulative += bucket
+            le = 'le="%s"' % bound
+            lines.append(f"{name}_bucket{_labels(labels, le)} {cumulative}")
+        le = 'le="+Inf"'
+        lines.append(f"{name}_bucket{_labels(labels, le)} {count}")
+        lines.append(f"{name}_sum{_labels(labels)} {total:g}")
+        lines.append(f"{name}_count{_labels(labels)} {count}")
+    return '\n'.join(lines) + '\n'
+
+def write_textfile(directory: Path = METRICS_DIR) -> None:
+    """Writes the combined metrics to metrics.prom, for node_exporter's textfile collector"""
+    path = Path(directory).joinpath('metrics.prom')
+    # every process may write the file, each through a temporary file of its own
+    tmp = path.with_name(f"metrics.{os.getpid()}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(render(directory))
+        os.replace(tmp, path)
+    except OSError:
+        tmp.unlink(missing_ok=True)
+
+_SERVER = None
+_SERVER_LOCK = threading.Lock()
+
+def serve(port: int = PORT) -> None:
+    """Starts the /metrics endpoint on localhost once per process, when a port is set"""
+    global _SERVER
+    if not ENABLED or not port or _SERVER is not None:
+        return
+    # http.server is imported here, it costs every page's cold start otherwise
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    with _SERVER_LOCK:
+        if _SERVER is not None:
+            return
+        try:
+            _SERVER = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        except OSError:
+            # another app on this machine already serves the same metrics directory
+            _SERVER = False
+            return
+        threading.Thread(target=_SERVER.serve_forever, daemon=True).start()
@@ -0,0 +1,122 @@
+from typing import NamedTuple
+import os
+import subprocess
+
+from . import registry
+from .batch import cpu_count
+
+# memory (GB) kept free beside the weights for activations, beams and the audio
+GPU_HEADROOM_GB = float(os.environ.get('TRANSCRIBER_GPU_HEADROOM_GB', '1.0'))
+RAM_HEADROOM_GB = float(os.environ.get('TRANSCRIBER_RAM_HEADROOM_GB', '1.0'))
+
+# set TRANSCRIBER_DEVICE=cpu to never use a GPU
+DEVICE = os.environ.get('TRANSCRIBER_DEVICE', 'auto')
+
+# threads per chunk decoder in long-form mode
+LONG_FORM_THREADS = 4
+
+# compute types from the fastest to the smallest, the first that fits is used
+GPU_COMPUTE_TYPES = ('float16', 'int8_float16', 'int8')
+CPU_COMPUTE_TYPES = ('int8', 'float32')
+
+class ModelTooLarge(MemoryError):
+    """Raised when a model fits neither in the GPU's nor in the machine's free memory"""
+
+class Plan(NamedTuple):
+    """How a whisper model is loaded and run for one job"""
+    device: str
+    compute_type: str
+    cpu_threads: int
+    num_workers: int
+
+# ctranslate2 reports the gpus itself, torch isn't needed for it
+def gpu_count() -> int:
+    """Returns the number of CUDA devices ctranslate2 can use"""
+    try:
+        import ctranslate2
+        return ctranslate2.get_cuda_device_count()
+    except Exception:
+        return 0
+
+def supported_compute_types(device: str) -> set:
+    """Returns the compute types ctranslate2 supports on the device"""
+    try:
+        import ctranslate2
+        return set(ctranslate2.get_supported_compute_types(device))
+    except Exception:
+        return set(CPU_COMPUTE_TYPES) if device == 'cpu' else set()
+
+def gpu_free_gb():
+    """Returns the free memory (GB) of the first GPU, or None when it can't be read"""
+    command = ['nvidia-smi', '--query-gpu=memory.free', '--format=csv,noheader,nounits',
+               '--id=0']
+    try:
+        output = subprocess.run(command, capture_output=True, text=True, timeout=10).stdout
+        return float(output.split()[0]) / 1024
+    except (OSError, subprocess.SubprocessError, ValueError, IndexError):
+        return None
+
+def ram_available_gb():
+    """Returns the memory (GB) available to new allocations, or None when it can't tell"""
+    try:
+        with open('/proc/meminfo', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024 ** 2
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def _fits(needed_gb: float, available_gb) -> bool:
+    # when the memory can't be read the model is assumed to fit, as before the planner
+    return available_gb is None or needed_gb <= available_gb
+
+def _loaded(model: str, device: str, compute_type: str, num_workers: int = 1) -> bool:
+    """Returns True when the registry already holds the model with these settings"""
+    key = list(registry.whisper_key(model, device, compute_type, num_workers))
+    return key in registry.stats()['models']
+
+def plan(model: str, long_form: bool = False, cpu_threads: int = 0) -> Plan:
+    """Picks device, compute type, threads and workers for one job of model
+
+    cpu_threads is this job's share of the cores (the worker processes split the cores
+    between them, 0 uses them all), long_form asks for several replicas to decode
+    silence-split chunks in parallel
+    """
+    # ---- gpu: the first compute type whose weights fit in the free memory ----
+    if DEVICE != 'cpu' and gpu_count() > 0:
+        free = gpu_free_gb()
+        supported = supported_compute_types('cuda')
+        for compute_type in GPU_COMPUTE_TYPES:
+            if compute_type not in supported:
+                continue
+            # concurrent jobs in other workers already hold their share of the free memory,
+            # and a model this process holds doesn't need it a second time
+            if _loaded(model, 'cuda', compute_type) or _fits(
+                    registry.footprint('whisper', model, compute_type) + GPU_HEADROOM_GB, free):
+                return Plan('cuda', compute_type, 0, 1)
+
+    # ---- cpu: this job's share of the cores, never more threads than cores ----
+    cores = cpu_count()
+    threads = max(1, min(cpu_threads or cores, cores))
+
+    supported = supported_compute_types('cpu')
+    compute_type = next((c for c in CPU_COMPUTE_TYPES if c in supported), 'default')
+
+    # the model must fit in the free memory, a worker loading it regardless would be killed
+    available = ram_available_gb()
+    size = registry.footprint('whisper', model, compute_type)
+    if not _loaded(model, 'cpu', compute_type) and not _fits(size + RAM_HEADROOM_GB, available):
+        raise ModelTooLarge(f"The {model} model needs about {size + RAM_HEADROOM_GB:.1f} GB of "
+                            f"memory but only {available:.1f} GB are free, please choose a "
+                            f"smaller model or try again later")
+
+    workers = 1
+    if long_form and threads >= 2 * LONG_FORM_THREADS:
+        # every replica holds its own buffers, only as many as the free memory allows
+        workers = threads // LONG_FORM_THREADS
+        if available is not None and not _loaded(model, 'cpu', compute_type, workers):
+            workers = max(1, min(workers, int((available - RAM_HEADROOM_GB) // size)))
+        threads = max(1, threads // workers)
+
+    return Plan('cpu', compute_type, threads, workers)
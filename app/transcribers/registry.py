@@ -0,0 +1,132 @@
+from collections import OrderedDict
+import gc
+import os
+import threading
+import time
+
+from . import metrics
+
+# memory budget (GB) for all resident models, shared by every session in the process
+DEFAULT_BUDGET_GB = float(os.environ.get('TRANSCRIBER_MODEL_BUDGET_GB', '8'))
+
+# approximate parameter counts (millions) of the whisper checkpoints
+WHISPER_PARAMS = {
+    'tiny': 39, 'base': 74, 'small': 244, 'medium': 769,
+    'large': 1550, 'large-v1': 1550, 'large-v2': 1550, 'large-v3': 1550,
+}
+
+# bytes used per parameter for each ctranslate2 compute type
+BYTES_PER_PARAM = {
+    'int8': 1, 'int8_float16': 1, 'int8_float32': 1,
+    'float16': 2, 'bfloat16': 2, 'float32': 4, 'default': 4,
+}
+
+# approximate resident size (GB) of the vosk models once the graph is loaded
+VOSK_FOOTPRINTS = {'vosk-small': 0.3, 'vosk-large': 4.0}
+
+# estimate how much memory a model will hold once loaded
+def footprint(backend: str, name: str, compute_type: str = 'default') -> float:
+    """Returns the estimated resident size of a model in GB"""
+    name = name.removesuffix('.en')
+    if backend == 'vosk':
+        return VOSK_FOOTPRINTS.get(name, VOSK_FOOTPRINTS['vosk-large'])
+
+    params = WHISPER_PARAMS.get(name, WHISPER_PARAMS['large'])
+    # weights plus ~20% for the runtime buffers
+    return params * 1e6 * BYTES_PER_PARAM.get(compute_type, 4) * 1.2 / 1024 ** 3
+
+def whisper_key(model: str, device: str, compute_type: str, num_workers: int = 1) -> tuple:
+    """Returns the registry key of a whisper model loaded with these settings"""
+    key = ('whisper', model, device, compute_type)
+    # a model with several replicas for concurrent decoding is a different resident object
+    if num_workers > 1:
+        key += (num_workers,)
+    return key
+
+class ModelRegistry:
+    """LRU cache of loaded models keyed by (backend, model name, device, compute_type)"""
+
+    def __init__(self, budget_gb: float = DEFAULT_BUDGET_GB):
+        self.budget_gb = budget_gb
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+
+    def get(self, key: tuple, loader, size_gb: float):
+        """Returns the model for key, calling loader() to build it on a miss"""
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return self._models[key][0]
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        # only one thread loads a given model, the others wait and then hit the cache
+        with key_lock:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    self.hits += 1
+                    return self._models[key][0]
+                self.misses += 1
+                self._evict(size_gb)
+
+            start = time.perf_counter()
+            with metrics.stage('model_load', backend=key[0]):
+                model = loader()
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                self.load_seconds += elapsed
+                self._models[key] = (model, size_gb)
+                self._loading.pop(key, None)
+
+        return model
+
+    def _evict(self, needed_gb: float):
+        """Drops least recently used models until needed_gb fits in the budget"""
+        evicted = False
+        while self._models and self.resident_gb() + needed_gb > self.budget_gb:
+            self._models.popitem(last=False)
+            self.evictions += 1
+            evicted = True
+        if evicted:
+            gc.collect()
+
+    def resident_gb(self) -> float:
+        """Returns the estimated memory held by the cached models"""
+        return sum(size for _, size in self._models.values())
+
+    def clear(self):
+        """Unloads every cached model"""
+        with self._lock:
+            self._models.clear()
+        gc.collect()
+
+    def stats(self) -> dict:
+        """Returns the cache counters"""
+        with self._lock:
+            return {
+                'models': [list(key) for key in self._models],
+                'resident_gb': round(self.resident_gb(), 3),
+                'budget_gb': self.budget_gb,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'load_seconds': round(self.load_seconds, 3),
+            }
+
+# process-wide registry, shared across streamlit sessions and batch iterations
+REGISTRY = ModelRegistry()
+
+def get_model(key: tuple, loader, size_gb: float):
+    """Returns a model from the process-wide registry"""
+    return REGISTRY.get(key, loader, size_gb)
+
+def stats() -> dict:
+    """Returns the counters of the process-wide registry"""
+    return REGISTRY.stats()
@@ -0,0 +1,120 @@
+import os
+
+from .transcript import Segment, Transcript
+
+# subtitle layout defaults, the usual broadcast guidelines
+MAX_CHARS = int(os.environ.get('SUBTITLE_MAX_CHARS', '42'))
+MAX_LINES = int(os.environ.get('SUBTITLE_MAX_LINES', '2'))
+MAX_DURATION = float(os.environ.get('SUBTITLE_MAX_DURATION', '7'))
+MAX_CPS = float(os.environ.get('SUBTITLE_MAX_CPS', '17'))
+
+# a pause this long always starts a new caption
+PAUSE_SECONDS = 1.0
+
+# a caption may end after a sentence once it has been on screen this long
+MIN_SENTENCE_SECONDS = 1.0
+
+# captions are extended for reading speed, up to this gap before the next one
+MIN_GAP_SECONDS = 0.08
+
+SENTENCE_END = ('.', '?', '!', '…', '。', '？', '！')
+
+# captions are rebuilt from word timings, so the layout can change without decoding again
+def _words(transcript):
+    """Yields (start, end, word, speaker) of every word of the transcript in order
+
+    segments without word timings share their time between their words by length
+    """
+    for segment in transcript:
+        if segment.words:
+            for start, end, word in segment.words:
+                yield start, end, word, segment.speaker
+            continue
+        words = segment.text.split()
+        per_char = (segment.end - segment.start) / max(sum(len(w) + 1 for w in words), 1)
+        start = segment.start
+        for word in words:
+            end = start + (len(word) + 1) * per_char
+            yield start, end, word, segment.speaker
+            start = end
+
+def _greedy(words: list, max_chars: int) -> list:
+    """Fills each line with as many words as fit"""
+    lines = []
+    for word in words:
+        if lines and len(lines[-1]) + 1 + len(word) <= max_chars:
+            lines[-1] += ' ' + word
+        else:
+            lines.append(word)
+    return lines
+
+def _lines(words: list, max_chars: int, max_lines: int) -> str:
+    """Lays a caption's words out on the fewest lines, each about the same length"""
+    lines = _greedy(words, max_chars)
+    if len(lines) < 2:
+        return '\n'.join(lines)
+    # a line breaks once the next word would end past its even share of the text
+    target = (sum(map(len, lines)) + len(lines) - 1) / len(lines)
+    balanced = ['']
+    for word in words:
+        if (balanced[-1] and len(balanced) < len(lines)
+                and len(balanced[-1]) + 1 + len(word) / 2 > target):
+            balanced.append(word)
+        else:
+            balanced[-1] = f"{balanced[-1]} {word}" if balanced[-1] else word
+    if max(map(len, balanced)) <= max_chars:
+        return '\n'.join(balanced)
+    return '\n'.join(lines)
+
+def resegment(transcript, max_chars: int = MAX_CHARS, max_lines: int = MAX_LINES,
+              max_duration: float = MAX_DURATION, max_cps: float = MAX_CPS) -> Transcript:
+    """Returns the transcript cut into captions of at most max_lines lines of max_chars
+
+    a caption ends before it would outgrow its lines or max_duration, at a pause or a change
+    of speaker, or after a sentence. Captions too short to read at max_cps characters a
+    second are extended into the following gap. One pass over the words, linear in their count
+    """
+    captions = []
+    words = []
+    start = end = 0.0
+    speaker = None
+    # greedy line filling of the open caption, the same as _greedy
+    lines = line = 0
+
+    def close():
+        text = _lines([word for _, _, word in words], max_chars, max_lines)
+        captions.append(Segment(start, end, text, words, speaker))
+
+    for word_start, word_end, word, word_speaker in _words(transcript):
+        if words:
+            wraps = line + 1 + len(word) > max_chars
+            if ((wraps and lines == max_lines)
+                    or word_end - start > max_duration
+                    or word_start - end >= PAUSE_SECONDS
+                    or word_speaker != speaker
+                    or (words[-1][2].endswith(SENTENCE_END)
+                        and end - start >= MIN_SENTENCE_SECONDS)):
+                close()
+                words = []
+            elif wraps:
+                lines, line = lines + 1, len(word)
+            else:
+                line += 1 + len(word)
+        if not words:
+            start, end, speaker = word_start, word_end, word_speaker
+            lines, line = 1, len(word)
+        words.append((word_start, word_end, word))
+        end = max(end, word_end)
+    if words:
+        close()
+
+    # reading speed: stretch each caption towards the next one
+    for i, caption in enumerate(captions):
+        needed = caption.start + len(caption.text) / max_cps
+        if i + 1 < len(captions):
+            needed = min(needed, captions[i + 1].start - MIN_GAP_SECONDS)
+        elif transcript.duration:
+            needed = min(needed, transcript.duration)
+        caption.end = max(caption.end, needed)
+
+    return Transcript(captions, transcript.language, transcript.duration)
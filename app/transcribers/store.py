@@ -0,0 +1,269 @@
+from contextlib import contextmanager
+from pathlib import Path
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import urllib.request
+import zipfile
+
+# installed models, one directory each beside manifest.json
+MODELS_DIR = Path(os.environ.get('TRANSCRIBER_MODELS_DIR',
+                                 Path.home().joinpath('.cache', 'offline-transcription',
+                                                      'models')))
+
+# never download, a model that isn't installed is an error (air-gapped machines)
+OFFLINE = os.environ.get('TRANSCRIBER_OFFLINE', '0') == '1'
+
+# 'size' checks the file sizes on the first load of a model, 'full' their sha256
+VERIFY = os.environ.get('TRANSCRIBER_MODEL_VERIFY', 'size')
+
+MANIFEST = 'manifest.json'
+
+# held while a model is installed and the manifest rewritten, by every process of the app
+LOCK_FILE = '.lock'
+
+# where prefetch gets the vosk models, the version is the archive's name
+VOSK_SOURCES = {
+    'vosk-small': 'https://alphacephei.com/vosk/models/vosk-model-small-en-us-0.15.zip',
+    'vosk-large': 'https://alphacephei.com/vosk/models/vosk-model-en-us-0.22.zip',
+}
+
+# bytes hashed per step when a file can't be memory-mapped
+HASH_CHUNK_SIZE = 1 << 20
+
+class ModelStoreError(RuntimeError):
+    """Raised when a model is missing from the store or its files don't match the manifest"""
+
+# models verified by this process, each is checked once
+_VERIFIED = set()
+_LOCK = threading.Lock()
+
+def backend(model: str) -> str:
+    return 'vosk' if model[0:4] == 'vosk' else 'whisper'
+
+def read_manifest(directory: Path = MODELS_DIR) -> dict:
+    """Returns the manifest of a store, {model: {backend, version, installed, files}}"""
+    try:
+        with open(Path(directory).joinpath(MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def _write_manifest(manifest: dict, directory: Path = MODELS_DIR) -> None:
+    # written aside and renamed, a loading worker never sees half a manifest
+    temp = Path(directory).joinpath(MANIFEST + '.tmp')
+    with open(temp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(temp, Path(directory).joinpath(MANIFEST))
+
+def sha256(path: Path) -> str:
+    """Returns the sha256 of a file, hashed from a memory map rather than copied reads"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                digest.update(mapped)
+        except ValueError:
+            # empty files can't be mapped
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def _describe(directory: Path) -> dict:
+    """Returns {relative path: [size, sha256]} of every file under directory"""
+    return {path.relative_to(directory).as_posix(): [path.stat().st_size, sha256(path)]
+            for path in sorted(directory.rglob('*')) if path.is_file()}
+
+def verify(model: str, full: bool = True, directory: Path = MODELS_DIR) -> list:
+    """Returns the problems of an installed model, an empty list when it matches the manifest"""
+    entry = read_manifest(directory).get(model)
+    if entry is None:
+        return [f"{model} is not installed"]
+    root = Path(directory).joinpath(model)
+    problems = []
+    for name, (size, digest) in entry['files'].items():
+        path = root.joinpath(name)
+        if not path.is_file():
+            problems.append(f"{name} is missing")
+        elif path.stat().st_size != size:
+            problems.append(f"{name} has {path.stat().st_size} bytes instead of {size}")
+        elif full and sha256(path) != digest:
+            problems.append(f"{name} doesn't match its checksum")
+    return problems
+
+def locate(model: str, directory: Path = MODELS_DIR):
+    """Returns the directory of an installed model, checked once per process, or None
+
+    raises ModelStoreError when the installed files don't match the manifest
+    """
+    model = model if backend(model) == 'whisper' else model.removesuffix('.en')
+    root = Path(directory).joinpath(model)
+    if model not in read_manifest(directory) or not root.is_dir():
+        return None
+    with _LOCK:
+        if (directory, model) not in _VERIFIED:
+            problems = verify(model, VERIFY == 'full', directory)
+            if problems:
+                raise ModelStoreError(f"the installed {model} model is damaged: "
+                                      f"{'; '.join(problems)}. Install it again")
+            _VERIFIED.add((directory, model))
+    return root
+
+def require(model: str, directory: Path = MODELS_DIR):
+    """Returns the installed model's directory, or None when it may still be downloaded"""
+    root = locate(model, directory)
+    if root is None and OFFLINE:
+        raise ModelStoreError(f"the {model} model is not installed, run "
+                              f"python app/models.py install <directory or archive> "
+                              f"--model {model}")
+    return root
+
+# ------------------------- installing -------------------------
+@contextmanager
+def _locked(directory: Path = MODELS_DIR):
+    """Holds the store's file lock, the job workers are separate processes"""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    fd = os.open(directory.joinpath(LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # closing the file releases the lock
+        os.close(fd)
+
+def _check_members(names, into: Path) -> None:
+    """Raises ModelStoreError when an archive member would land outside into"""
+    root = into.resolve()
+    for name in names:
+        target = root.joinpath(name).resolve()
+        if target != root and root not in target.parents:
+            raise ModelStoreError(f"the archive member {name} points outside the model")
+
+def _unpack(source: Path, into: Path) -> Path:
+    """Extracts a zip or tar archive into a directory and returns the model's root in it"""
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            _check_members(archive.namelist(), into)
+            archive.extractall(into)
+    else:
+        with tarfile.open(source) as archive:
+            if hasattr(tarfile, 'data_filter'):
+                # refuses absolute paths, links out of the directory and device files
+                try:
+                    archive.extractall(into, filter='data')
+                except tarfile.FilterError as e:
+                    raise ModelStoreError(f"unsafe model archive: {e}") from None
+            else:
+                members = archive.getmembers()
+                _check_members([member.name for member in members], into)
+                if any(not (member.isfile() or member.isdir()) for member in members):
+                    raise ModelStoreError('model archives may only hold files and directories')
+                archive.extractall(into, members)
+    # archives usually hold the model in one top directory
+    entries = list(into.iterdir())
+    return entries[0] if len(entries) == 1 and entries[0].is_dir() else into
+
+def _install_tree(root: Path, model: str, version: str, files=None,
+                  directory: Path = MODELS_DIR, replace: bool = True) -> dict:
+    """Copies a model's directory into the store and records it, checked against files
+
+    the copy is made beside the store and renamed in, a failed install leaves nothing behind.
+    Without replace, a model another process installed meanwhile is kept as it is
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    described = _describe(root)
+    if files is not None and described != files:
+        raise ModelStoreError(f"the files of {model} don't match the archive's manifest")
+
+    staging = Path(tempfile.mkdtemp(prefix=f".{model}-", dir=directory))
+    try:
+        shutil.copytree(root, staging.joinpath('model'))
+        target = directory.joinpath(model)
+        with _locked(directory):
+            manifest = read_manifest(directory)
+            if not replace and model in manifest and target.is_dir():
+                return manifest[model]
+            # the old copy is moved aside in one rename, a loading process sees either model
+            if target.exists():
+                os.replace(target, staging.joinpath('old'))
+            os.replace(staging.joinpath('model'), target)
+
+            entry = {'backend': backend(model), 'version': version, 'installed': time.time(),
+                     'files': described}
+            manifest[model] = entry
+            _write_manifest(manifest, directory)
+        with _LOCK:
+            _VERIFIED.discard((directory, model))
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return entry
+
+def _stem(source: Path) -> str:
+    """Returns the name of a source without its archive extensions"""
+    name = source.name
+    for suffix in ('.gz', '.tgz', '.tar', '.zip'):
+        name = name.removesuffix(suffix)
+    return name
+
+def install(source, model: str = None, version: str = None,
+            directory: Path = MODELS_DIR) -> list:
+    """Installs models from a directory, a zip or tar archive, or a packed store
+
+    a packed store (a manifest.json beside the model directories) installs every model it
+    holds, checked against its checksums. Returns the installed model names
+    """
+    source = Path(source)
+    with tempfile.TemporaryDirectory() as temp:
+        root = source if source.is_dir() else _unpack(source, Path(temp))
+        packed = read_manifest(root)
+        if packed:
+            names = [model] if model else sorted(packed)
+            for name in names:
+                _install_tree(root.joinpath(name), name, packed[name]['version'],
+                              packed[name]['files'], directory)
+            return names
+        if model is None:
+            raise ModelStoreError('give the model name of a directory or archive')
+        _install_tree(root, model, version or _stem(source), None, directory)
+        return [model]
+
+def prefetch(model: str, directory: Path = MODELS_DIR) -> None:
+    """Downloads a model into the store, on a machine with internet access
+
+    workers fetching the same model at once each download it, the first install is kept
+    """
+    with tempfile.TemporaryDirectory() as temp:
+        if backend(model) == 'vosk':
+            url = VOSK_SOURCES[model.removesuffix('.en')]
+            archive, _ = urllib.request.urlretrieve(url, Path(temp).joinpath('model.zip'))
+            root = _unpack(Path(archive), Path(temp).joinpath('unpacked'))
+            _install_tree(root, model.removesuffix('.en'), Path(url).stem, None, directory,
+                          replace=False)
+        else:
+            # imported here, only prefetching whisper models needs it
+            import faster_whisper
+            root = faster_whisper.download_model(model, output_dir=temp)
+            _install_tree(Path(root), model, f"faster-whisper-{model}", None, directory,
+                          replace=False)
+
+def pack(models, output, directory: Path = MODELS_DIR) -> None:
+    """Writes installed models and their manifest into a tar archive to carry offline"""
+    manifest = read_manifest(directory)
+    missing = [model for model in models if model not in manifest]
+    if missing:
+        raise ModelStoreError(f"not installed: {', '.join(missing)}")
+    with tempfile.TemporaryDirectory() as temp:
+        _write_manifest({model: manifest[model] for model in models}, Path(temp))
+        with tarfile.open(output, 'w') as archive:
+            archive.add(Path(temp).joinpath(MANIFEST), MANIFEST)
+            for model in models:
+                archive.add(Path(directory).joinpath(model), model)
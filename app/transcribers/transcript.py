@@ -0,0 +1,153 @@
+from array import array
+import math
+
+class Words:
+    """Word timings of a segment, kept in flat arrays of milliseconds instead of tuples
+
+    8 bytes a word besides its text, against over 150 for a (start, end, word) tuple, which
+    matters for the transcript cache and the job results of long recordings
+    """
+    __slots__ = ('starts', 'ends', 'text')
+
+    def __init__(self, starts, ends, text: str):
+        self.starts = starts
+        self.ends = ends
+        # the words joined by newlines, a word never contains one
+        self.text = text
+
+    @classmethod
+    def of(cls, value) -> 'Words':
+        """Returns value as Words, from (start, end, word) seconds or a to_dict() entry"""
+        if value is None or isinstance(value, cls):
+            return value
+        if isinstance(value, dict):
+            return cls(array('i', value['starts']), array('i', value['ends']), value['text'])
+        starts, ends, words = array('i'), array('i'), []
+        for start, end, word in value:
+            starts.append(int(round(start * 1000)))
+            ends.append(int(round(end * 1000)))
+            words.append(' '.join(word.split()))
+        return cls(starts, ends, '\n'.join(words))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __iter__(self):
+        """Yields (start, end, word) with the times in seconds"""
+        if not self.starts:
+            return iter(())
+        return zip((t / 1000 for t in self.starts), (t / 1000 for t in self.ends),
+                   self.text.split('\n'))
+
+    def shifted(self, seconds: float) -> 'Words':
+        """Returns the timings moved later by seconds, for chunks decoded on their own"""
+        ms = int(round(seconds * 1000))
+        return Words(array('i', (t + ms for t in self.starts)),
+                     array('i', (t + ms for t in self.ends)), self.text)
+
+    def to_dict(self) -> dict:
+        return {'starts': self.starts.tolist(), 'ends': self.ends.tolist(), 'text': self.text}
+
+    def __getstate__(self):
+        return (self.starts.tobytes(), self.ends.tobytes(), self.text)
+
+    def __setstate__(self, state):
+        starts, ends, self.text = state
+        self.starts, self.ends = array('i'), array('i')
+        self.starts.frombytes(starts)
+        self.ends.frombytes(ends)
+
+class Segment:
+    """A decoded segment with timestamps in seconds from the start of the recording"""
+    __slots__ = ('start', 'end', 'text', 'words', 'speaker')
+
+    def __init__(self, start: float, end: float, text: str, words=None, speaker=None):
+        self.start = start
+        self.end = end
+        self.text = text.strip()
+        # optional timings of the words in the segment, given as Words or (start, end, word)
+        self.words = Words.of(words)
+        # optional label set by diarization, e.g. 'Speaker 1'
+        self.speaker = speaker
+
+    def __repr__(self) -> str:
+        return f"Segment({self.start:.3f}, {self.end:.3f}, {self.text!r})"
+
+    @property
+    def spoken(self) -> str:
+        """The text, preceded by the speaker when the recording was diarized"""
+        return f"{self.speaker}: {self.text}" if self.speaker else self.text
+
+    def __getstate__(self):
+        return (self.start, self.end, self.text, self.words, self.speaker)
+
+    def __setstate__(self, state):
+        self.start, self.end, self.text, self.words, self.speaker = state
+
+class Transcript:
+    """The segments of one recording, shared by the transcribers and every exporter"""
+    __slots__ = ('segments', 'language', 'duration', 'info')
+
+    def __init__(self, segments=(), language=None, duration=None, info=None):
+        self.segments = list(segments)
+        self.language = language
+        self.duration = duration
+        # optional json serialisable notes on how it was decoded, e.g. the cascade report
+        self.info = info
+
+    def __iter__(self):
+        return iter(self.segments)
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    def __getstate__(self):
+        return (self.segments, self.language, self.duration, self.info)
+
+    def __setstate__(self, state):
+        self.segments, self.language, self.duration, self.info = state
+
+    @property
+    def text(self) -> str:
+        """The transcript without timestamps, one segment per line"""
+        return '\n'.join(segment.text for segment in self.segments)
+
+    def to_vtt(self, ts: str = 'yes') -> str:
+        """Renders the transcript in the webvtt-like layout used for previews and exports"""
+        if ts != 'yes':
+            return ''.join(f"{segment.spoken}\n\n" for segment in self.segments)
+        return ''.join(f"{i}\n{convert_seg(segment)}"
+                       for i, segment in enumerate(self.segments, start=1))
+
+    def to_dict(self) -> dict:
+        """Returns a json serialisable copy of the transcript"""
+        return {
+            'language': self.language,
+            'duration': self.duration,
+            'info': self.info,
+            'segments': [[s.start, s.end, s.text, s.words.to_dict() if s.words else None,
+                          s.speaker] for s in self.segments],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Transcript':
+        """Rebuilds a transcript from to_dict() output"""
+        # entries written before diarization have no speaker, older words are (start, end, word)
+        segments = [Segment(*fields) for fields in data['segments']]
+        return cls(segments, data.get('language'), data.get('duration'), data.get('info'))
+
+# convert seconds to hms
+def convert_to_hms(seconds: float) -> str:
+    """Converts segment timestamp to hours:minuts:seconds:milliseconds"""
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    milliseconds = math.floor((seconds % 1) * 1000)
+    output = f"{int(hours):02}:{int(minutes):02}:{int(seconds):02}.{milliseconds:03}"
+
+    return output
+
+# convert segment to a srt like format
+def convert_seg(segment: Segment) -> str:
+    """Converts the segment into a string to be output into file"""
+    return (f"{convert_to_hms(segment.start)} --> {convert_to_hms(segment.end)}\n"
+            f"{segment.spoken}\n\n")
@@ -0,0 +1,390 @@
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+from . import metrics
+
+# uploads are spooled here as they arrive, only readable by the user running the app
+UPLOADS_DIR = Path(os.environ.get('TRANSCRIBER_UPLOADS_DIR',
+                                  Path.home().joinpath('.cache', 'offline-transcription',
+                                                       'uploads')))
+
+# the chunked upload endpoint beside streamlit, off unless a port is set; it only listens on
+# this machine unless told otherwise, e.g. for a proxy on another host
+PORT = int(os.environ.get('TRANSCRIBER_UPLOAD_PORT', '0'))
+HOST = os.environ.get('TRANSCRIBER_UPLOAD_HOST', '127.0.0.1')
+
+# origin of the pages allowed to send chunks, by default a page on the endpoint's own host
+ORIGIN = os.environ.get('TRANSCRIBER_UPLOAD_ORIGIN', '')
+
+# the endpoint as the browser sees it, when a proxy serves it elsewhere than host:PORT
+PUBLIC_URL = os.environ.get('TRANSCRIBER_UPLOAD_URL', '')
+
+# the same limit as streamlit's maxUploadSize
+MAX_BYTES = int(float(os.environ.get('TRANSCRIBER_MAX_UPLOAD_MB', '1000')) * (1 << 20))
+
+# size of the pieces the browser sends, each is retried on its own after a disconnect
+CHUNK_BYTES = 8 << 20
+
+# a transcription reading an upload gives up when nothing arrives for this long
+STALL_SECONDS = float(os.environ.get('TRANSCRIBER_UPLOAD_STALL_MINUTES', '10')) * 60
+
+# uploads nobody transcribed are deleted after this long without a new chunk
+RETENTION_SECONDS = 2 * 3600
+
+# seconds between checks of a reader waiting for the next chunk
+POLL_SECONDS = 0.2
+
+_ID = re.compile('[0-9a-f]{32}')
+_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+
+# one writer per upload at a time, a retried chunk may race the original
+_LOCKS = {}
+_LOCKS_LOCK = threading.Lock()
+
+class UploadError(Exception):
+    """Raised for a chunk the upload can't take, with the http status to answer"""
+
+    def __init__(self, status: int, message: str, consumed: int = 0):
+        super().__init__(message)
+        self.status = status
+        # bytes of the request body already read
+        self.consumed = consumed
+
+def _paths(upload_id: str):
+    """Returns the (data, metadata) paths of an upload, rejecting anything but an id"""
+    if not _ID.fullmatch(upload_id or ''):
+        raise UploadError(404, 'unknown upload')
+    return UPLOADS_DIR.joinpath(upload_id), UPLOADS_DIR.joinpath(upload_id + '.json')
+
+def _read_meta(path: Path) -> dict:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def _write_meta(path: Path, meta: dict) -> None:
+    # written aside and renamed, a reader never sees half a file
+    temp = path.with_suffix('.tmp')
+    with open(temp, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(temp, path)
+
+def create(session: str = '') -> str:
+    """Registers a new upload and returns its id, the endpoint only accepts registered ids"""
+    UPLOADS_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+    upload_id = uuid.uuid4().hex
+    data, meta = _paths(upload_id)
+    os.close(os.open(data, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600))
+    _write_meta(meta, {'session': session, 'name': None, 'size': None, 'created': time.time()})
+    return upload_id
+
+def status(upload_id: str):
+    """Returns the name, size, received bytes and completeness of an upload, or None"""
+    try:
+        data, meta = _paths(upload_id)
+        info = _read_meta(meta)
+        received = data.stat().st_size
+    except (UploadError, OSError, ValueError):
+        return None
+    info['received'] = received
+    info['complete'] = info['size'] is not None and received >= info['size']
+    return info
+
+def path(upload_id: str) -> Path:
+    """Returns where the upload's bytes are spooled"""
+    return _paths(upload_id)[0]
+
+def _release(upload_id: str) -> None:
+    """Forgets the writer lock of an upload that is complete or gone"""
+    with _LOCKS_LOCK:
+        _LOCKS.pop(upload_id, None)
+
+def write_chunk(upload_id: str, content_range: str, name: str, body, length: int) -> int:
+    """Appends one chunk read from body and returns the bytes received so far
+
+    a chunk starting before the end of the spool (resent after a lost reply) has its known
+    part skipped, one starting after it is refused with the offset to resume from
+    """
+    data, meta_path = _paths(upload_id)
+    match = _RANGE.fullmatch(content_range or '')
+    if match is None:
+        raise UploadError(400, 'a Content-Range header is required')
+    first, last, total = map(int, match.groups())
+    if last - first + 1 != length or total > MAX_BYTES or last >= total:
+        raise UploadError(413 if total > MAX_BYTES else 400, 'bad chunk range')
+
+    with _LOCKS_LOCK:
+        lock = _LOCKS.setdefault(upload_id, threading.Lock())
+    with lock:
+        try:
+            meta = _read_meta(meta_path)
+            f = open(data, 'r+b')
+        except OSError:
+            # never registered, or already transcribed and removed
+            raise UploadError(404, 'unknown upload') from None
+        with f:
+            received = f.seek(0, os.SEEK_END)
+            if first > received:
+                raise UploadError(409, 'chunk beyond the received bytes')
+            if meta['size'] is None:
+                meta.update(size=total, name=name or 'upload')
+                _write_meta(meta_path, meta)
+            elif meta['size'] != total:
+                raise UploadError(409, 'the upload has another size')
+
+            # the part already received is read and dropped
+            skip = received - first
+            remaining = length
+            while remaining:
+                piece = body.read(min(remaining, 1 << 20))
+                if not piece:
+                    raise UploadError(400, 'the chunk ended early', length - remaining)
+                remaining -= len(piece)
+                if skip >= len(piece):
+                    skip -= len(piece)
+                    continue
+                f.write(piece[skip:])
+                skip = 0
+            received = f.tell()
+    # a chunk resent after this only skips what is already there, no lock is needed any more
+    if received >= total:
+        _release(upload_id)
+    metrics.inc('transcriber_upload_bytes_total', length)
+    return received
+
+def purge(keep=()) -> None:
+    """Deletes the uploads nobody transcribed and the metadata of the transcribed ones
+
+    keep holds the spool paths of queued or running jobs, an upload may wait in the queue
+    longer than the retention period
+    """
+    cutoff = time.time() - RETENTION_SECONDS
+    keep = {str(path) for path in keep}
+    for meta in UPLOADS_DIR.glob('*.json'):
+        data = meta.with_suffix('')
+        if str(data) in keep:
+            continue
+        try:
+            # the job removes the bytes once transcribed, a stale upload is removed here
+            if not data.exists() or data.stat().st_mtime < cutoff:
+                data.unlink(missing_ok=True)
+                meta.unlink(missing_ok=True)
+                _release(data.name)
+        except OSError:
+            pass
+
+class TailReader:
+    """Reads an upload from the start while it is still arriving
+
+    reads wait for the next chunk instead of returning the end of the file, so ffmpeg
+    demuxes and decodes the received part while the rest uploads
+    """
+    growing = True
+
+    def __init__(self, upload_id: str, stall_seconds: float = STALL_SECONDS):
+        self.upload_id = upload_id
+        self.file = open(path(upload_id), 'rb')
+        self.stall_seconds = stall_seconds
+        self.stalled = False
+        info = status(upload_id) or {}
+        # the upload's full size, audio.consumed() reports progress against it
+        self.size = info.get('size')
+
+    def _complete(self) -> bool:
+        info = status(self.upload_id)
+        if info is None:
+            return True
+        self.size = info['size']
+        return info['complete']
+
+    def read(self, size: int = -1) -> bytes:
+        waited = time.monotonic()
+        while True:
+            data = self.file.read(size)
+            if data or self._complete():
+                return data
+            if time.monotonic() - waited > self.stall_seconds:
+                # the feeder stops on ValueError, the job then reports the stalled upload
+                self.stalled = True
+                raise ValueError('the upload stopped before it finished')
+            time.sleep(POLL_SECONDS)
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        return self.file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.file.tell()
+
+    def close(self) -> None:
+        self.file.close()
+
+# the browser side, an <input type=file> that sends the file in chunks with retries
+WIDGET = """
+<div style="font-family: sans-serif; font-size: 14px">
+  <input type="file" id="file">
+  <div id="state" style="margin-top: 6px; color: #555"></div>
+</div>
+<script>
+const URL_BASE = %(url)s || (window.parent.location.protocol + '//'
+                             + window.parent.location.hostname + ':%(port)d');
+const TARGET = URL_BASE + '/uploads/%(id)s';
+const CHUNK = %(chunk)d;
+const state = document.getElementById('state');
+
+async function offset() {
+  const reply = await fetch(TARGET, {method: 'HEAD'});
+  if (!reply.ok) throw new Error('upload expired, reload the page');
+  return parseInt(reply.headers.get('Upload-Offset'));
+}
+
+async function send(file) {
+  let start = 0, delay = 1000;
+  while (start < file.size) {
+    const end = Math.min(start + CHUNK, file.size);
+    try {
+      const reply = await fetch(TARGET, {
+        method: 'PUT', body: file.slice(start, end),
+        headers: {'Content-Range': `bytes ${start}-${end - 1}/${file.size}`,
+                  'X-File-Name': encodeURIComponent(file.name)}});
+      if (reply.status === 409) { start = await offset(); continue; }
+      if (!reply.ok) throw new Error(await reply.text());
+      start = parseInt(reply.headers.get('Upload-Offset'));
+      delay = 1000;
+      state.textContent = `Uploaded ${(start / 1048576).toFixed(0)} of `
+                          + `${(file.size / 1048576).toFixed(0)} MB`;
+    } catch (error) {
+      // disconnected: wait, ask the server how much it has and carry on from there
+      state.textContent = `Connection lost, retrying (${error.message})`;
+      await new Promise(resolve => setTimeout(resolve, delay));
+      delay = Math.min(delay * 2, 30000);
+      try { start = await offset(); } catch (ignored) {}
+    }
+  }
+  state.textContent = `Uploaded ${file.name}`;
+}
+
+document.getElementById('file').addEventListener('change', event => {
+  if (event.target.files.length) send(event.target.files[0]);
+});
+</script>
+"""
+
+def widget(upload_id: str) -> str:
+    """Returns the html of the chunked upload field for one registered upload"""
+    return WIDGET % {'url': json.dumps(PUBLIC_URL), 'port': PORT, 'id': upload_id,
+                     'chunk': CHUNK_BYTES}
+
+_SERVER = None
+_SERVER_LOCK = threading.Lock()
+
+def allowed_origin(origin: str, host: str):
+    """Returns the origin to allow for a request, or None when the page isn't the app's
+
+    host is the request's Host header; without TRANSCRIBER_UPLOAD_ORIGIN, the app is the
+    streamlit page on another port of the same host
+    """
+    if not origin:
+        return None
+    if ORIGIN:
+        return origin if origin == ORIGIN.rstrip('/') else None
+    try:
+        same = urlsplit(origin).hostname == urlsplit('//' + (host or '')).hostname
+    except ValueError:
+        return None
+    return origin if same and urlsplit(origin).hostname else None
+
+def serve(port: int = PORT) -> None:
+    """Starts the chunked upload endpoint once per server process, when a port is set
+
+    PUT /uploads/<id> appends the chunk given by Content-Range, HEAD /uploads/<id> answers
+    with the received bytes in Upload-Offset so an interrupted upload carries on from there
+    """
+    global _SERVER
+    if not port or _SERVER is not None:
+        return
+    # http.server is imported here, it costs every page's cold start otherwise
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def _upload_id(self) -> str:
+            parts = self.path.split('?')[0].strip('/').split('/')
+            return parts[1] if len(parts) == 2 and parts[0] == 'uploads' else ''
+
+        def _reply(self, code: int, received=None, message: str = '') -> None:
+            body = message.encode('utf-8')
+            self.send_response(code)
+            # the page is served by streamlit on another port, no other site may send chunks
+            origin = allowed_origin(self.headers.get('Origin'), self.headers.get('Host'))
+            if origin is not None:
+                self.send_header('Access-Control-Allow-Origin', origin)
+            self.send_header('Vary', 'Origin')
+            self.send_header('Access-Control-Allow-Methods', 'PUT, HEAD, OPTIONS')
+            self.send_header('Access-Control-Allow-Headers', 'Content-Range, X-File-Name')
+            self.send_header('Access-Control-Expose-Headers', 'Upload-Offset')
+            if received is not None:
+                self.send_header('Upload-Offset', str(received))
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(body)
+
+        def do_OPTIONS(self):
+            self._reply(204)
+
+        def do_HEAD(self):
+            info = status(self._upload_id())
+            if info is None:
+                self._reply(404)
+            else:
+                self._reply(200, info['received'])
+
+        def do_PUT(self):
+            upload_id = self._upload_id()
+            # a page of another site is refused before anything is written
+            origin = self.headers.get('Origin')
+            if origin and allowed_origin(origin, self.headers.get('Host')) is None:
+                self.close_connection = True
+                self._reply(403, message='origin not allowed')
+                return
+            try:
+                length = int(self.headers.get('Content-Length', '0'))
+                received = write_chunk(upload_id, self.headers.get('Content-Range'),
+                                       unquote(self.headers.get('X-File-Name', '')),
+                                       self.rfile, length)
+            except UploadError as e:
+                info = status(upload_id)
+                # a refused chunk is read to the end, so the browser gets the reply and resumes
+                remaining = length - e.consumed
+                if 0 <= remaining <= 2 * CHUNK_BYTES:
+                    while remaining > 0:
+                        read = len(self.rfile.read(min(remaining, 1 << 20)))
+                        if not read:
+                            break
+                        remaining -= read
+                else:
+                    self.close_connection = True
+                self._reply(e.status, info and info['received'], str(e))
+                return
+            except ValueError:
+                self.close_connection = True
+                self._reply(400, message='bad Content-Length')
+                return
+            self._reply(200, received)
+
+        def log_message(self, *args):
+            pass
+
+    with _SERVER_LOCK:
+        if _SERVER is not None:
+            return
+        try:
+            _SERVER = ThreadingHTTPServer((HOST, port), Handler)
+        except OSError:
+            # another server process on this machine already listens there
+            _SERVER = False
+            return
+        threading.Thread(target=_SERVER.serve_forever, daemon=True).start()
@@ -1,85 +1,163 @@
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import os
-import math
-import subprocess
 import json
-import urllib
-import zipfile
 
+import numpy as np
 from vosk import Model, KaldiRecognizer, SetLogLevel
 
-# convert seconds to hms
-def convert_to_hms(seconds: float) -> str:
-    """Converts segment timestamp to hours:minuts:seconds:milliseconds"""
-    hours, remainder = divmod(seconds, 3600)
-    minutes, seconds = divmod(remainder, 60)
-    milliseconds = math.floor((seconds % 1) * 1000)
-    output = f"{int(hours):02}:{int(minutes):02}:{int(seconds):02}.{milliseconds:03}"
+from . import audio, cache, diarize, longform, metrics, registry, store
+from .transcript import Segment, Transcript
 
-    return output
+# bytes of 16 kHz s16le audio handed to the recognizer per call (64 KiB is ~2 s)
+READ_SIZE = int(os.environ.get('VOSK_READ_SIZE', str(64 * 1024)))
 
-def transcribe(audio_file_path, model, eo, ts):
-    """Uses vosk-api to transcribe audio file and writes the segments"""
-    # set sample rate for model (16000) is desired
-    SAMPLE_RATE = 16000
+# recognizers decoding silence-split chunks in parallel, 1 streams the file sequentially
+WORKERS = int(os.environ.get('VOSK_WORKERS', '1'))
 
+# locate (or download) the vosk model and build it
+def _build_model(model: str) -> Model:
+    """Reads the vosk model from the model store, downloading it into the store if allowed"""
+    path_to_model = store.require(model)
+    if path_to_model is None:
+        store.prefetch(model)
+        path_to_model = store.locate(model)
+
+    return Model(str(path_to_model))
+
+# load the model through the shared registry
+def load_model(model: str) -> Model:
+    """Returns a cached vosk model, loading it on first use"""
+    model = model.removesuffix('.en')
+    return registry.get_model(('vosk', model, 'cpu', 'default'),
+                              lambda: _build_model(model),
+                              registry.footprint('vosk', model))
+
+# feed a decoded buffer to a recognizer
+def _accept(rec: KaldiRecognizer, buffer: bytearray, filled: int) -> bool:
+    """Sends the first filled bytes of buffer to rec, without a copy for full buffers"""
+    if filled == len(buffer):
+        try:
+            return rec.AcceptWaveform(buffer)
+        except TypeError:
+            # bindings built with an older cffi only take bytes
+            pass
+    return rec.AcceptWaveform(bytes(memoryview(buffer)[:filled]))
+
+# parse a recognizer result into a segment
+def _to_segment(res: str, offset: float = 0.0):
+    """Returns the segment of a vosk json result, or None when nothing was recognised"""
+    words = json.loads(res).get("result")
+    if not words:
+        return None
+
+    content = " ".join([w["word"] for w in words])
+    timings = [(offset + w["start"], offset + w["end"], w["word"]) for w in words]
+    return Segment(timings[0][0], timings[-1][1], content, timings)
+
+def _decode_sequential(audio_file, v_model: Model, read_size: int, pcm: bytearray = None):
+    """Streams the whole file through one recognizer, yielding (segment, progress)
+
+    the decoded audio is appended to pcm when given, for the stages that run afterwards
+    """
+    rec = KaldiRecognizer(v_model, audio.SAMPLE_RATE)
+    rec.SetWords(True)
+
+    # one preallocated buffer is refilled by every read
+    buffer = bytearray(read_size)
+    for filled in audio.iter_pcm_into(audio_file, buffer, 's16le', audio.SAMPLE_RATE):
+        if pcm is not None:
+            pcm += memoryview(buffer)[:filled]
+        if _accept(rec, buffer, filled):
+            segment = _to_segment(rec.Result())
+            if segment is not None:
+                yield segment, audio.consumed(audio_file)
+    segment = _to_segment(rec.FinalResult())
+    if segment is not None:
+        yield segment, 1.0
+
+def _decode_parallel(audio_file, v_model: Model, read_size: int, workers: int, samples):
+    """Decodes silence-split chunks on one recognizer each, sharing the model, in time order"""
+    chunks = longform.split_on_silence(samples)
+
+    def decode_chunk(chunk):
+        start, end = chunk
+        rec = KaldiRecognizer(v_model, audio.SAMPLE_RATE)
+        rec.SetWords(True)
+        pcm = (np.clip(samples[start:end], -1.0, 1.0) * 32767).astype('<i2').tobytes()
+        results = []
+        for i in range(0, len(pcm), read_size):
+            if rec.AcceptWaveform(pcm[i:i + read_size]):
+                results.append(rec.Result())
+        results.append(rec.FinalResult())
+        return results
+
+    # the kaldi decoder runs without the GIL, so threads decode in parallel
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [pool.submit(decode_chunk, chunk) for chunk in chunks]
+        for (start, end), future in zip(chunks, futures):
+            offset = start / audio.SAMPLE_RATE
+            progress = end / max(len(samples), 1)
+            # results are parsed as each chunk finishes, not after the whole file
+            for res in future.result():
+                segment = _to_segment(res, offset)
+                if segment is not None:
+                    yield segment, progress
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def decode(audio_file, model, eo, workers=WORKERS, read_size=READ_SIZE, diarization=False):
+    """Starts vosk-api on an audio path or upload buffer and returns (segments, transcript)
+
+    segments lazily yields (segment, progress) for every recognised utterance, progress
+    being the fraction of the audio done (None for paths when streaming sequentially),
+    and appends each to transcript. With diarization the speakers are labelled from the
+    audio already decoded for recognition
+    """
     # set LogLevel to -1 so that output isn't printed to terminal
     SetLogLevel(-1)
     
     # initialize the model and set the transcription to word level
-    cwd = Path(os.getcwd())
-    if model == 'vosk-large' or model == 'vosk-large.en':
-        path_to_model = cwd.joinpath("models/vosk/vosk-model-en-us-0.22")
-        url = "https://alphacephei.com/vosk/models/vosk-model-en-us-0.22.zip"
-    else:
-        path_to_model = cwd.joinpath("models/vosk/vosk-model-small-en-us-0.15")
-        url = "https://alphacephei.com/vosk/models/vosk-model-small-en-us-0.15.zip"
-    
-    # check if model exists, and download if it doesnt
-    if path_to_model.is_dir():
-        v_model = Model(str(path_to_model))
+    v_model = load_model(model)
+
+    # read sizes must hold whole 16 bit samples
+    read_size = max(2, read_size - read_size % 2)
+    samples = pcm = None
+    if workers > 1:
+        samples = audio.decode_audio(audio_file)
+        decoded = _decode_parallel(audio_file, v_model, read_size, workers, samples)
     else:
-        path_to_model.parent.mkdir(parents=True, exist_ok=True)
-        zip_file, _ = urllib.request.urlretrieve(url)
-        with zipfile.ZipFile(zip_file, 'r') as zf:
-            zf.extractall(path_to_model.parent)
-        v_model = Model(str(path_to_model))        
-    
-    rec = KaldiRecognizer(v_model, SAMPLE_RATE)
-    rec.SetWords(True)
-    
-    # converts audio/video with ffmpeg
-    command = ["ffmpeg", "-nostdin", "-loglevel", "quiet", "-i", audio_file_path,
-               "-ar", str(SAMPLE_RATE), "-ac", "1", "-f", "s16le", "-"]
-    with subprocess.Popen(command, stdout=subprocess.PIPE) as process:
+        # the streamed audio is kept (as 16 bit, 115 MB an hour) only when it is needed again
+        pcm = bytearray() if diarization else None
+        decoded = _decode_sequential(audio_file, v_model, read_size, pcm)
 
-        # send the data through the model
-        results = []
-        while True:
-            data = process.stdout.read(4000)
-            if len(data) == 0:
-                break
-            if rec.AcceptWaveform(data):
-                results.append(rec.Result())
-        results.append(rec.FinalResult())
+    transcript = Transcript([], 'en', 0.0)
+
+    def segments():
+        for segment, progress in decoded:
+            transcript.segments.append(segment)
+            transcript.duration = segment.end
+            yield segment, progress
+        if diarization:
+            with metrics.stage('diarize'):
+                decoded_samples = samples
+                if decoded_samples is None:
+                    decoded_samples = np.frombuffer(pcm, dtype='<i2').astype(np.float32) / 32768
+                diarize.diarize(transcript, decoded_samples)
+
+    return segments(), transcript
+
+def stream(audio_file, model, eo, diarization=False):
+    """Same as decode(), replaying the transcript from the cache when decoded before"""
+    # the same recording with the same options is only decoded once
+    return cache.stream(audio_file, 'vosk', model.removesuffix('.en'),
+                        lambda: decode(audio_file, model, eo, diarization=diarization),
+                        parallel=WORKERS > 1, diarization=diarization)
+
+def transcribe(audio_file, model, eo, diarization=False) -> Transcript:
+    """Uses vosk-api to transcribe an audio path or upload buffer"""
+    segments, transcript = stream(audio_file, model, eo, diarization)
+    for _ in segments:
+        pass
 
-    tr_file_path = Path(audio_file_path + '.vtt')
-    with open(tr_file_path, 'w', encoding='utf-8') as tr:         
-        i = 1 # counter for each segment
-        for _, res in enumerate(results):
-            words = json.loads(res).get("result")
-            if not words:
-                continue
-            
-            start = convert_to_hms(words[0]["start"])
-            end = convert_to_hms(words[-1]["end"])
-            content = " ".join([w["word"] for w in words])
-            
-            if ts == 'yes':
-                tr.write(f"{i}\n" f"{start} --> {end}\n"
-                            f"{content}\n\n")
-                i += 1
-            else:
-                tr.write(f"{content}\n\n")
-                
-    return tr_file_path
\ No newline at end of file
+    return transcript
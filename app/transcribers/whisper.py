@@ -1,59 +1,147 @@
-from pathlib import Path
-import math
+import os
+
 import faster_whisper
-import torch
-import gc
-
-# convert seconds to hms
-def convert_to_hms(seconds: float) -> str:
-    """Converts segment timestamp to hours:minuts:seconds:milliseconds"""
-    hours, remainder = divmod(seconds, 3600)
-    minutes, seconds = divmod(remainder, 60)
-    milliseconds = math.floor((seconds % 1) * 1000)
-    output = f"{int(hours):02}:{int(minutes):02}:{int(seconds):02}.{milliseconds:03}"
-
-    return output
-
-# convert segment to a srt like format
-def convert_seg(segment: faster_whisper.transcribe.Segment) -> str:
-    """Converts the segment into a string to be output into file"""
-    return (f"{convert_to_hms(segment.start)} --> {convert_to_hms(segment.end)}\n"
-            f"{segment.text.lstrip()}\n\n")
-
-def transcribe(audio_file_path, model, eo, ts):
-    """Uses faster_whisper to transcribe audio file and writes the segments"""
-    # determine the free memory
-    free = torch.cuda.mem_get_info()[0] / 1024 ** 3
-    #total = torch.cuda.mem_get_info()[1] / 1024 ** 3
-    
-    # initialize the model and set the transcription to word level
-    if torch.cuda.is_available() and free >= 6.0:
-        gpu=True
-        fw_model = faster_whisper.WhisperModel(model, device="cuda", compute_type="float16")
-    else:
-        gpu=False
-        fw_model = faster_whisper.WhisperModel(model, device="cpu", compute_type="int8")
+import numpy as np
+
+from . import audio, cache, cascade, diarize, longform, metrics, planner, registry, store
+from .transcript import Transcript
+
+# load the model through the shared registry
+def load_model(model: str, device: str, compute_type: str, cpu_threads: int = 0,
+               num_workers: int = 1) -> faster_whisper.WhisperModel:
+    """Returns a cached faster_whisper model, loading it on first use
+
+    the model is read from the model store when installed there, otherwise faster_whisper
+    downloads it into the huggingface cache unless TRANSCRIBER_OFFLINE is set
+    """
+    key = registry.whisper_key(model, device, compute_type, num_workers)
+
+    def build():
+        installed = store.require(model)
+        return faster_whisper.WhisperModel(str(installed) if installed else model,
+                                           device=device, compute_type=compute_type,
+                                           cpu_threads=cpu_threads, num_workers=num_workers,
+                                           local_files_only=store.OFFLINE)
+
+    return registry.get_model(key, build, registry.footprint('whisper', model, compute_type))
+
+# load a model before the first job asks for it
+def warm_up(model: str, cpu_threads: int = 0) -> None:
+    """Loads the model the way a short recording would, so the first job finds it resident"""
+    plan = planner.plan(model, False, cpu_threads)
+    load_model(model, plan.device, plan.compute_type, plan.cpu_threads, plan.num_workers)
+
+# beam width used for every decode, part of the transcript cache key
+BEAM_SIZE = 5
+
+# word timings let subtitles be re-segmented without decoding again, for ~10% more decoding time
+WORD_TIMESTAMPS = os.environ.get('WHISPER_WORD_TIMESTAMPS', '1') != '0'
+
+def decode(audio_file, model, eo, cpu_threads=0, long_form=False, diarization=False,
+           draft=False):
+    """Starts faster_whisper on an audio path or upload buffer and returns (segments, transcript)
+
+    segments lazily yields (segment, progress) as they are decoded, progress being the
+    fraction of the audio done, and appends each segment to transcript. With diarization
+    the speakers are labelled from the same samples once the last segment is decoded. With
+    draft a small model decodes first and model only re-decodes what it was unsure of
+    """
+    # device, precision, threads and replicas from the hardware and the model's size
+    plan = planner.plan(model, long_form, cpu_threads)
+    metrics.annotate(plan=plan._asdict())
+    fw_model = load_model(model, plan.device, plan.compute_type, plan.cpu_threads,
+                          plan.num_workers)
+    workers = plan.num_workers
 
     # Check if english only model happens
+    options = {'beam_size': BEAM_SIZE, 'vad_filter': False, 'word_timestamps': WORD_TIMESTAMPS}
     if eo == 'yes':
-        segments, _ = fw_model.transcribe(audio_file_path, language='en', beam_size=5,
-                                          vad_filter=False)
+        options['language'] = 'en'
+
+    draft_model = cascade.draft_model(model, eo) if draft else None
+    # an upload still arriving is decoded a chunk at a time as its audio comes in; the
+    # cascade compares whole recordings, it waits for the end of the upload
+    if getattr(audio_file, 'growing', False) and draft_model is None:
+        return _decode_growing(audio_file, fw_model, options, diarization)
+
+    # decode straight from the upload buffer through ffmpeg, no temporary copy
+    samples = audio.decode_audio(audio_file)
+    duration = len(samples) / audio.SAMPLE_RATE
+
+    if draft_model is not None:
+        draft_plan = planner.plan(draft_model, False, cpu_threads)
+        fw_draft = load_model(draft_model, draft_plan.device, draft_plan.compute_type,
+                              draft_plan.cpu_threads, draft_plan.num_workers)
+        transcript = Transcript([], options.get('language'), duration)
+        decoded = cascade.decode(fw_draft, fw_model, samples, transcript, draft_model, model,
+                                 **options)
+    elif long_form:
+        transcript = Transcript([], options.get('language'), duration)
+        decoded = longform.transcribe_chunks(fw_model, samples, workers, **options)
     else:
-        segments, _ = fw_model.transcribe(audio_file_path, beam_size=5, vad_filter=False)
-
-    if gpu:
-        gc.collect()
-        torch.cuda.empty_cache()
-    
-    del fw_model
-
-    # write the webvtt file
-    tr_file_path = Path(audio_file_path + '.vtt')
-    with open(tr_file_path, 'w', encoding='utf-8') as tr:
-        for i, segment in enumerate(segments, start=1):
-            if ts == 'yes':
-                tr.write(f"{i}\n{convert_seg(segment)}")
-            else:
-                tr.write(f"{segment.text.lstrip()}\n\n")
-
-    return tr_file_path
+        # faster_whisper detects the language up front and decodes lazily
+        fw_segments, info = fw_model.transcribe(samples, **options)
+        transcript = Transcript([], info.language, duration)
+        decoded = ((longform.to_segment(segment), min(segment.end / max(duration, 1e-6), 1.0))
+                   for segment in fw_segments)
+
+    def segments():
+        for segment, progress in decoded:
+            transcript.segments.append(segment)
+            yield segment, progress
+        if diarization:
+            with metrics.stage('diarize'):
+                diarize.diarize(transcript, samples)
+
+    return segments(), transcript
+
+def _decode_growing(source, fw_model, options: dict, diarization: bool):
+    """decode() of an upload still arriving, the model keeps pace with the upload"""
+    transcript = Transcript([], options.get('language'))
+    # every sample is kept for diarization, otherwise only the chunk being decoded
+    received = []
+    total = 0
+
+    def blocks():
+        nonlocal total
+        for block in audio.iter_samples(source):
+            total += len(block)
+            if diarization:
+                received.append(block)
+            yield block
+
+    def segments():
+        for segment, _ in longform.transcribe_stream(fw_model, blocks(), options):
+            transcript.language = options.get('language')
+            transcript.segments.append(segment)
+            # the share of the upload ffmpeg has read, the decoding follows close behind
+            yield segment, audio.consumed(source)
+        transcript.duration = total / audio.SAMPLE_RATE
+        if diarization:
+            samples = np.concatenate(received) if received else np.empty(0, np.float32)
+            with metrics.stage('diarize'):
+                diarize.diarize(transcript, samples)
+
+    return segments(), transcript
+
+def stream(audio_file, model, eo, cpu_threads=0, long_form=False, diarization=False,
+           draft=False):
+    """Same as decode(), replaying the transcript from the cache when decoded before"""
+    # the same recording with the same options is only decoded once
+    draft_model = cascade.draft_model(model, eo) if draft else None
+    return cache.stream(audio_file, 'faster-whisper', model,
+                        lambda: decode(audio_file, model, eo, cpu_threads, long_form,
+                                       diarization, draft),
+                        eo=eo, beam_size=BEAM_SIZE, long_form=long_form,
+                        diarization=diarization, word_timestamps=WORD_TIMESTAMPS,
+                        draft=draft_model)
+
+def transcribe(audio_file, model, eo, cpu_threads=0, long_form=False,
+               diarization=False, draft=False) -> Transcript:
+    """Uses faster_whisper to transcribe an audio path or upload buffer"""
+    segments, transcript = stream(audio_file, model, eo, cpu_threads, long_form, diarization,
+                                  draft)
+    for _ in segments:
+        pass
+
+    return transcript
@@ -0,0 +1,285 @@
+from contextlib import contextmanager
+from pathlib import Path
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from . import metrics
+
+# scratch files of the browser sessions (exports waiting to be downloaded), one directory
+# per session, only readable by the user running the app
+WORKSPACE_DIR = Path(os.environ.get('TRANSCRIBER_WORKSPACE_DIR',
+                                    Path.home().joinpath('.cache', 'offline-transcription',
+                                                         'workspaces')))
+
+# small files are kept in memory backed storage and never reach the disk, empty turns it off
+TMPFS_DIR = os.environ.get('TRANSCRIBER_WORKSPACE_TMPFS', '/dev/shm')
+SMALL_BYTES = int(float(os.environ.get('TRANSCRIBER_WORKSPACE_SMALL_MB', '1')) * (1 << 20))
+
+# memory the small files of all sessions may take, larger totals spill to the disk
+TMPFS_BYTES = int(float(os.environ.get('TRANSCRIBER_WORKSPACE_TMPFS_MB', '256')) * (1 << 20))
+
+# bytes one session may hold at once
+QUOTA_BYTES = int(float(os.environ.get('TRANSCRIBER_WORKSPACE_QUOTA_MB', '100')) * (1 << 20))
+
+# workspaces untouched this long are deleted, even when their session looks alive
+IDLE_SECONDS = float(os.environ.get('TRANSCRIBER_WORKSPACE_IDLE_HOURS', '12')) * 3600
+
+# seconds between two rounds of the reaper
+REAP_SECONDS = 60
+
+# bytes overwritten per write when a file on disk is deleted
+WIPE_CHUNK_SIZE = 1 << 20
+
+class QuotaExceeded(ValueError):
+    """Raised when a file would take a session's workspace over its quota"""
+
+# bytes held by the workspaces of this process, by storage
+_HELD = {'disk': 0, 'tmpfs': 0}
+_WORKSPACES = {}
+_LOCK = threading.Lock()
+_REAPER = None
+
+def _tmpfs_root():
+    """Returns this app's directory in the memory backed storage, or None when there is none"""
+    if not TMPFS_DIR or not os.path.isdir(TMPFS_DIR):
+        return None
+    root = Path(TMPFS_DIR).joinpath(f"offline-transcription-{os.getuid()}")
+    try:
+        root.mkdir(mode=0o700, exist_ok=True)
+        # the storage is shared by every user of the machine, never use a directory of theirs
+        if root.stat().st_uid != os.getuid():
+            return None
+    except OSError:
+        return None
+    return root
+
+def _report() -> None:
+    # copied under the lock, other sessions' threads change both while this one reports
+    with _LOCK:
+        held = dict(_HELD)
+        workspaces = list(_WORKSPACES.values())
+    for storage, size in held.items():
+        metrics.gauge('transcriber_workspace_bytes', size, storage=storage)
+    metrics.gauge('transcriber_workspaces', sum(bool(ws.files) for ws in workspaces))
+
+def _wipe(path: Path, size: int) -> None:
+    """Overwrites a file on disk with zeros before deleting it
+
+    a journaling file system or an SSD may still keep the old blocks, the workspace's
+    permissions are what protects the transcripts, this only shortens how long they last
+    """
+    try:
+        with open(path, 'r+b') as f:
+            zeros = bytes(min(size, WIPE_CHUNK_SIZE))
+            for offset in range(0, size, WIPE_CHUNK_SIZE):
+                f.write(zeros[:size - offset])
+            f.flush()
+            os.fsync(f.fileno())
+    except OSError:
+        pass
+    path.unlink(missing_ok=True)
+
+class Workspace:
+    """Scratch directory of one browser session, bounded by a quota
+
+    files below SMALL_BYTES go to the memory backed storage while it has room, the rest to
+    WORKSPACE_DIR. The workspace is deleted once its session has ended and the last
+    reference to it is released
+    """
+
+    def __init__(self, session_id: str, quota: int = QUOTA_BYTES):
+        self.session_id = session_id
+        # the directories are named apart from the session id, it is never part of a path
+        self.name = uuid.uuid4().hex
+        self.quota = quota
+        self.refs = 0
+        self.ended = False
+        self.touched = time.time()
+        # {name: (path, size, storage)}
+        self.files = {}
+        self._lock = threading.Lock()
+
+    def _directory(self, storage: str) -> Path:
+        root = _tmpfs_root() if storage == 'tmpfs' else WORKSPACE_DIR
+        if storage == 'disk':
+            root.mkdir(mode=0o700, parents=True, exist_ok=True)
+        directory = root.joinpath(self.name)
+        directory.mkdir(mode=0o700, exist_ok=True)
+        return directory
+
+    def used(self) -> int:
+        """Returns the bytes this workspace holds"""
+        return sum(size for _, size, _ in self.files.values())
+
+    def write(self, name: str, data: bytes) -> Path:
+        """Writes a file into the workspace and returns its path, replacing one of the same name
+
+        raises QuotaExceeded when the workspace would hold more than its quota
+        """
+        name = Path(name).name
+        with self._lock:
+            previous = self.files.get(name)
+            if self.used() - (previous[1] if previous else 0) + len(data) > self.quota:
+                metrics.inc('transcriber_workspace_quota_exceeded_total')
+                raise QuotaExceeded(f"{name} is too large to prepare, the files of a session "
+                                    f"are limited to {self.quota / (1 << 20):.0f} MB")
+            if previous is not None:
+                self._remove(name)
+            with _LOCK:
+                storage = 'tmpfs' if (len(data) <= SMALL_BYTES and _tmpfs_root() is not None
+                                      and _HELD['tmpfs'] + len(data) <= TMPFS_BYTES) else 'disk'
+                # reserved before writing, concurrent sessions can't overfill the memory
+                _HELD[storage] += len(data)
+            try:
+                try:
+                    path = self._store(storage, name, data)
+                except OSError:
+                    # a full memory storage (docker's /dev/shm is 64 MB) falls back to the disk
+                    if storage == 'disk':
+                        raise
+                    with _LOCK:
+                        _HELD['tmpfs'] -= len(data)
+                        _HELD['disk'] += len(data)
+                    storage = 'disk'
+                    path = self._store(storage, name, data)
+            except BaseException:
+                with _LOCK:
+                    _HELD[storage] -= len(data)
+                raise
+            self.files[name] = (path, len(data), storage)
+            self.touched = time.time()
+        _report()
+        return path
+
+    def _store(self, storage: str, name: str, data: bytes) -> Path:
+        """Writes one file, only readable by the user running the app"""
+        path = self._directory(storage).joinpath(name)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with open(fd, 'wb') as f:
+                f.write(data)
+        except BaseException:
+            path.unlink(missing_ok=True)
+            raise
+        return path
+
+    def _remove(self, name: str) -> None:
+        path, size, storage = self.files.pop(name)
+        if storage == 'disk':
+            _wipe(path, size)
+        else:
+            path.unlink(missing_ok=True)
+        with _LOCK:
+            _HELD[storage] -= size
+
+    def clear(self) -> None:
+        """Deletes every file of the workspace"""
+        with self._lock:
+            for name in list(self.files):
+                self._remove(name)
+            for root in (WORKSPACE_DIR, _tmpfs_root()):
+                if root is not None:
+                    shutil.rmtree(root.joinpath(self.name), ignore_errors=True)
+            self.touched = time.time()
+        _report()
+
+def acquire(session_id: str) -> Workspace:
+    """Returns the workspace of a session and takes a reference to it, creating it if needed"""
+    with _LOCK:
+        ws = _WORKSPACES.get(session_id)
+        if ws is None:
+            ws = _WORKSPACES[session_id] = Workspace(session_id)
+        ws.refs += 1
+        ws.touched = time.time()
+    return ws
+
+def release(ws: Workspace) -> None:
+    """Drops a reference to a workspace, deleting it with the last one once its session ended"""
+    with _LOCK:
+        ws.refs -= 1
+        delete = ws.refs <= 0 and ws.ended
+        if delete and _WORKSPACES.get(ws.session_id) is ws:
+            del _WORKSPACES[ws.session_id]
+    if delete:
+        ws.clear()
+
+@contextmanager
+def use(session_id: str):
+    """Holds a reference to the session's workspace for the block, the reaper leaves it be"""
+    ws = acquire(session_id)
+    try:
+        yield ws
+    finally:
+        release(ws)
+
+def end(session_id: str) -> None:
+    """Marks a session as ended, its workspace goes when nothing uses it any more"""
+    with _LOCK:
+        ws = _WORKSPACES.get(session_id)
+        if ws is None:
+            return
+        ws.ended = True
+        ws.refs += 1
+    # released like any other reference, whoever releases last deletes the files
+    release(ws)
+
+def reap(alive=None) -> int:
+    """Ends the workspaces of sessions that are gone or idle and removes orphaned directories
+
+    alive(session_id) tells whether a session is still open; directories no workspace of
+    this process owns, left by a stopped server, are removed once idle. Returns the number
+    of workspaces ended
+    """
+    now = time.time()
+    with _LOCK:
+        workspaces = list(_WORKSPACES.values())
+    ended = 0
+    for ws in workspaces:
+        if ws.ended or ws.refs:
+            continue
+        try:
+            gone = alive is not None and not alive(ws.session_id)
+        except Exception:
+            # an unknown session is only ended once idle
+            gone = False
+        if gone or now - ws.touched > IDLE_SECONDS:
+            end(ws.session_id)
+            ended += 1
+    if ended:
+        metrics.inc('transcriber_workspace_reaped_total', ended)
+
+    with _LOCK:
+        owned = {ws.name for ws in _WORKSPACES.values()}
+    for root in (WORKSPACE_DIR, _tmpfs_root()):
+        if root is None or not root.is_dir():
+            continue
+        for directory in root.iterdir():
+            try:
+                if directory.name not in owned and now - directory.stat().st_mtime > IDLE_SECONDS:
+                    shutil.rmtree(directory, ignore_errors=True)
+            except OSError:
+                pass
+    _report()
+    return ended
+
+def start_reaper(alive=None) -> None:
+    """Starts the reaper thread once per process"""
+    global _REAPER
+    with _LOCK:
+        if _REAPER is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(REAP_SECONDS)
+                try:
+                    reap(alive)
+                except Exception:
+                    # the next round tries again, the reaper must never stop
+                    pass
+
+        _REAPER = threading.Thread(target=loop, name='workspace-reaper', daemon=True)
+        _REAPER.start()
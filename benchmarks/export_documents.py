@@ -0,0 +1,76 @@
+"""Benchmark of the pdf and docx exporters on a synthetic transcript of 100k segments
+
+Run from the repository root:
+
+    python benchmarks/export_documents.py --segments 100000
+
+Reports the time and the peak of python memory allocations of each exporter, and the size of
+the file it wrote. Exits with status 1 when an exporter allocates more than --budget-mb.
+"""
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+from export_formats import synthetic_transcript
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1].joinpath('app')))
+
+EXPORTERS = ['pdf', 'docx']
+
+# each converter is imported in its own branch, pdf needs reportlab and docx nothing more
+def exporter(extension: str):
+    """Returns the convert function of an exporter"""
+    if extension == 'pdf':
+        from converters import vtt2pdf
+        return vtt2pdf.convert
+    from converters import vtt2docx
+    return vtt2docx.convert
+
+def bench(transcript, extension: str, directory: Path, ts: str) -> dict:
+    """Exports the transcript once, measuring time and peak allocations"""
+    convert = exporter(extension)
+    tracemalloc.start()
+    start = time.perf_counter()
+    path = convert(directory.joinpath('transcript.vtt'), transcript, ts)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'seconds': round(seconds, 3),
+        'peak_mb': round(peak / 1024 ** 2, 1),
+        'file_mb': round(path.stat().st_size / 1024 ** 2, 2),
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--segments', type=int, default=100000)
+    parser.add_argument('--ts', default='yes', choices=['yes', 'no'])
+    parser.add_argument('--formats', nargs='+', default=EXPORTERS, choices=EXPORTERS)
+    parser.add_argument('--budget-mb', type=float, default=200.0,
+                        help='maximum peak of python allocations per exporter')
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    # three second segments, as in export_formats.py
+    transcript = synthetic_transcript(args.segments * 3.0 / 3600)
+    results = {}
+    with TemporaryDirectory() as directory:
+        for extension in args.formats:
+            results[extension] = bench(transcript, extension, Path(directory), args.ts)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{len(transcript)} segments")
+        for extension, result in results.items():
+            print(f"{extension:>5}: {result['seconds']:8.3f} s  peak {result['peak_mb']:7.1f} MB"
+                  f"  file {result['file_mb']:.2f} MB")
+
+    over = [ext for ext, result in results.items() if result['peak_mb'] > args.budget_mb]
+    if over:
+        print(f"over budget ({args.budget_mb} MB): {', '.join(over)}")
+        sys.exit(1)
@@ -0,0 +1,78 @@
+"""Benchmark of the text exporters on a synthetic 10 hour transcript
+
+Run from the repository root:
+
+    python benchmarks/export_formats.py --hours 10 --budget-ms 50
+
+Exits with status 1 when a format takes longer than the budget per thousand segments.
+"""
+from pathlib import Path
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1].joinpath('app')))
+
+from converters import formats
+from transcribers.transcript import Segment, Transcript
+
+# build a transcript that looks like whisper output, with word timings
+def synthetic_transcript(hours: float, segment_seconds: float = 3.0,
+                         words_per_segment: int = 8) -> Transcript:
+    """Returns a transcript covering the given hours of audio"""
+    vocabulary = ['the', 'lecture', 'covers', 'offline', 'speech', 'recognition', 'today', 'and']
+    segments = []
+    start = 0.0
+    word_seconds = segment_seconds / words_per_segment
+    while start < hours * 3600:
+        words = [(start + i * word_seconds, start + (i + 1) * word_seconds,
+                  vocabulary[i % len(vocabulary)]) for i in range(words_per_segment)]
+        segments.append(Segment(start, start + segment_seconds,
+                                ' '.join(word for _, _, word in words), words))
+        start += segment_seconds
+    return Transcript(segments, 'en', start)
+
+def bench(transcript: Transcript, extension: str, repeats: int) -> float:
+    """Returns the best time in seconds to export the transcript"""
+    best = float('inf')
+    for _ in range(repeats):
+        with open(os.devnull, 'w', encoding='utf-8') as sink:
+            start = time.perf_counter()
+            formats.write(transcript, sink, extension)
+            best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--hours', type=float, default=10.0)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--budget-ms', type=float, default=50.0,
+                        help='maximum milliseconds per thousand segments')
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    transcript = synthetic_transcript(args.hours)
+    results = {}
+    for extension in formats.WRITERS:
+        seconds = bench(transcript, extension, args.repeats)
+        results[extension] = {
+            'segments': len(transcript),
+            'seconds': round(seconds, 4),
+            'ms_per_1000_segments': round(seconds * 1000 / (len(transcript) / 1000), 3),
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{len(transcript)} segments ({args.hours:g} h)")
+        for extension, result in results.items():
+            print(f"{extension:>5}: {result['seconds']:8.4f} s  "
+                  f"{result['ms_per_1000_segments']:7.3f} ms / 1000 segments")
+
+    over = [ext for ext, result in results.items()
+            if result['ms_per_1000_segments'] > args.budget_ms]
+    if over:
+        print(f"over budget ({args.budget_ms} ms / 1000 segments): {', '.join(over)}")
+        sys.exit(1)
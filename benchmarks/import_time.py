@@ -0,0 +1,90 @@
+"""Import time of what the streamlit pages load on every script run
+
+Run from the repository root:
+
+    python benchmarks/import_time.py --budget-ms 150
+
+Each measurement runs in a fresh interpreter. Exits with status 1 when the app's own modules
+of any page take longer than the budget to import, or when they pull in a backend or
+exporter library (torch, faster_whisper, ctranslate2, vosk, numpy, reportlab, docx) that
+should only load on first use.
+"""
+from pathlib import Path
+import argparse
+import json
+import subprocess
+import sys
+
+APP = Path(__file__).resolve().parents[1].joinpath('app')
+
+# the app's imports at the top of each page, keep in step with the pages; streamlit itself is
+# measured apart
+PAGE_IMPORTS = {
+    'main.py': ['converters.formats', 'transcribers.jobs', 'transcribers.library',
+                'transcribers.metrics', 'transcribers.resegment', 'transcribers.uploads',
+                'transcribers.workspace'],
+    'main_multiupload.py': ['converters.archive', 'transcribers.batch', 'transcribers.jobs',
+                            'transcribers.library', 'transcribers.metrics'],
+    'main_search.py': ['converters.formats', 'transcribers.library'],
+}
+
+HEAVY = ['torch', 'faster_whisper', 'ctranslate2', 'vosk', 'numpy', 'reportlab', 'docx']
+
+CHILD = """
+import importlib, json, sys, time
+sys.path.insert(0, %r)
+start = time.perf_counter()
+for name in %r:
+    importlib.import_module(name)
+print(json.dumps({'seconds': time.perf_counter() - start,
+                  'heavy': [name for name in %r if name in sys.modules]}))
+"""
+
+def measure(modules: list, repeats: int) -> dict:
+    """Returns the best import time of the modules in a fresh interpreter, and what they loaded"""
+    best = None
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', CHILD % (str(APP), modules, HEAVY)],
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output)
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+    return best
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=150.0,
+                        help="maximum milliseconds to import the app's own modules")
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    results = {page: measure(modules, args.repeats) for page, modules in PAGE_IMPORTS.items()}
+    modules = sorted({name for names in PAGE_IMPORTS.values() for name in names})
+    for name in modules + ['streamlit']:
+        try:
+            results[name] = measure([name], args.repeats)
+        except subprocess.CalledProcessError as e:
+            results[name] = {'error': e.stderr.strip().splitlines()[-1]}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, result in results.items():
+            if 'error' in result:
+                print(f"{name:>22}: {result['error']}")
+            else:
+                heavy = ', '.join(result['heavy']) or 'none'
+                print(f"{name:>22}: {result['seconds'] * 1000:8.1f} ms  heavy modules: {heavy}")
+
+    failed = False
+    for page in PAGE_IMPORTS:
+        result = results[page]
+        if result['seconds'] * 1000 > args.budget_ms:
+            print(f"{page} over budget: {result['seconds'] * 1000:.1f} ms > {args.budget_ms} ms")
+            failed = True
+        if result['heavy']:
+            print(f"{page} imports at startup: {', '.join(result['heavy'])}")
+            failed = True
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,211 @@
+"""Benchmark suite: model load time, real-time factor, peak memory and export cost per model
+
+Run from the repository root on a CPU-only machine with the small models:
+
+    python benchmarks/suite.py --models tiny,vosk-small --minutes 0.5,2 --output results.json
+    python benchmarks/suite.py --baseline results.json --tolerance 0.2
+
+Each model runs in a fresh process so its load time and peak RSS are not hidden by the models
+measured before it. The transcript cache is disabled. Recordings given with --audio are used
+as they are, otherwise synthetic ones of the requested lengths are generated.
+
+With --baseline the run is compared with an earlier results file and exits with status 1 when
+a real-time factor, load time or export time got slower by more than the tolerance.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from importlib import metadata
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+from synthetic import synthetic_wav
+
+REPOSITORY = Path(__file__).resolve().parents[1]
+
+# every run records what it ran on, results are only comparable on the same machine
+def environment() -> dict:
+    """Returns the machine, python and backend versions of this run"""
+    versions = {}
+    for package in ('faster-whisper', 'ctranslate2', 'vosk', 'reportlab'):
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPOSITORY,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'packages': versions,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+def _peak_rss_mb() -> float:
+    """Returns the peak resident memory of this process in MB"""
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _export_times(transcript, directory: Path, repeats: int) -> dict:
+    """Returns the best time in seconds of every exporter on the transcript"""
+    from converters import formats, vtt2docx, vtt2pdf
+
+    exporters = {'pdf': vtt2pdf.convert, 'docx': vtt2docx.convert}
+    for extension in formats.WRITERS:
+        exporters[extension] = (lambda file, transcript, ts, extension=extension:
+                                formats.convert(file, transcript, extension, ts))
+
+    transcript_file = directory.joinpath('export.vtt')
+    times = {}
+    for extension, convert in exporters.items():
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            convert(transcript_file, transcript, 'yes')
+            best = min(best, time.perf_counter() - start)
+        times[extension] = round(best, 4)
+    return times
+
+# ------------------------- child process side -------------------------
+def run_model(model: str, recordings: list, repeats: int, export_repeats: int) -> dict:
+    """Measures one model in this (fresh) process and returns its results"""
+    # measure decoding, not the cache, and import the backends only after that is set
+    os.environ['TRANSCRIPT_CACHE'] = '0'
+    from transcribers import registry
+    if model[0:4] == 'vosk':
+        from transcribers import vosk as backend
+    else:
+        from transcribers import whisper as backend
+
+    result = {'model': model, 'rss_before_load_mb': round(_peak_rss_mb(), 1), 'runs': []}
+
+    # the first transcription loads the model, the registry times the load on its own
+    path, duration = recordings[0]
+    start = time.perf_counter()
+    transcript = backend.transcribe(path, model, 'yes')
+    result['first_transcription_seconds'] = round(time.perf_counter() - start, 3)
+    result['load_seconds'] = round(registry.stats()['load_seconds'], 3)
+    result['rss_after_load_mb'] = round(_peak_rss_mb(), 1)
+
+    for path, duration in recordings:
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            transcript = backend.transcribe(path, model, 'yes')
+            best = min(best, time.perf_counter() - start)
+        result['runs'].append({
+            'audio': Path(path).name,
+            'duration': round(duration, 2),
+            'seconds': round(best, 3),
+            'rtf': round(best / duration, 4),
+            'segments': len(transcript),
+        })
+    result['peak_rss_mb'] = round(_peak_rss_mb(), 1)
+
+    # the exporters run on the transcript of the longest recording
+    with TemporaryDirectory() as directory:
+        result['export_seconds'] = _export_times(transcript, Path(directory), export_repeats)
+        result['export_segments'] = len(transcript)
+    return result
+
+# ------------------------- comparison with a baseline -------------------------
+def regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    """Returns a description of every measurement slower than the baseline by the tolerance"""
+    found = []
+
+    def check(name, new, old):
+        if new is not None and old and new > old * (1 + tolerance):
+            found.append(f"{name}: {old} -> {new} (+{(new / old - 1):.0%})")
+
+    old_models = {entry['model']: entry for entry in baseline.get('models', [])}
+    for entry in results['models']:
+        old = old_models.get(entry['model'])
+        if old is None or 'error' in entry or 'error' in old:
+            continue
+        check(f"{entry['model']} load_seconds", entry['load_seconds'], old['load_seconds'])
+        old_runs = {run['audio']: run for run in old['runs']}
+        for run in entry['runs']:
+            if run['audio'] in old_runs:
+                check(f"{entry['model']} rtf {run['audio']}", run['rtf'],
+                      old_runs[run['audio']]['rtf'])
+        for extension, seconds in entry['export_seconds'].items():
+            check(f"{entry['model']} export {extension}", seconds,
+                  old['export_seconds'].get(extension))
+    return found
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--models', default='tiny,vosk-small',
+                        help='comma separated models, as named in the webapp')
+    parser.add_argument('--minutes', default='0.5,2',
+                        help='comma separated lengths of the synthetic recordings')
+    parser.add_argument('--audio', nargs='*', default=[],
+                        help='recordings to use instead of synthetic audio')
+    parser.add_argument('--repeats', type=int, default=1,
+                        help='timed transcriptions per recording, the best is kept')
+    parser.add_argument('--export-repeats', type=int, default=3)
+    parser.add_argument('--output', help='write the results as json to this file')
+    parser.add_argument('--baseline', help='earlier results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown against the baseline, 0.2 is 20%%')
+    args = parser.parse_args()
+
+    results = {'environment': environment(), 'models': []}
+    with TemporaryDirectory() as directory:
+        if args.audio:
+            from transcribers import audio
+            recordings = [(str(Path(path).resolve()), audio.probe_duration(path))
+                          for path in args.audio]
+        else:
+            recordings = []
+            for minutes in map(float, args.minutes.split(',')):
+                path = Path(directory).joinpath(f"synthetic-{minutes:g}min.wav")
+                recordings.append((str(path), synthetic_wav(path, minutes)))
+        recordings.sort(key=lambda recording: recording[1])
+
+        # a fresh process per model, so peak memory and load time are the model's own
+        context = multiprocessing.get_context('spawn')
+        for model in args.models.split(','):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                try:
+                    entry = pool.submit(run_model, model, recordings, args.repeats,
+                                        args.export_repeats).result()
+                except Exception as e:
+                    entry = {'model': model, 'error': str(e)}
+            results['models'].append(entry)
+
+            if 'error' in entry:
+                print(f"{model}: failed, {entry['error']}", file=sys.stderr)
+                continue
+            print(f"{model}: load {entry['load_seconds']:.2f} s, "
+                  f"peak rss {entry['peak_rss_mb']:.0f} MB")
+            for run in entry['runs']:
+                print(f"  {run['audio']:>24}: {run['duration']:7.1f} s of audio  "
+                      f"rtf {run['rtf']:.4f}")
+            print('  exports: ' + ', '.join(f"{extension} {seconds * 1000:.1f} ms"
+                                            for extension, seconds
+                                            in entry['export_seconds'].items()))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        if found:
+            print(f"slower than {args.baseline}:\n  " + '\n  '.join(found))
+            sys.exit(1)
@@ -0,0 +1,29 @@
+"""Synthetic recordings shared by the benchmark scripts"""
+from pathlib import Path
+import sys
+import wave
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1].joinpath('app')))
+
+from transcribers import audio
+
+# a recording with pauses, so the silence splitting has something to split on
+def synthetic_wav(path: Path, minutes: float, seed: int = 0) -> float:
+    """Writes a 16 kHz mono wav of noise bursts and silences, returns its duration"""
+    rng = np.random.default_rng(seed)
+    pieces = []
+    total = 0
+    while total < minutes * 60 * audio.SAMPLE_RATE:
+        burst = rng.normal(0, 0.2, int(rng.uniform(1, 8) * audio.SAMPLE_RATE))
+        pause = np.zeros(int(rng.uniform(0.6, 2) * audio.SAMPLE_RATE))
+        pieces += [burst, pause]
+        total += len(burst) + len(pause)
+    samples = (np.clip(np.concatenate(pieces), -1, 1) * 32767).astype('<i2')
+    with wave.open(str(path), 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(audio.SAMPLE_RATE)
+        wav.writeframes(samples.tobytes())
+    return len(samples) / audio.SAMPLE_RATE
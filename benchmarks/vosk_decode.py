@@ -0,0 +1,91 @@
+"""Real-time factor of the vosk decoding loop: the original loop against the tuned pipeline
+
+Run from the repository root with ffmpeg and a vosk model available:
+
+    python benchmarks/vosk_decode.py --model vosk-small --audio lecture.mp3
+
+Without --audio a synthetic recording of bursts of noise separated by silences is used.
+The real-time factor is decoding time divided by audio duration, lower is faster.
+"""
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1].joinpath('app')))
+
+from synthetic import synthetic_wav
+from transcribers import audio, vosk
+
+# the loop vosk.transcribe used before the tuned pipeline
+def legacy(audio_path: str, model: str) -> int:
+    """4000 byte reads, results kept as json strings and parsed after decoding"""
+    rec = vosk.KaldiRecognizer(vosk.load_model(model), audio.SAMPLE_RATE)
+    rec.SetWords(True)
+    command = ["ffmpeg", "-nostdin", "-loglevel", "quiet", "-i", audio_path,
+               "-ar", str(audio.SAMPLE_RATE), "-ac", "1", "-f", "s16le", "-"]
+    with subprocess.Popen(command, stdout=subprocess.PIPE) as process:
+        results = []
+        while True:
+            data = process.stdout.read(4000)
+            if len(data) == 0:
+                break
+            if rec.AcceptWaveform(data):
+                results.append(rec.Result())
+        results.append(rec.FinalResult())
+    return sum(1 for res in results if json.loads(res).get("result"))
+
+def tuned(audio_path: str, model: str, workers: int, read_size: int) -> int:
+    """The current pipeline, bypassing the transcript cache"""
+    segments, transcript = vosk.decode(audio_path, model, 'yes', workers, read_size)
+    for _ in segments:
+        pass
+    return len(transcript)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model', default='vosk-small', choices=['vosk-small', 'vosk-large'])
+    parser.add_argument('--audio', help='recording to decode, synthetic when omitted')
+    parser.add_argument('--minutes', type=float, default=5.0,
+                        help='length of the synthetic recording')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--read-size', type=int, default=vosk.READ_SIZE)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    with NamedTemporaryFile(suffix='.wav') as temp:
+        if args.audio:
+            audio_path = args.audio
+            duration = audio.probe_duration(audio_path)
+        else:
+            audio_path = temp.name
+            duration = synthetic_wav(Path(audio_path), args.minutes)
+
+        # load the model once so every variant measures decoding only
+        vosk.load_model(args.model)
+
+        variants = {
+            'legacy': lambda: legacy(audio_path, args.model),
+            'sequential': lambda: tuned(audio_path, args.model, 1, args.read_size),
+            f'parallel-{args.workers}': lambda: tuned(audio_path, args.model, args.workers,
+                                                      args.read_size),
+        }
+        results = {}
+        for name, run in variants.items():
+            start = time.perf_counter()
+            segments = run()
+            elapsed = time.perf_counter() - start
+            results[name] = {'seconds': round(elapsed, 3), 'rtf': round(elapsed / duration, 4),
+                             'segments': segments}
+
+    if args.json:
+        print(json.dumps({'duration': duration, 'results': results}, indent=2))
+    else:
+        print(f"{duration:.1f} s of audio, model {args.model}")
+        for name, result in results.items():
+            speedup = results['legacy']['seconds'] / max(result['seconds'], 1e-9)
+            print(f"{name:>12}: {result['seconds']:8.3f} s  rtf {result['rtf']:.4f}  "
+                  f"x{speedup:.2f}  ({result['segments']} segments)")
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the app imports its packages as top-level modules, as streamlit runs it from app/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.joinpath('app')))
@@ -0,0 +1,17 @@
+from converters.archive import member_names
+
+def test_member_names_keep_the_stems():
+    assert member_names(['a.mp3', 'b.wav'], 'vtt') == ['a.vtt', 'b.vtt']
+
+def test_member_names_number_duplicates():
+    assert member_names(['a.mp3', 'a.wav', 'A.mp4'], 'srt') == ['a.srt', 'a (2).srt',
+                                                                'A (3).srt']
+
+def test_member_names_skip_names_already_taken():
+    names = member_names(['a.mp3', 'a (2).mp3', 'a.mp3', 'a.mp3'], 'vtt')
+    assert names == ['a.vtt', 'a (2).vtt', 'a (3).vtt', 'a (4).vtt']
+    assert len(set(names)) == len(names)
+
+def test_member_names_drop_directories():
+    assert member_names(['../x/a.mp3', 'c:\\d\\b.mp3', ''], 'txt') == ['a.txt', 'b.txt',
+                                                                       'transcript.txt']
@@ -0,0 +1,31 @@
+import os
+import time
+
+from transcribers.cache import TranscriptCache
+
+def test_purge_leaves_other_json_files(tmp_path):
+    manifest = tmp_path.joinpath('models', 'manifest.json')
+    manifest.parent.mkdir()
+    manifest.write_text('{}')
+    entry = tmp_path.joinpath('ab', 'ab' + '0' * 62 + '.json')
+    entry.parent.mkdir()
+    entry.write_text('{}')
+    old = time.time() - 3600
+    for path in (manifest, entry):
+        os.utime(path, (old, old))
+
+    TranscriptCache(tmp_path, max_bytes=0, ttl_seconds=60).purge()
+    assert manifest.exists()
+    assert not entry.exists()
+
+def test_get_survives_an_entry_purged_while_reading(tmp_path, monkeypatch):
+    cache = TranscriptCache(tmp_path)
+    key = 'cd' + '1' * 62
+    path = cache._path(key)
+    path.parent.mkdir()
+    path.write_text('{"segments": []}')
+
+    def purged(*args):
+        raise FileNotFoundError(path)
+    monkeypatch.setattr(os, 'utime', purged)
+    assert cache.get(key) is not None
@@ -0,0 +1,18 @@
+from pathlib import Path
+
+from cli import output_stems
+
+def test_output_stems_next_to_the_recordings():
+    inputs = [Path('/r/a/x.mp3'), Path('/r/b/y.wav')]
+    assert output_stems(inputs) == {inputs[0]: Path('/r/a/x'), inputs[1]: Path('/r/b/y')}
+
+def test_output_stems_keep_the_tree_under_output_dir():
+    inputs = [Path('/r/a/x.mp3'), Path('/r/b/x.mp3')]
+    assert output_stems(inputs, '/out') == {inputs[0]: Path('/out/a/x'),
+                                            inputs[1]: Path('/out/b/x')}
+
+def test_output_stems_keep_the_extension_of_shared_stems():
+    inputs = [Path('/r/x.mp3'), Path('/r/x.wav'), Path('/r/y.wav')]
+    assert output_stems(inputs, '/out') == {inputs[0]: Path('/out/x.mp3'),
+                                            inputs[1]: Path('/out/x.wav'),
+                                            inputs[2]: Path('/out/y')}
@@ -0,0 +1,17 @@
+import json
+
+import numpy as np
+
+from converters import formats
+from transcribers.transcript import Segment, Transcript
+
+def test_json_writes_numpy_times_as_numbers():
+    transcript = Transcript([Segment(np.float64(1.5), np.float32(2.25), 'hello')], 'en', 2.25)
+    document = json.loads(formats.render(transcript, 'json'))
+    assert document['segments'][0]['start'] == 1.5
+    assert document['segments'][0]['end'] == 2.25
+
+def test_vtt_escapes_cue_text():
+    transcript = Transcript([Segment(0, 1, 'a < b & c --> d', speaker='<A&B>')], 'en', 1)
+    vtt = formats.render(transcript, 'vtt').decode('utf-8')
+    assert '<v &lt;A&amp;B&gt;>a &lt; b &amp; c --&gt; d\n' in vtt
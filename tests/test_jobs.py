@@ -0,0 +1,40 @@
+import io
+
+import pytest
+
+from transcribers import audio, jobs
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(audio, 'probe_duration', lambda path: 1.0)
+    return jobs.JobQueue(tmp_path)
+
+def files(count):
+    return [(io.BytesIO(b'audio'), f"{i}.mp3") for i in range(count)]
+
+def test_batch_takes_one_place_in_the_queue(queue, monkeypatch):
+    monkeypatch.setattr(jobs, 'MAX_PENDING_PER_SESSION', 2)
+    ids = queue.submit_batch(files(30), 'base', {'eo': 'yes'}, 'a')
+    assert len(ids) == 30
+    queue.submit(io.BytesIO(b'audio'), 'x.mp3', 'base', {'eo': 'yes'}, 'a')
+    with pytest.raises(jobs.QueueFull):
+        queue.submit(io.BytesIO(b'audio'), 'y.mp3', 'base', {'eo': 'yes'}, 'a')
+
+def test_refused_batch_queues_nothing(queue, monkeypatch):
+    monkeypatch.setattr(jobs, 'MAX_BATCH_FILES', 3)
+    with pytest.raises(jobs.QueueFull):
+        queue.submit_batch(files(4), 'base', {'eo': 'yes'}, 'a')
+    assert queue.pending_inputs() == []
+    assert list(queue.inputs.iterdir()) == []
+
+def test_job_killing_its_workers_fails_after_the_attempts(queue, monkeypatch):
+    monkeypatch.setattr(jobs, 'MAX_ATTEMPTS', 2)
+    monkeypatch.setattr(jobs, '_alive', lambda pid: False)
+    job_id = queue.submit(io.BytesIO(b'audio'), 'x.mp3', 'base', {'eo': 'yes'}, 'a')
+    for _ in range(2):
+        assert queue.claim(1)['id'] == job_id
+        queue.requeue_orphans()
+    job = queue.get(job_id)
+    assert job['status'] == jobs.FAILED
+    assert job['attempts'] == 2
+    assert queue.pending_inputs() == []
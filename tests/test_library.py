@@ -0,0 +1,32 @@
+import time
+
+import pytest
+
+from transcribers.library import Library
+from transcribers.transcript import Segment, Transcript
+
+@pytest.fixture
+def library(tmp_path):
+    return Library(tmp_path.joinpath('library.sqlite3'))
+
+def test_purge_removes_transcripts_past_the_retention(library):
+    old = library.add(Transcript([Segment(0, 1, 'old words')]), 'old.mp3')
+    library.add(Transcript([Segment(0, 1, 'new words')]), 'new.mp3')
+    with library._connect() as db:
+        db.execute("UPDATE transcripts SET added = ? WHERE id = ?", (time.time() - 7200, old))
+
+    assert library.purge(3600) == 1
+    assert [result['name'] for result in library.search('words')] == ['new.mp3']
+    assert library.purge(0) == 0
+
+def test_failed_remove_leaves_no_transaction_open(library, monkeypatch):
+    kept = library.add(Transcript([Segment(0, 1, 'words')]), 'a.mp3')
+
+    def broken(db, transcript_id=None, job_id=None):
+        raise RuntimeError('disk gone')
+    monkeypatch.setattr(library, '_delete', broken)
+    with pytest.raises(RuntimeError):
+        library.remove(kept)
+    monkeypatch.undo()
+    library.remove(kept)
+    assert library.get(kept) is None
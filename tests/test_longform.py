@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from transcribers import longform
+
+SAMPLE_RATE = 16000
+
+class Model:
+    """Returns one segment per chunk and records what was read when it was called"""
+
+    def __init__(self, read):
+        self.read = read
+        self.calls = []
+
+    def transcribe(self, samples, **options):
+        self.calls.append((self.read[0], options.get('language')))
+        segment = SimpleNamespace(start=0.0, end=len(samples) / SAMPLE_RATE, text='x',
+                                  words=None)
+        return iter([segment]), SimpleNamespace(language='fr')
+
+def test_stream_decodes_while_the_audio_arrives():
+    # five minutes of 8 s of noise followed by 2 s of silence
+    noise = np.random.default_rng(0).standard_normal(8 * SAMPLE_RATE).astype(np.float32)
+    audio = np.tile(np.concatenate((noise * 0.3, np.zeros(2 * SAMPLE_RATE, np.float32))), 30)
+    read = [0]
+
+    def blocks():
+        for start in range(0, len(audio), SAMPLE_RATE * 10):
+            read[0] = start + SAMPLE_RATE * 10
+            yield audio[start:start + SAMPLE_RATE * 10]
+
+    model = Model(read)
+    options = {}
+    segments = [segment for segment, _ in longform.transcribe_stream(model, blocks(), options)]
+
+    assert model.calls[0][0] < len(audio)
+    assert options['language'] == 'fr'
+    assert [language for _, language in model.calls[1:]] == ['fr'] * (len(model.calls) - 1)
+    assert all(a.end <= b.start for a, b in zip(segments, segments[1:]))
+    assert segments[-1].end > 290
@@ -0,0 +1,9 @@
+from transcribers import metrics
+
+def test_labels_escape_the_text_format():
+    labels = (('file', 'a\\b "c"\nd'),)
+    assert metrics._labels(labels) == '{file="a\\\\b \\"c\\"\\nd"}'
+
+def test_write_textfile_leaves_no_temporary_file(tmp_path):
+    metrics.write_textfile(tmp_path)
+    assert [path.name for path in tmp_path.iterdir()] == ['metrics.prom']
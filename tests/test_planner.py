@@ -0,0 +1,28 @@
+import pytest
+
+from transcribers import planner, registry
+
+@pytest.fixture(autouse=True)
+def cpu_only(monkeypatch):
+    monkeypatch.setattr(planner, 'gpu_count', lambda: 0)
+    monkeypatch.setattr(planner, 'cpu_count', lambda: 16)
+    monkeypatch.setattr(planner, 'supported_compute_types', lambda device: {'int8', 'float32'})
+    monkeypatch.setattr(planner, 'RAM_HEADROOM_GB', 1.0)
+
+def test_cpu_plan_refuses_a_model_larger_than_the_free_memory(monkeypatch):
+    monkeypatch.setattr(planner, 'ram_available_gb', lambda: 1.5)
+    with pytest.raises(planner.ModelTooLarge):
+        planner.plan('large-v2')
+    assert planner.plan('tiny').device == 'cpu'
+
+def test_loaded_model_compares_the_replicas(monkeypatch):
+    monkeypatch.setattr(registry, 'stats',
+                        lambda: {'models': [list(registry.whisper_key('small', 'cpu', 'int8'))]})
+    assert planner._loaded('small', 'cpu', 'int8')
+    assert not planner._loaded('small', 'cpu', 'int8', 4)
+    assert not planner._loaded('small.en', 'cpu', 'int8')
+
+def test_long_form_replicas_are_bounded_by_the_free_memory(monkeypatch):
+    size = registry.footprint('whisper', 'medium', 'int8')
+    monkeypatch.setattr(planner, 'ram_available_gb', lambda: 1.0 + 2.5 * size)
+    assert planner.plan('medium', long_form=True).num_workers == 2
@@ -0,0 +1,20 @@
+import io
+
+from transcribers import uploads
+
+def test_origin_of_the_app_host_is_allowed():
+    assert uploads.allowed_origin('http://host:8501', 'host:8502') == 'http://host:8501'
+    assert uploads.allowed_origin('http://[::1]:8501', '[::1]:8502') == 'http://[::1]:8501'
+
+def test_other_sites_are_not_allowed():
+    assert uploads.allowed_origin('https://evil.example', 'host:8502') is None
+    assert uploads.allowed_origin('null', 'host:8502') is None
+    assert uploads.allowed_origin('', 'host:8502') is None
+
+def test_lock_is_released_when_the_upload_completes(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, 'UPLOADS_DIR', tmp_path)
+    upload_id = uploads.create()
+    uploads.write_chunk(upload_id, 'bytes 0-2/6', 'a.mp3', io.BytesIO(b'abc'), 3)
+    assert upload_id in uploads._LOCKS
+    assert uploads.write_chunk(upload_id, 'bytes 3-5/6', 'a.mp3', io.BytesIO(b'def'), 3) == 6
+    assert upload_id not in uploads._LOCKS